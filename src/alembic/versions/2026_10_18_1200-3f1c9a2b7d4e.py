@@ -0,0 +1,43 @@
+"""users filter and ordering indexes
+
+Revision ID: 3f1c9a2b7d4e
+Revises: 576b97f4884e
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "3f1c9a2b7d4e"
+down_revision = "576b97f4884e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_users_lower_email", "users", [sa.text("lower(email)")])
+    op.create_index(
+        "ix_users_name_pattern",
+        "users",
+        ["name"],
+        postgresql_ops={"name": "varchar_pattern_ops"},
+    )
+    op.create_index(
+        "ix_users_surname_pattern",
+        "users",
+        ["surname"],
+        postgresql_ops={"surname": "varchar_pattern_ops"},
+    )
+    op.create_index("ix_users_name_id", "users", ["name", "id"])
+    op.create_index("ix_users_surname_id", "users", ["surname", "id"])
+    op.create_index("ix_users_birthday_id", "users", ["birthday", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_users_birthday_id", table_name="users")
+    op.drop_index("ix_users_surname_id", table_name="users")
+    op.drop_index("ix_users_name_id", table_name="users")
+    op.drop_index("ix_users_surname_pattern", table_name="users")
+    op.drop_index("ix_users_name_pattern", table_name="users")
+    op.drop_index("ix_users_lower_email", table_name="users")
@@ -0,0 +1,41 @@
+"""users trigram search indexes
+
+Revision ID: 8b2e4d6f1a9c
+Revises: 3f1c9a2b7d4e
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "8b2e4d6f1a9c"
+down_revision = "3f1c9a2b7d4e"
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    "ix_users_name_trgm": "name",
+    "ix_users_surname_trgm": "surname",
+    "ix_users_email_trgm": "email",
+}
+
+
+def upgrade() -> None:
+    # поиск требует расширения pg_trgm (входит в contrib и есть в образе postgres).  Если
+    # оно недоступно, то миграция должна упасть, а не оставить схему без индексов из models
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    for name, column in INDEXES.items():
+        op.create_index(
+            name,
+            "users",
+            [column],
+            postgresql_using="gin",
+            postgresql_ops={column: "gin_trgm_ops"},
+        )
+
+
+def downgrade() -> None:
+    # расширение не удаляется, тк им может пользоваться что-то еще
+    for name in reversed(INDEXES):
+        op.drop_index(name, table_name="users")
@@ -0,0 +1,34 @@
+"""users source key
+
+Revision ID: c4a7e1f93b26
+Revises: 8b2e4d6f1a9c
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c4a7e1f93b26"
+down_revision = "8b2e4d6f1a9c"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column(
+            "source_key",
+            sa.String(length=255),
+            nullable=True,
+            comment="Ключ сообщения, из которого создан пользователь.  "
+            "Уникален, чтобы повторная загрузка сообщения не создавала дубликат",
+        ),
+    )
+    op.create_index("uq_users_source_key", "users", ["source_key"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("uq_users_source_key", table_name="users")
+    op.drop_column("users", "source_key")
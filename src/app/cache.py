@@ -0,0 +1,158 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from app.config import settings
+
+
+class LRUCache:
+    """Кэш в памяти процесса.
+
+    Количество записей ограничено, при переполнении вытесняются давно не использованные записи.
+    Записи старше ttl секунд считаются отсутствующими
+
+    Notes:
+        Кэш у каждого процесса свой, поэтому изменения, сделанные другим процессом, видны
+        не позже чем через ttl секунд
+
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._loading: dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Возвращает значение из кэша.
+
+        Args:
+            key: ключ
+            default: значение, если записи нет или она устарела
+
+        """
+
+        item = self._data.get(key)
+
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение в кэш.
+
+        Args:
+            key: ключ
+            value: значение
+
+        """
+
+        self._data[key] = (time.monotonic() + self._ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self._maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_load(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Возвращает значение из кэша, а при его отсутствии загружает и сохраняет его.
+
+        Одновременные промахи по одному ключу объединяются: загрузчик вызывается один раз,
+        остальные ожидают его результат (single-flight).  Исключение загрузчика получают
+        все ожидающие, в кэш при этом ничего не сохраняется
+
+        Args:
+            key: ключ
+            loader: загрузчик значения
+
+        """
+
+        value = self.get(key)
+
+        if value is not None:
+            return value
+
+        if (future := self._loading.get(key)) is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+
+        try:
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # исключение могут не ждать, тогда asyncio ругается на необработанное исключение
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+
+            # если во время загрузки ключ инвалидировали, то значение уже устарело
+            if self._loading.get(key) is future:
+                self.set(key, value)
+        finally:
+            if self._loading.get(key) is future:
+                del self._loading[key]
+
+        return value
+
+    def delete(self, key: Hashable) -> None:
+        """Удаляет значение из кэша.
+
+        Args:
+            key: ключ
+
+        """
+
+        self._data.pop(key, None)
+        self._loading.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._loading.clear()
+
+    def stats(self) -> dict:
+        """Возвращает статистику использования кэша."""
+
+        return {
+            "size": len(self._data),
+            "maxsize": self._maxsize,
+            "ttl": self._ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# сериализованные в JSON пользователи (UserSchema) по идентификатору
+users_cache = LRUCache(
+    maxsize=settings.cache.users_maxsize, ttl=settings.cache.users_ttl
+)
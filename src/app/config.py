@@ -1,3 +1,5 @@
+from typing import Literal
+
 from sqlalchemy import URL
 
 from pydantic_settings import BaseSettings
@@ -15,7 +17,18 @@ class DatabaseSettings(BaseSettings):
     port: int
     database: str
 
-    # connection args
+    # пул соединений
+    pool_size: int = 5  # количество постоянно открытых соединений
+    max_overflow: int = 10  # сколько соединений можно открыть сверх pool_size
+    pool_timeout: float = 30  # время ожидания свободного соединения, секунды
+    pool_recycle: int = -1  # время жизни соединения, секунды.  -1 - не ограничено
+    pool_pre_ping: bool = False  # проверять ли соединение перед выдачей из пула
+    pool_slow_holds: int = 10  # сколько самых долгих занятий соединения показывать
+
+    # кэши подготовленных запросов asyncpg и SQLAlchemy.  Для pgbouncer в режиме
+    # transaction оба должны быть 0
+    statement_cache_size: int = 100
+    prepared_statement_cache_size: int = 100
 
     @property
     def dsn(self):
@@ -29,6 +42,22 @@ class DatabaseSettings(BaseSettings):
         )
         return url.render_as_string(hide_password=False)
 
+    @property
+    def engine_options(self) -> dict:
+        """Параметры create_async_engine."""
+
+        return {
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+            "connect_args": {
+                "statement_cache_size": self.statement_cache_size,
+                "prepared_statement_cache_size": self.prepared_statement_cache_size,
+            },
+        }
+
 
 class KafkaSettings(BaseSettings):
     class Config:
@@ -38,11 +67,87 @@ class KafkaSettings(BaseSettings):
     bootstrap_servers: str
     consume_topic: str
     feedback_topic: str
+    group_id: str = "rtk-users"  # группа консумеров загрузки пользователей
+
+    # запускать ли загрузку в процессе API.  Если загрузка выполняется процессами
+    # python -m app.worker, то в API ее нужно отключить
+    ingestion_enabled: bool = True
+
+    # пакетная обработка сообщений
+    batch_size: int = 500  # максимальное количество сообщений в пачке
+    batch_linger_ms: int = 100  # время ожидания сообщений, если их нет в буфере
+
+    # идемпотентная загрузка: пользователь, уже созданный по тому же сообщению (например,
+    # при повторной доставке или перечитывании топика), повторно не создается
+    idempotent: bool = True
+
+    # обработчики партиций
+    workers_concurrency: int = 5  # сколько обработчиков одновременно работают с БД
+    # сколько пачек может ожидать записи в партиции.  При заполнении очереди партиция
+    # приостанавливается на консумере
+    worker_queue_size: int = 4
+
+    # разбор и проверка сообщений выполняются вне цикла событий, чтобы большие сообщения
+    # не задерживали ответы API: в пуле потоков (thread) или процессов (process)
+    parse_executor: Literal["thread", "process"] = "thread"
+    parse_workers: int = 2  # размер пула
+    feedback_queue_size: int = 100  # сколько фидбеков может ожидать отправки
+    feedback_retries: int = 3  # сколько раз повторять отправку фидбека
+
+    # ручная фиксация смещений после записи в БД
+    commit_interval_ms: int = 1000  # как часто фиксировать смещения
+    commit_messages: int = 1000  # после скольких сообщений фиксировать досрочно
+
+    # повторная обработка.  Запись пачки при временных ошибках БД повторяется на месте,
+    # затем сообщения откладываются в топики <consume_topic>-retry-<N> с задержками
+    # retry_delays_ms, а после последнего из них - в топик недоставленных сообщений
+    write_retries: int = 3  # сколько раз повторять запись на месте
+    retry_backoff_ms: int = 100  # начальная задержка перед повтором записи
+    retry_backoff_max_ms: int = 5000  # максимальная задержка перед повтором записи
+    retry_delays_ms: list[int] = [1000, 10000, 60000]
+    dlq_topic: str = "users-dlq"
+
+
+class CacheSettings(BaseSettings):
+    class Config:
+        env_file = ".env"
+        env_prefix = "CACHE_"
+
+    users_maxsize: int = 10000  # максимальное количество пользователей в кэше
+    users_ttl: float = 60  # время жизни пользователя в кэше, секунды
+
+
+class SearchSettings(BaseSettings):
+    class Config:
+        env_file = ".env"
+        env_prefix = "SEARCH_"
+
+    max_results: int = 50  # максимальное количество найденных пользователей
+    statement_timeout_ms: int = 500  # ограничение времени выполнения запроса поиска
+    similarity_threshold: float = 0.3  # минимальная схожесть найденного с запросом
+
+
+class ProfilingSettings(BaseSettings):
+    class Config:
+        env_file = ".env"
+        env_prefix = "PROFILING_"
+
+    # профилирование запросов с заголовком X-Profile.  В проде включать только на время
+    # разбора проблемы: профилировщик замедляет обработку всех запросов процесса
+    enabled: bool = False
+    sample_rate: float = 0  # доля профилируемых запросов без заголовка, от 0 до 1
+    directory: str | None = (
+        None  # куда сохранять профили.  Если не задано - не сохранять
+    )
+    repeated_queries: int = 10  # с какого количества повторов запроса предупреждать
 
 
 class Settings(BaseSettings):
     db: DatabaseSettings = DatabaseSettings()
     kafka: KafkaSettings = KafkaSettings()
+    cache: CacheSettings = CacheSettings()
+    search: SearchSettings = SearchSettings()
+    profiling: ProfilingSettings = ProfilingSettings()
 
 
 settings = Settings()
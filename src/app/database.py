@@ -3,8 +3,16 @@ from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 
 from app.config import settings
+from app.metrics import instrument_engine
+from app.pool import TelemetryPool, pool_telemetry
+from app.profiling import profile_engine
 
-engine = create_async_engine(settings.db.dsn)
+engine = create_async_engine(
+    settings.db.dsn, poolclass=TelemetryPool, **settings.db.engine_options
+)
+pool_telemetry.instrument(engine, settings.db.max_overflow)
+instrument_engine(engine)
+profile_engine(engine)
 metadata = MetaData()
 SessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base(metadata=metadata)
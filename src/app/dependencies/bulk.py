@@ -0,0 +1,53 @@
+import json
+from typing import AsyncIterator
+
+from starlette.requests import Request
+
+from app.exceptions import Http400
+
+NDJSON_MEDIA_TYPES = ("application/x-ndjson", "application/jsonl")
+
+
+async def get_bulk_rows(request: Request) -> AsyncIterator[dict | bytes]:
+    """Строки для массовой обработки из тела запроса.
+
+    Тело запроса - JSON-массив объектов или, если Content-Type application/x-ndjson,
+    по JSON-объекту на строку.  NDJSON читается потоково, и его строки отдаются в байтах,
+    чтобы ошибка разбора JSON стала ошибкой валидации одной строки, а не всего запроса
+
+    """
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    if content_type in NDJSON_MEDIA_TYPES:
+        return _iter_ndjson(request)
+
+    try:
+        rows = json.loads(await request.body())
+    except ValueError:
+        raise Http400("Некорректный JSON")
+
+    if not isinstance(rows, list):
+        raise Http400("Ожидается JSON-массив")
+
+    return _iter_list(rows)
+
+
+async def _iter_list(rows: list) -> AsyncIterator[dict]:
+    for row in rows:
+        yield row
+
+
+async def _iter_ndjson(request: Request) -> AsyncIterator[bytes]:
+    buffer = b""
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+
+        for line in lines:
+            if line.strip():
+                yield line
+
+    if buffer.strip():
+        yield buffer
@@ -12,3 +12,20 @@ class Http404(HTTPException):
             detail = "Объект не найден"
         super().__init__(status.HTTP_404_NOT_FOUND, detail, headers)
 
+
+class Http400(HTTPException):
+    def __init__(
+        self, detail: Any = None, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        if detail is None:
+            detail = "Некорректный запрос"
+        super().__init__(status.HTTP_400_BAD_REQUEST, detail, headers)
+
+
+class Http503(HTTPException):
+    def __init__(
+        self, detail: Any = None, headers: Optional[Dict[str, str]] = None
+    ) -> None:
+        if detail is None:
+            detail = "Сервис временно недоступен"
+        super().__init__(status.HTTP_503_SERVICE_UNAVAILABLE, detail, headers)
@@ -0,0 +1,129 @@
+import csv
+import io
+import logging
+from enum import Enum
+from typing import AsyncIterator, Type
+
+from fastapi import Depends, Query
+from pydantic import BaseModel
+from sqlalchemy import Select, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.responses import StreamingResponse
+
+from app.dependencies.database import get_session
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+class StreamingExport:
+    """Выгрузка всех записей запроса потоком.
+
+    Записи читаются из БД курсором на стороне сервера пачками по yield_per и отдаются клиенту
+    по мере чтения, поэтому потребление памяти не зависит от размера таблицы.  Записи упорядочены
+    по первичному ключу, и выгрузку можно продолжить с записи, следующей за after_id
+
+    Notes:
+        Как и пагинатор, выгрузка рассматривается как частный случай пользовательского кейса
+        и работает с запросом, подготовленным снаружи
+        Сессия закрывается после отправки ответа, поэтому курсор доступен, пока идет выгрузка
+
+    """
+
+    yield_per = 1000
+
+    def __init__(
+        self,
+        format: ExportFormat = Query(
+            ExportFormat.ndjson, description="Формат выгрузки"
+        ),
+        after_id: int = Query(
+            None, description="Выгрузить записи, следующие за записью с этим ID"
+        ),
+        session: AsyncSession = Depends(get_session),
+    ):
+        self._format = format
+        self._after_id = after_id
+        self._session = session
+
+    def get_response(
+        self, stmt: Select, schema: Type[BaseModel], filename: str
+    ) -> StreamingResponse:
+        """Возвращает ответ, выгружающий записи запроса.
+
+        Args:
+            stmt: sql-запрос
+            schema: схема, в которую сериализуется запись
+            filename: имя файла выгрузки без расширения
+
+        """
+
+        entity = stmt.column_descriptions[0]["entity"]
+        pk = inspect(entity).primary_key[0]
+
+        if self._after_id is not None:
+            stmt = stmt.where(pk > self._after_id)
+
+        stmt = stmt.order_by(pk).execution_options(yield_per=self.yield_per)
+
+        if self._format == ExportFormat.csv:
+            content = self._iter_csv(stmt, schema)
+        else:
+            content = self._iter_ndjson(stmt, schema)
+
+        return StreamingResponse(
+            content,
+            media_type=MEDIA_TYPES[self._format],
+            headers={
+                "Content-Disposition": (
+                    f'attachment; filename="{filename}.{self._format.value}"'
+                )
+            },
+        )
+
+    async def _iter_partitions(self, stmt: Select) -> AsyncIterator[list]:
+        result = await self._session.stream_scalars(stmt)
+
+        async for partition in result.partitions():
+            yield partition
+
+    async def _iter_ndjson(
+        self, stmt: Select, schema: Type[BaseModel]
+    ) -> AsyncIterator[bytes]:
+        # одна пачка - одна часть ответа, чтобы не отправлять каждую запись отдельно
+        async for partition in self._iter_partitions(stmt):
+            yield b"".join(
+                schema.model_validate(instance).model_dump_json().encode() + b"\n"
+                for instance in partition
+            )
+
+    async def _iter_csv(
+        self, stmt: Select, schema: Type[BaseModel]
+    ) -> AsyncIterator[bytes]:
+        fields = list(schema.model_fields)
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+
+        async for partition in self._iter_partitions(stmt):
+            writer.writerows(
+                schema.model_validate(instance).model_dump(mode="json")
+                for instance in partition
+            )
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+
+        # заголовок отдается, даже если записей нет
+        if buffer.tell():
+            yield buffer.getvalue().encode()
@@ -0,0 +1,71 @@
+"""Формирование фидбеков о результатах обработки сообщений из топика.
+
+Фидбек собирается подстановкой значений в заранее подготовленные шаблоны без отступов
+и кодируется в байты один раз на сообщение.  Значения из сообщений экранируются, тк в них может
+быть все что угодно
+"""
+
+from typing import Iterable
+from xml.sax.saxutils import escape
+
+from app.parsers import NAMESPACE
+
+RESPONSE_START = f'<ns2:Response xmlns:ns2="{NAMESPACE}">'
+RESPONSE_END = "</ns2:Response>"
+
+SUCCESS = (
+    "<ns2:KafkaUser><ns2:Id>%d</ns2:Id><ns2:Status>SUCCESS</ns2:Status></ns2:KafkaUser>"
+)
+EXISTS = (
+    "<ns2:KafkaUser><ns2:Id>%d</ns2:Id><ns2:Status>EXISTS</ns2:Status></ns2:KafkaUser>"
+)
+FAILED = (
+    "<ns2:KafkaUser>"
+    "<ns2:Name>{}</ns2:Name>"
+    "<ns2:Surname>{}</ns2:Surname>"
+    "<ns2:Email>{}</ns2:Email>"
+    "<ns2:Birthday>{}</ns2:Birthday>"
+    "<ns2:Status>FAILED</ns2:Status>"
+    "</ns2:KafkaUser>"
+)
+
+
+def render_batch(
+    user_ids: Iterable[int], failed: Iterable[dict], existing_ids: Iterable[int] = ()
+) -> bytes:
+    """Возвращает один фидбек с результатами обработки пачки пользователей.
+
+    Args:
+        user_ids: идентификаторы созданных пользователей
+        failed: данные невалидных пользователей из топика
+        existing_ids: идентификаторы пользователей, созданных ранее по тем же сообщениям
+
+    """
+
+    parts = [RESPONSE_START]
+    parts += [SUCCESS % user_id for user_id in user_ids]
+    parts += [EXISTS % user_id for user_id in existing_ids]
+    parts += [FAILED.format(*_escape_user_data(user_data)) for user_data in failed]
+    parts.append(RESPONSE_END)
+
+    return "".join(parts).encode()
+
+
+def _escape_user_data(user_data: dict) -> tuple[str, str, str, str]:
+    return (
+        _escape(user_data.get("name")),
+        _escape(user_data.get("surname")),
+        _escape(user_data.get("email")),
+        _escape(user_data.get("birthday")),
+    )
+
+
+def _escape(value: str | None) -> str:
+    if not value:
+        return ""
+
+    # в подавляющем большинстве значений экранировать нечего
+    if "&" in value or "<" in value or ">" in value:
+        return escape(value)
+
+    return value
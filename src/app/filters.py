@@ -0,0 +1,137 @@
+from datetime import datetime
+from enum import Enum
+
+from fastapi import Query
+from sqlalchemy import Select, func
+from sqlalchemy.orm import InstrumentedAttribute
+
+from app.models import User
+
+
+class UsersOrdering(str, Enum):
+    """Сортировка пользователей.  Минус - по убыванию."""
+
+    id = "id"
+    id_desc = "-id"
+    name = "name"
+    name_desc = "-name"
+    surname = "surname"
+    surname_desc = "-surname"
+    birthday = "birthday"
+    birthday_desc = "-birthday"
+
+
+class UsersFilter:
+    """Фильтрация пользователей.
+
+    Каждому фильтру соответствует индекс, поэтому они не требуют полного просмотра таблицы.
+    Сортировка задается отдельно (UsersSorting), тк не все ручки ее допускают: например,
+    выгрузка всегда упорядочена по id
+
+    Notes:
+        Как и пагинатор, фильтр применяется к запросу, подготовленному снаружи, а не передается
+        в репозиторий
+
+    """
+
+    def __init__(
+        self,
+        email: str = Query(None, description="Email, без учета регистра"),
+        name: str = Query(None, min_length=1, description="Начало имени"),
+        surname: str = Query(None, min_length=1, description="Начало фамилии"),
+        birthday_from: datetime = Query(
+            None, description="Дата и время рождения, начиная с"
+        ),
+        birthday_to: datetime = Query(
+            None, description="Дата и время рождения, до (не включая)"
+        ),
+    ):
+        self._email = email
+        self._name = name
+        self._surname = surname
+        self._birthday_from = birthday_from
+        self._birthday_to = birthday_to
+
+    def filter(self, stmt: Select) -> Select:
+        """Применяет к запросу фильтры.
+
+        Args:
+            stmt: sql-запрос
+
+        """
+
+        if self._email is not None:
+            stmt = stmt.where(func.lower(User.email) == self._email.lower())
+
+        if self._name is not None:
+            stmt = stmt.where(User.name.like(_prefix_pattern(self._name), escape="\\"))
+
+        if self._surname is not None:
+            stmt = stmt.where(
+                User.surname.like(_prefix_pattern(self._surname), escape="\\")
+            )
+
+        if self._birthday_from is not None:
+            stmt = stmt.where(User.birthday >= self._birthday_from)
+
+        if self._birthday_to is not None:
+            stmt = stmt.where(User.birthday < self._birthday_to)
+
+        return stmt
+
+
+class UsersSorting:
+    """Сортировка пользователей.
+
+    Каждой сортировке соответствует индекс, поэтому записи читаются из него уже
+    упорядоченными
+
+    """
+
+    def __init__(
+        self,
+        ordering: UsersOrdering = Query(UsersOrdering.id, description="Сортировка"),
+    ):
+        self._ordering = ordering
+
+    @property
+    def ordering(self) -> tuple[list[InstrumentedAttribute], bool]:
+        """Колонки сортировки и признак сортировки по убыванию.
+
+        Последним ключом всегда идет id, чтобы порядок был однозначным и страницы
+        не пересекались.  Все колонки сортируются в одном направлении, поэтому ключ
+        подходит и для пагинации по курсору
+
+        """
+
+        field, desc = self._ordering.value.lstrip("-"), self._ordering.value[0] == "-"
+        columns = [getattr(User, field)]
+
+        if field != "id":
+            columns.append(User.id)
+
+        return columns, desc
+
+    def sort(self, stmt: Select) -> Select:
+        """Применяет к запросу сортировку.
+
+        Args:
+            stmt: sql-запрос
+
+        """
+
+        columns, desc = self.ordering
+
+        return stmt.order_by(*(column.desc() if desc else column for column in columns))
+
+
+def escape_like(value: str) -> str:
+    """Экранирует спецсимволы LIKE обратной косой чертой."""
+
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _prefix_pattern(value: str) -> str:
+    # шаблон передается целиком, а не склеивается в запросе, чтобы при известном значении
+    # параметра планировщик мог использовать индекс varchar_pattern_ops
+    return escape_like(value) + "%"
@@ -0,0 +1,261 @@
+"""Загрузка пользователей из файлов выгрузок в обход Kafka и API.
+
+Поддерживаются CSV с заголовком, NDJSON и XML в формате сообщений из топика (<ns2:Request>).
+Строки проверяются по тем же правилам, что и сообщения из топика (KafkaUser), в пуле процессов,
+а валидные загружаются в БД через COPY пачками по chunk_size строк.  Каждая пачка фиксируется
+отдельной транзакцией.  Невалидные строки записываются в NDJSON-файл отказов
+
+Запуск из директории src:
+
+    python -m app.importer users.csv --chunk-size 10000 --rejects users.rejects.ndjson
+
+"""
+
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Iterator, TextIO
+
+from pydantic import ValidationError
+
+from app.database import SessionLocal
+from app.kafka import KafkaUser
+from app.parsers import ParseError, iter_file_users
+from app.repositories import UsersRepository
+
+FORMATS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".xml": "xml",
+}
+
+
+class ImportProgress:
+    """Ход загрузки."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.loaded = 0
+        self.rejected = 0
+
+    @property
+    def rows(self) -> int:
+        return self.loaded + self.rejected
+
+    @property
+    def rate(self) -> float:
+        """Скорость обработки, строк в секунду."""
+
+        elapsed = time.perf_counter() - self.started_at
+
+        return self.rows / elapsed if elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"загружено {self.loaded}, отклонено {self.rejected}, "
+            f"{self.rate:.0f} строк/с"
+        )
+
+
+def iter_rows(path: Path, format: str) -> Iterator[tuple[int, dict | bytes]]:
+    """Читает строки файла выгрузки.
+
+    Args:
+        path: путь к файлу
+        format: формат файла - csv, ndjson или xml
+
+    Returns:
+        номера строк и данные пользователей.  Строки NDJSON отдаются в байтах, чтобы ошибка
+        разбора JSON стала ошибкой валидации одной строки
+
+    """
+
+    if format == "csv":
+        with open(path, newline="", encoding="utf-8") as file:
+            yield from enumerate(csv.DictReader(file), start=1)
+    elif format == "ndjson":
+        with open(path, "rb") as file:
+            for number, line in enumerate(file, start=1):
+                if line.strip():
+                    yield number, line
+    elif format == "xml":
+        with open(path, "rb") as file:
+            # пользователи без части полей отклоняются при проверке, как строки CSV
+            yield from enumerate(iter_file_users(file, partial=True), start=1)
+    else:
+        raise ValueError(f"Неизвестный формат: {format}")
+
+
+def validate_chunk(
+    rows: list[tuple[int, dict | bytes]]
+) -> tuple[list[dict], list[str]]:
+    """Проверяет пачку строк по правилам KafkaUser.
+
+    Выполняется в пуле процессов, поэтому отказы возвращаются уже сериализованными
+
+    Args:
+        rows: номера строк и данные пользователей
+
+    Returns:
+        данные валидных пользователей и отказы в виде строк NDJSON
+
+    """
+
+    valid, rejects = [], []
+
+    for number, row in rows:
+        try:
+            if isinstance(row, bytes):
+                user = KafkaUser.model_validate_json(row)
+            else:
+                user = KafkaUser.model_validate(row)
+        except ValidationError as e:
+            reject = {
+                "row": number,
+                "data": row.decode(errors="replace").rstrip("\n")
+                if isinstance(row, bytes)
+                else row,
+                "errors": json.loads(e.json(include_url=False)),
+            }
+            rejects.append(json.dumps(reject, ensure_ascii=False) + "\n")
+        else:
+            valid.append(user.model_dump())
+
+    return valid, rejects
+
+
+async def import_users(
+    rows: Iterable[tuple[int, dict | bytes]],
+    users_repository: UsersRepository,
+    executor: Executor,
+    rejects: TextIO,
+    chunk_size: int = 5000,
+    max_pending: int = 4,
+    progress_file: TextIO = None,
+) -> ImportProgress:
+    """Загружает пользователей в БД.
+
+    Пока пачка загружается в БД, следующие пачки проверяются в пуле процессов.  Пачки
+    загружаются в порядке следования строк
+
+    Args:
+        rows: номера строк и данные пользователей
+        users_repository: репозиторий пользователей
+        executor: пул процессов для проверки строк
+        rejects: файл для отказов
+        chunk_size: размер пачки
+        max_pending: сколько пачек может одновременно проверяться
+        progress_file: файл для вывода хода загрузки
+
+    """
+
+    loop = asyncio.get_running_loop()
+    progress = ImportProgress()
+    pending = deque()
+    rows = iter(rows)
+
+    async def load_next():
+        valid, rejected = await pending.popleft()
+        await users_repository.copy_many(valid)
+        await users_repository.commit()
+        rejects.writelines(rejected)
+        progress.loaded += len(valid)
+        progress.rejected += len(rejected)
+
+        if progress_file is not None:
+            print(f"\r{progress}", end="", file=progress_file, flush=True)
+
+    while chunk := list(itertools.islice(rows, chunk_size)):
+        pending.append(loop.run_in_executor(executor, validate_chunk, chunk))
+
+        if len(pending) >= max_pending:
+            await load_next()
+
+    while pending:
+        await load_next()
+
+    if progress_file is not None:
+        print(f"\r{progress}", file=progress_file, flush=True)
+
+    return progress
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.importer",
+        description="Загрузка пользователей из файла выгрузки",
+    )
+    parser.add_argument("path", type=Path, help="файл выгрузки")
+    parser.add_argument(
+        "--format",
+        choices=sorted(set(FORMATS.values())),
+        help="формат файла.  По умолчанию определяется по расширению",
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=5000, help="размер пачки для COPY"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="количество процессов для проверки строк",
+    )
+    parser.add_argument(
+        "--rejects",
+        type=Path,
+        help="файл для отказов.  По умолчанию <path>.rejects.ndjson",
+    )
+    args = parser.parse_args(argv)
+
+    if args.format is None:
+        args.format = FORMATS.get(args.path.suffix.lower())
+
+        if args.format is None:
+            parser.error("не удалось определить формат файла, укажите --format")
+
+    if args.rejects is None:
+        args.rejects = args.path.with_name(args.path.name + ".rejects.ndjson")
+
+    return args
+
+
+async def main(argv: list[str] = None) -> int:
+    args = parse_args(argv)
+    rows = iter_rows(args.path, args.format)
+
+    with (
+        ProcessPoolExecutor(max_workers=args.workers) as executor,
+        open(args.rejects, "w", encoding="utf-8") as rejects,
+    ):
+        async with SessionLocal() as session:
+            try:
+                progress = await import_users(
+                    rows,
+                    UsersRepository(session),
+                    executor,
+                    rejects,
+                    chunk_size=args.chunk_size,
+                    max_pending=args.workers + 1,
+                    progress_file=sys.stderr,
+                )
+            except ParseError as e:
+                print(f"\nНекорректный XML: {e}", file=sys.stderr)
+                return 1
+
+    if progress.rejected:
+        print(f"Отказы записаны в {args.rejects}", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,16 +1,95 @@
+import asyncio
+import itertools
 import logging
-import xml.etree.ElementTree as ET
+import random
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from typing import Callable
 
+import sqlalchemy.exc
 from pydantic import BaseModel, EmailStr, Field
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
+from aiokafka import (
+    AIOKafkaConsumer,
+    AIOKafkaProducer,
+    ConsumerRebalanceListener,
+    ConsumerRecord,
+    TopicPartition,
+)
+from aiokafka.errors import ConsumerStoppedError, KafkaError
+from app.cache import users_cache
 from app.config import settings
+from app.feedback import render_batch
+from app.metrics import Counter, Gauge, Histogram, registry
+from app.parsers import ParseError, parse
 from app.repositories import UsersRepository
 from pydantic_core import ValidationError
 
 LOGGER = logging.getLogger(__name__)
 
+MESSAGE_ID_HEADER = "message-id"
+# заголовки с метаданными ошибки у сообщений в топиках повторной обработки и DLQ
+ERROR_HEADER = "error"
+ERROR_REASON_HEADER = "error-reason"
+ORIGINAL_TOPIC_HEADER = "original-topic"
+ORIGINAL_PARTITION_HEADER = "original-partition"
+ORIGINAL_OFFSET_HEADER = "original-offset"
+
+# SQLSTATE ошибок PostgreSQL, после которых запрос можно повторить: serialization_failure,
+# deadlock_detected, lock_not_available, admin_shutdown, cannot_connect_now
+TRANSIENT_SQLSTATES = {"40001", "40P01", "55P03", "57P01", "57P03"}
+
+# стадии загрузки: validate - разбор и проверка в пуле, write - запись в БД,
+# feedback - отправка фидбеков
+STAGE_QUEUE_DEPTH = registry.register(
+    Gauge(
+        "ingestion_stage_queue_depth",
+        "Количество пачек сообщений, ожидающих стадию загрузки",
+        ("stage",),
+    )
+)
+STAGE_DURATION = registry.register(
+    Histogram(
+        "ingestion_stage_duration_seconds",
+        "Время обработки пачки сообщений стадией загрузки",
+        ("stage",),
+    )
+)
+PAUSED_PARTITIONS = registry.register(
+    Gauge(
+        "ingestion_paused_partitions",
+        "Количество партиций, приостановленных из-за заполненной очереди",
+    )
+)
+WRITE_RETRIES = registry.register(
+    Counter(
+        "ingestion_write_retries_total",
+        "Количество повторов записи пачки в БД после временных ошибок",
+    )
+)
+FEEDBACK_RETRIES = registry.register(
+    Counter(
+        "ingestion_feedback_retries_total",
+        "Количество повторов отправки фидбека",
+    )
+)
+RETRIED_MESSAGES = registry.register(
+    Counter(
+        "ingestion_retried_messages_total",
+        "Количество сообщений, отложенных в топики повторной обработки",
+        ("tier",),
+    )
+)
+DEAD_LETTERS = registry.register(
+    Counter(
+        "ingestion_dead_letters_total",
+        "Количество сообщений, отправленных в топик недоставленных сообщений",
+        ("reason",),
+    )
+)
+
 
 class KafkaUser(BaseModel):
     name: str = Field(min_length=1, max_length=255)
@@ -19,117 +98,1069 @@ class KafkaUser(BaseModel):
     birthday: datetime
 
 
-def parse(msg: str) -> dict:
-    """Извлечение данных из сообщения.
+async def send_batch_feedback(
+    producer: AIOKafkaProducer,
+    user_ids: list[int],
+    failed: list[dict],
+    existing_ids: list[int] = (),
+) -> None:
+    """Отправка одного фидбека по всей пачке пользователей.
 
     Args:
-        msg: сообщение из топика
+        producer: продьюсер
+        user_ids: идентификаторы созданных пользователей
+        failed: данные невалидных пользователей из топика
+        existing_ids: идентификаторы пользователей, созданных ранее по тем же сообщениям
 
     """
 
-    xml = ET.fromstring(msg)
-    namespaces = {"ns2": "urn://www.example.com"}
-    name = xml.find(".//ns2:Name", namespaces).text
-    surname = xml.find(".//ns2:Surname", namespaces).text
-    email = xml.find(".//ns2:Email", namespaces).text
-    birthday = xml.find(".//ns2:Birthday", namespaces).text
+    await send_feedback(producer, render_batch(user_ids, failed, existing_ids))
 
-    return {
-        "name": name or "",
-        "surname": surname or "",
-        "email": email or "",
-        "birthday": birthday or "",
-    }
 
-
-async def send_success_feedback(producer: AIOKafkaProducer, user_id: int):
-    """Отправка успешного фидбека.
+async def send_feedback(producer: AIOKafkaProducer, msg: bytes) -> None:
+    """Отправка сообщения в топик фидбеков.
 
     Args:
         producer: продьюсер
-        user_id: идентификатор созданного пользователя
+        msg: сообщение
 
     """
 
-    msg = f"""
-        <ns2:Response xmlns:ns2="urn://www.example.com">
-            <ns2:KafkaUser>
-                <ns2:Id>{user_id}</ns2:Id>
-                <ns2:Status>SUCCESS</ns2:Status>
-            </ns2:KafkaUser>
-        </ns2:Response>
+    # смещения отмечаются после отправки фидбека, поэтому нужно дождаться подтверждения
+    await producer.send_and_wait(settings.kafka.feedback_topic, msg)
+
+
+def get_source_prefix(record: ConsumerRecord) -> str:
+    """Возвращает начало ключей пользователей из сообщения.
+
+    Ключ строится по заголовку message-id, если он есть, иначе - по положению сообщения
+    в топике, поэтому не меняется при повторной доставке или перечитывании топика
+
+    Args:
+        record: сообщение из топика
+
     """
 
-    await send_feedback(producer, msg.strip().encode())
+    for name, value in record.headers or ():
+        if name == MESSAGE_ID_HEADER and value:
+            return value.decode(errors="replace")
+
+    return f"{record.topic}/{record.partition}/{record.offset}"
 
 
-async def send_failed_feedback(producer: AIOKafkaProducer, user_data: dict):
-    """Отправка неуспешного фидбека.
+def get_source_key(record: ConsumerRecord, index: int) -> str:
+    """Возвращает ключ пользователя из сообщения для идемпотентной загрузки.
 
     Args:
-        producer: продьюсер
-        user_data: данные пользователя из топика
+        record: сообщение из топика
+        index: порядковый номер пользователя в сообщении
+
+    """
+
+    return f"{get_source_prefix(record)}/{index}"
+
+
+def get_retry_topics() -> list[str]:
+    """Возвращает топики повторной обработки по возрастанию задержки."""
+
+    return [
+        f"{settings.kafka.consume_topic}-retry-{tier}"
+        for tier in range(1, len(settings.kafka.retry_delays_ms) + 1)
+    ]
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """Можно ли повторить запись в БД после ошибки.
+
+    Временными считаются таймаут пула и запросов, разрыв соединения, взаимная блокировка
+    и конфликт сериализации
+
+    Args:
+        error: ошибка записи
 
     """
 
-    msg = """
-        <ns2:Response xmlns:ns2="urn://www.example.com">
-            <ns2:KafkaUser>
-                <ns2:Name>{name}</ns2:Name>
-                <ns2:Surname>{surname}</ns2:Surname>
-                <ns2:Email>{email}</ns2:Email>
-                <ns2:Birthday>{birthday}</ns2:Birthday>
-                <ns2:Status>FAILED</ns2:Status
-            </ns2:KafkaUser>
-        </ns2:Response>
-    """.format_map(
-        user_data
+    # TimeoutError и ConnectionError - подклассы OSError
+    if isinstance(error, (sqlalchemy.exc.TimeoutError, OSError)):
+        return True
+
+    if isinstance(error, sqlalchemy.exc.DBAPIError):
+        return (
+            error.connection_invalidated
+            or isinstance(error.orig, OSError)
+            or getattr(error.orig, "sqlstate", None) in TRANSIENT_SQLSTATES
+        )
+
+    return False
+
+
+def get_backoff(attempt: int) -> float:
+    """Возвращает задержку перед повтором записи или отправки фидбека, секунды.
+
+    Задержка растет экспоненциально и выбирается случайно от нуля до нее (full jitter),
+    чтобы обработчики партиций, получившие ошибку одновременно, не повторяли запрос вместе
+
+    Args:
+        attempt: номер повтора, начиная с нуля
+
+    """
+
+    ceiling = min(
+        settings.kafka.retry_backoff_max_ms,
+        settings.kafka.retry_backoff_ms * 2**attempt,
     )
 
-    await send_feedback(producer, msg.strip().encode())
+    return random.uniform(0, ceiling) / 1000
 
 
-async def send_feedback(producer: AIOKafkaProducer, msg: bytes) -> None:
-    """Отправка сообщения в топик фидбеков.
+class Redelivery:
+    """Отложенная повторная обработка сообщений и топик недоставленных сообщений (DLQ).
+
+    Сообщения пачки, которую не удалось записать, откладываются в топик следующего уровня
+    повторной обработки, поэтому не задерживают остальные сообщения партиции.  Сообщения,
+    не записанные и после последнего уровня, и сообщения, которые невозможно разобрать,
+    отправляются в settings.kafka.dlq_topic.  Ключ источника (get_source_prefix) передается
+    заголовком message-id, поэтому повторная обработка остается идемпотентной
 
     Args:
         producer: продьюсер
-        msg: сообщение
 
     """
 
-    await producer.send(settings.kafka.feedback_topic, msg)
+    def __init__(self, producer: AIOKafkaProducer):
+        self._producer = producer
+        self._topics = get_retry_topics()
 
+    def get_delay(self, record: ConsumerRecord) -> float:
+        """Возвращает, через сколько секунд сообщение можно обрабатывать.
 
-async def consume(
-    consumer: AIOKafkaConsumer,
-    producer: AIOKafkaProducer,
-    users_repository: UsersRepository,
-) -> None:
-    """Обработка сообщений из топика.
+        Задержка отсчитывается от времени отправки сообщения в топик повторной обработки
+
+        Args:
+            record: сообщение из топика
+
+        """
+
+        if record.topic not in self._topics:
+            return 0
+
+        delay_ms = settings.kafka.retry_delays_ms[self._topics.index(record.topic)]
+
+        return max(record.timestamp + delay_ms - time.time() * 1000, 0) / 1000
+
+    async def retry(self, records: list[ConsumerRecord], error: BaseException) -> None:
+        """Откладывает сообщения на следующий уровень повторной обработки.
+
+        Args:
+            records: сообщения, которые не удалось записать
+            error: ошибка записи
+
+        """
+
+        if not records:
+            return
+
+        # сообщения пачки из одной партиции, а значит, и с одного уровня
+        topic = records[0].topic
+        tier = self._topics.index(topic) + 1 if topic in self._topics else 0
+
+        if tier == len(self._topics):
+            await self.dead_letter(records, "write", repr(error))
+            return
+
+        await self._send(self._topics[tier], records, {ERROR_HEADER: repr(error)})
+        RETRIED_MESSAGES.labels(str(tier + 1)).inc(len(records))
+
+    async def dead_letter(
+        self, records: list[ConsumerRecord], reason: str, error: str
+    ) -> None:
+        """Отправляет сообщения в топик недоставленных сообщений.
+
+        Args:
+            records: сообщения
+            reason: причина: parse - сообщение невозможно разобрать, write - не удалось
+                записать после всех повторов
+            error: описание ошибки
+
+        """
+
+        await self._send(
+            settings.kafka.dlq_topic,
+            records,
+            {ERROR_HEADER: error, ERROR_REASON_HEADER: reason},
+        )
+        DEAD_LETTERS.labels(reason).inc(len(records))
+
+    async def _send(
+        self, topic: str, records: list[ConsumerRecord], extra: dict[str, str]
+    ) -> None:
+        # смещения отмечаются после отправки, поэтому нужно дождаться подтверждения
+        await asyncio.gather(
+            *(
+                self._producer.send_and_wait(
+                    topic,
+                    record.value,
+                    key=record.key,
+                    headers=self._get_headers(record, extra),
+                )
+                for record in records
+            )
+        )
+
+    @staticmethod
+    def _get_headers(
+        record: ConsumerRecord, extra: dict[str, str]
+    ) -> list[tuple[str, bytes]]:
+        headers = dict(record.headers or ())
+        # положение в исходном топике сохраняется при переходе между уровнями
+        if record.topic == settings.kafka.consume_topic:
+            headers[ORIGINAL_TOPIC_HEADER] = record.topic.encode()
+            headers[ORIGINAL_PARTITION_HEADER] = str(record.partition).encode()
+            headers[ORIGINAL_OFFSET_HEADER] = str(record.offset).encode()
+
+        headers[MESSAGE_ID_HEADER] = get_source_prefix(record).encode()
+        headers.update((name, value.encode()) for name, value in extra.items())
+
+        return list(headers.items())
+
+
+def create_parse_executor() -> Executor:
+    """Создает пул для разбора и проверки сообщений по настройкам."""
+
+    if settings.kafka.parse_executor == "process":
+        return ProcessPoolExecutor(max_workers=settings.kafka.parse_workers)
+
+    return ThreadPoolExecutor(
+        max_workers=settings.kafka.parse_workers, thread_name_prefix="kafka-parse"
+    )
+
+
+def validate_messages(
+    messages: list[tuple[str, bytes]]
+) -> tuple[list[dict], list[dict], dict[int, str], float]:
+    """Разбор и проверка пачки сообщений.
+
+    Выполняется в пуле потоков или процессов, поэтому принимает не сообщения из топика,
+    а только то, что нужно для проверки
 
     Args:
-        consumer: консумер
-        producer: продьюсер
-        users_repository
+        messages: начала ключей пользователей (get_source_prefix) и тела сообщений
+
+    Returns:
+        данные валидных пользователей, данные невалидных пользователей, ошибки разбора
+        по номерам сообщений, которые не удалось разобрать, и время проверки
 
     """
 
-    try:
-        async for msg in consumer:
-            user_data = parse(msg.value.decode())
+    started_at = time.perf_counter()
+    create_data, failed, poisoned = {}, [], {}
+
+    for message_index, (source_prefix, value) in enumerate(messages):
+        try:
+            users_data = parse(value)
+        except ParseError as e:
+            LOGGER.warning(f"Не удалось разобрать сообщение {source_prefix}: {e}")
+            poisoned[message_index] = repr(e)
+            continue
 
+        for index, user_data in enumerate(users_data):
             try:
                 user = KafkaUser(**user_data)
             except ValidationError:
-                await send_failed_feedback(producer, user_data)
+                failed.append(user_data)
             else:
-                create_data = user.model_dump()
-                user = await users_repository.create(**create_data)
-                await users_repository.commit()
-                await users_repository.refresh(user)
+                # одно и то же сообщение может попасть в пачку дважды, а один запрос
+                # ON CONFLICT DO UPDATE не может затронуть строку дважды
+                source_key = f"{source_prefix}/{index}"
+                create_data[source_key] = {
+                    **user.model_dump(),
+                    "source_key": source_key,
+                }
+
+    return (
+        list(create_data.values()),
+        failed,
+        poisoned,
+        time.perf_counter() - started_at,
+    )
+
+
+async def write_users(
+    create_data: list[dict], users_repository: UsersRepository
+) -> tuple[list[int], list[int]]:
+    """Создание пользователей пачки одним запросом в одной транзакции.
+
+    В идемпотентном режиме пользователи, уже созданные по тем же сообщениям, повторно
+    не создаются.  Иначе ключ источника не записывается, тк он уникален, и повторно
+    доставленное сообщение создает пользователей заново
+
+    Args:
+        create_data: данные валидных пользователей
+        users_repository: репозиторий пользователей
+
+    Returns:
+        идентификаторы созданных пользователей и пользователей, созданных ранее
+
+    """
+
+    if not create_data:
+        return [], []
+
+    if settings.kafka.idempotent:
+        results = await users_repository.upsert_many(
+            create_data, conflict_key="source_key"
+        )
+    else:
+        user_ids = await users_repository.create_many(
+            [
+                {key: value for key, value in user_data.items() if key != "source_key"}
+                for user_data in create_data
+            ]
+        )
+        results = [(user_id, True) for user_id in user_ids]
+
+    await users_repository.commit()
+    user_ids = [user_id for user_id, created in results if created]
+    existing_ids = [user_id for user_id, created in results if not created]
+
+    for user_id in user_ids:
+        users_cache.delete(user_id)
+
+    return user_ids, existing_ids
+
+
+class OffsetCommitter:
+    """Ручная фиксация смещений консумера.
+
+    Обработанные сообщения отмечаются методом mark после фиксации транзакции БД и отправки
+    фидбека, а смещения фиксируются в Kafka одним запросом по всем партициям раз
+    в settings.kafka.commit_interval_ms или после settings.kafka.commit_messages отмеченных
+    сообщений.  При сбое повторно обрабатываются только сообщения после последних
+    зафиксированных смещений (доставка не менее одного раза)
+
+    Args:
+        consumer: консумер с отключенной автоматической фиксацией смещений
+
+    """
+
+    def __init__(self, consumer: AIOKafkaConsumer):
+        self._consumer = consumer
+        # смещения, с которых продолжать чтение, еще не зафиксированные в Kafka
+        self._offsets: dict[TopicPartition, int] = {}
+        self._messages = 0
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="offset-committer")
+
+    def mark(self, tp: TopicPartition, offset: int, count: int = 1) -> None:
+        """Отмечает сообщения партиции до offset включительно обработанными.
+
+        Args:
+            tp: партиция
+            offset: смещение последнего обработанного сообщения
+            count: количество обработанных сообщений
+
+        """
+
+        self._offsets[tp] = max(self._offsets.get(tp, 0), offset + 1)
+        self._messages += count
+
+        if self._messages >= settings.kafka.commit_messages:
+            self._wakeup.set()
+
+    async def commit(self, partitions: set[TopicPartition] = None) -> None:
+        """Фиксирует отмеченные смещения.
+
+        Args:
+            partitions: партиции, смещения которых нужно зафиксировать.  Если не переданы,
+                то фиксируются смещения всех партиций
+
+        """
+
+        async with self._lock:
+            offsets = {
+                tp: offset
+                for tp, offset in self._offsets.items()
+                if partitions is None or tp in partitions
+            }
+
+            if not offsets:
+                return
+
+            # отметки, сделанные во время фиксации, сохраняются до следующей
+            for tp in offsets:
+                del self._offsets[tp]
+
+            if partitions is None:
+                self._messages = 0
+
+            try:
+                await self._consumer.commit(offsets)
+            except KafkaError:
+                # сообщения будут обработаны повторно тем, кому достанутся партиции
+                LOGGER.exception(f"Не удалось зафиксировать смещения {offsets}")
+
+    async def stop(self) -> None:
+        """Останавливает периодическую фиксацию и фиксирует оставшиеся смещения."""
+
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        await self.commit()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(), settings.kafka.commit_interval_ms / 1000
+                )
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            await self.commit()
+
+
+class FeedbackSender:
+    """Стадия отправки фидбеков.
+
+    Фидбеки отправляются отдельной задачей, чтобы обработчики партиций не ждали продьюсер.
+    Очередь ограничена, поэтому, если продьюсер не успевает, обработчики ждут места в ней.
+    Пачки проходят стадию по порядку, и только после нее сообщения пачки отмечаются
+    обработанными, поэтому смещение не фиксируется раньше, чем доставлен фидбек.  Пачки
+    перемотанных партиций (PartitionWorker.rewind) пропускаются, тк будут прочитаны снова.
+
+    Отправка фидбека повторяется settings.kafka.feedback_retries раз, а если не удалась, то
+    сообщения пачки откладываются в топик повторной обработки.  Пользователи к этому моменту
+    уже записаны, поэтому в идемпотентном режиме повторная обработка только отправит фидбек.
+    Если отложить сообщения не удалось, то партиция перематывается к пачке.  Без
+    идемпотентности (settings.kafka.idempotent) повторная обработка записала бы пользователей
+    второй раз, поэтому сообщения не откладываются, а отправка фидбека повторяется, пока
+    не удастся или пока стадия не будет остановлена
+
+    Args:
+        producer: продьюсер
+        committer: фиксация смещений
+        redelivery: повторная обработка сообщений, фидбек по которым не удалось отправить.
+            Если не передана, то партиция перематывается к таким пачкам
+
+    """
+
+    def __init__(
+        self,
+        producer: AIOKafkaProducer,
+        committer: OffsetCommitter = None,
+        redelivery: Redelivery = None,
+    ):
+        self._producer = producer
+        self._committer = committer
+        self._redelivery = redelivery
+        self._queue = asyncio.Queue(maxsize=settings.kafka.feedback_queue_size)
+        self._stopping = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="feedback-sender")
+
+    async def put(
+        self,
+        worker: "PartitionWorker",
+        records: list[ConsumerRecord],
+        feedback: tuple[list[int], list[dict], list[int]] | None,
+    ) -> None:
+        """Постановка в очередь фидбека по записанной пачке.
+
+        Args:
+            worker: обработчик партиции пачки
+            records: сообщения пачки
+            feedback: идентификаторы созданных пользователей, данные невалидных
+                пользователей и идентификаторы созданных ранее.  None, если фидбек не нужен
+
+        """
+
+        await self._queue.put((worker, worker.generation, records, feedback))
+        STAGE_QUEUE_DEPTH.labels("feedback").inc()
+
+    async def join(self) -> None:
+        """Дожидается обработки поставленных в очередь пачек."""
+
+        await self._queue.join()
 
-                await send_success_feedback(producer, user.id)
+    async def stop(self) -> None:
+        """Дожидается отправки поставленных в очередь фидбеков."""
+
+        self._stopping.set()
+        await self._queue.put(None)
+        await self._task
+
+    async def _run(self) -> None:
+        while (item := await self._queue.get()) is not None:
+            STAGE_QUEUE_DEPTH.labels("feedback").dec()
+            worker, generation, records, feedback = item
+            offset = records[0].offset
+
+            if not worker.is_stale(generation, offset):
+                sent = feedback is None or await self._send(records, feedback)
+
+                if not sent:
+                    worker.rewind(offset)
+                # партиция могла быть перемотана к пачке, пока отправлялся фидбек
+                elif self._committer is not None and not worker.is_stale(
+                    generation, offset
+                ):
+                    last = records[-1]
+                    self._committer.mark(
+                        TopicPartition(last.topic, last.partition),
+                        last.offset,
+                        len(records),
+                    )
+
+            self._queue.task_done()
+
+    async def _send(
+        self,
+        records: list[ConsumerRecord],
+        feedback: tuple[list[int], list[dict], list[int]],
+    ) -> bool:
+        """Отправка фидбека с повторами.
+
+        Returns:
+            можно ли отмечать сообщения пачки обработанными: фидбек доставлен или
+            сообщения отложены в топик повторной обработки
+
+        """
+
+        started_at = time.perf_counter()
+
+        for attempt in itertools.count():
+            try:
+                await send_batch_feedback(self._producer, *feedback)
+            except Exception as e:
+                error = e
+            else:
+                STAGE_DURATION.labels("feedback").observe(
+                    time.perf_counter() - started_at
+                )
+                return True
+
+            if settings.kafka.idempotent:
+                if attempt >= settings.kafka.feedback_retries:
+                    break
+            elif self._stopping.is_set():
+                break
+
+            LOGGER.warning(
+                f"Не удалось отправить фидбек, повтор {attempt + 1}: {error!r}"
+            )
+            FEEDBACK_RETRIES.inc()
+
+            try:
+                await asyncio.wait_for(self._stopping.wait(), get_backoff(attempt))
+            except asyncio.TimeoutError:
+                pass
+
+        LOGGER.error("Не удалось отправить фидбек", exc_info=error)
+
+        if self._redelivery is None or not settings.kafka.idempotent:
+            return False
+
+        try:
+            await self._redelivery.retry(records, error)
+        except Exception:
+            LOGGER.exception("Не удалось отложить сообщения без фидбека")
+            return False
+
+        return True
+
+
+class PartitionWorker:
+    """Обработчик сообщений одной партиции.
+
+    Пачка сообщений сразу при постановке в очередь отправляется на разбор и проверку в пул,
+    поэтому следующие пачки проверяются, пока предыдущая записывается в БД.  Записываются
+    пачки строго по очереди, поэтому порядок сообщений внутри партиции сохраняется.  У каждого
+    обработчика своя сессия, поэтому партиции записываются параллельно.  Когда очередь
+    заполняется, партиция приостанавливается на консумере и возобновляется, когда очередь
+    разберется наполовину.
+
+    Запись при временных ошибках БД повторяется с задержкой, а если не удалась, то сообщения
+    пачки откладываются в топик повторной обработки (Redelivery).  Сообщения из топика
+    повторной обработки обрабатываются не раньше, чем истечет задержка его уровня.
+
+    Если пачку не удалось ни обработать, ни отложить, то партиция перематывается к ней
+    (rewind): уже поставленные в очередь следующие пачки не обрабатываются и не отмечаются,
+    а консумер перечитывает партицию с первого сообщения этой пачки
+
+    """
+
+    def __init__(
+        self,
+        tp: TopicPartition,
+        session: AsyncSession,
+        semaphore: asyncio.Semaphore,
+        feedback: FeedbackSender,
+        redelivery: Redelivery,
+        executor: Executor = None,
+    ):
+        self.tp = tp
+        self._session = session
+        self._users_repository = UsersRepository(session)
+        self._semaphore = semaphore
+        self._feedback = feedback
+        self._redelivery = redelivery
+        self._executor = executor
+        self._queue = asyncio.Queue(maxsize=settings.kafka.worker_queue_size)
+        self._stopping = asyncio.Event()
+        self._skipping = False
+        self._paused_on = None
+        # смещения, к которым перематывалась партиция
+        self._rewinds: list[int] = []
+        self._seek_offset = None
+        self._task = asyncio.create_task(
+            self._run(), name=f"partition-worker {tp.topic}-{tp.partition}"
+        )
+
+    async def put(
+        self, records: list[ConsumerRecord], consumer: AIOKafkaConsumer = None
+    ) -> None:
+        """Постановка пачки сообщений в очередь обработчика.
+
+        Если после постановки очередь заполнилась, то партиция приостанавливается на консумере.
+        Если очередь уже заполнена (например, консумер не поддерживает приостановку), то
+        ожидает, пока обработчик ее разберет
+
+        Args:
+            records: сообщения партиции
+            consumer: консумер, на котором приостанавливать партицию
+
+        """
+
+        if self._seek_offset is not None:
+            # сообщения получены до перемотки партиции и будут прочитаны снова
+            return
+
+        messages = [(get_source_prefix(record), record.value) for record in records]
+        validation = asyncio.get_running_loop().run_in_executor(
+            self._executor, validate_messages, messages
+        )
+        STAGE_QUEUE_DEPTH.labels("validate").inc()
+        validation.add_done_callback(
+            lambda _: STAGE_QUEUE_DEPTH.labels("validate").dec()
+        )
+        await self._queue.put((records, validation, self.generation))
+        STAGE_QUEUE_DEPTH.labels("write").inc()
+
+        if self._queue.full() and consumer is not None and self._paused_on is None:
+            consumer.pause(self.tp)
+            self._paused_on = consumer
+            PAUSED_PARTITIONS.labels().inc()
+
+    @property
+    def generation(self) -> int:
+        """Количество перемоток партиции."""
+
+        return len(self._rewinds)
+
+    def rewind(self, offset: int) -> None:
+        """Перемотка партиции к сообщению, которое не удалось ни обработать, ни отложить.
+
+        Args:
+            offset: смещение первого сообщения пачки
+
+        """
+
+        LOGGER.warning(f"Партиция {self.tp} будет перечитана со смещения {offset}")
+        self._rewinds.append(offset)
+
+        if self._seek_offset is None or offset < self._seek_offset:
+            self._seek_offset = offset
+
+    def is_stale(self, generation: int, offset: int) -> bool:
+        """Будет ли пачка перечитана после перемотки партиции.
+
+        Args:
+            generation: количество перемоток партиции при постановке пачки в очередь
+            offset: смещение первого сообщения пачки
+
+        """
+
+        return any(rewind <= offset for rewind in self._rewinds[generation:])
+
+    def seek(self, consumer: AIOKafkaConsumer) -> None:
+        """Перечитывание партиции с сообщения, к которому она перемотана.
+
+        Вызывается между получениями сообщений консумером, поэтому все сообщения,
+        полученные после вызова, прочитаны после перемотки
+
+        Args:
+            consumer: консумер
+
+        """
+
+        if self._seek_offset is not None:
+            consumer.seek(self.tp, self._seek_offset)
+            self._seek_offset = None
+
+    async def stop(self) -> None:
+        """Дожидается обработки поставленных в очередь сообщений и закрывает сессию.
+
+        Сообщения, задержка повторной обработки которых еще не истекла, не обрабатываются,
+        а их смещения не отмечаются, поэтому они будут прочитаны снова
+
+        """
+
+        self._stopping.set()
+        await self._queue.put(None)
+        await self._task
+
+    async def _run(self) -> None:
+        while (item := await self._queue.get()) is not None:
+            STAGE_QUEUE_DEPTH.labels("write").dec()
+            records, validation, generation = item
+            self._resume()
+
+            if self.is_stale(generation, records[0].offset):
+                validation.cancel()
+                continue
+
+            if not await self._wait_delay(records[-1]):
+                continue
+
+            # номера сообщений, уже отправленных в DLQ
+            dead = set()
+
+            try:
+                create_data, failed, poisoned, duration = await validation
+                STAGE_DURATION.labels("validate").observe(duration)
+
+                for index, error in poisoned.items():
+                    await self._redelivery.dead_letter([records[index]], "parse", error)
+                    dead.add(index)
+
+                user_ids, existing_ids = await self._write(create_data)
+            except Exception as error:
+                LOGGER.exception(f"Не удалось обработать сообщения партиции {self.tp}")
+
+                try:
+                    await self._redelivery.retry(
+                        [
+                            record
+                            for index, record in enumerate(records)
+                            if index not in dead
+                        ],
+                        error,
+                    )
+                except Exception:
+                    LOGGER.exception(
+                        f"Не удалось отложить сообщения партиции {self.tp}"
+                    )
+                    self.rewind(records[0].offset)
+                    continue
+
+                # фидбек будет отправлен после повторной обработки
+                await self._feedback.put(self, records, None)
+                continue
+
+            feedback = None
+
+            if user_ids or existing_ids or failed:
+                feedback = user_ids, failed, existing_ids
+
+            await self._feedback.put(self, records, feedback)
+
+        self._resume(force=True)
+
+        async with self._semaphore:
+            await self._session.close()
+
+    async def _wait_delay(self, record: ConsumerRecord) -> bool:
+        """Ожидает истечения задержки повторной обработки сообщения.
+
+        Returns:
+            можно ли обрабатывать сообщение.  False, если обработчик останавливается
+
+        """
+
+        if self._skipping:
+            return False
+
+        if (delay := self._redelivery.get_delay(record)) <= 0:
+            return True
+
+        try:
+            await asyncio.wait_for(self._stopping.wait(), delay)
+        except asyncio.TimeoutError:
+            return True
+
+        # эта и следующие пачки не обрабатываются, чтобы смещение не отметилось после них
+        self._skipping = True
+
+        return False
+
+    async def _write(self, create_data: list[dict]) -> tuple[list[int], list[int]]:
+        """Запись пачки с повторами при временных ошибках БД."""
+
+        for attempt in itertools.count():
+            async with self._semaphore:
+                started_at = time.perf_counter()
+
+                try:
+                    result = await write_users(create_data, self._users_repository)
+                except Exception as error:
+                    await self._session.rollback()
+
+                    if (
+                        attempt >= settings.kafka.write_retries
+                        or not is_transient_error(error)
+                    ):
+                        raise
+
+                    LOGGER.warning(
+                        f"Временная ошибка записи партиции {self.tp}, "
+                        f"повтор {attempt + 1}: {error!r}"
+                    )
+                else:
+                    STAGE_DURATION.labels("write").observe(
+                        time.perf_counter() - started_at
+                    )
+                    return result
+
+            WRITE_RETRIES.inc()
+            await asyncio.sleep(get_backoff(attempt))
+
+    def _resume(self, force: bool = False) -> None:
+        if self._paused_on is None:
+            return
+
+        if force or self._queue.qsize() <= self._queue.maxsize // 2:
+            # отозванная партиция на консумере уже не назначена
+            if self.tp in self._paused_on.assignment():
+                self._paused_on.resume(self.tp)
+
+            self._paused_on = None
+            PAUSED_PARTITIONS.labels().dec()
+
+
+class PartitionWorkers(ConsumerRebalanceListener):
+    """Обработчики сообщений по одному на каждую назначенную партицию.
+
+    Обработчики создаются при назначении партиций консумеру и останавливаются при их отзыве.
+    Количество одновременно работающих с БД обработчиков ограничено, чтобы не исчерпать
+    пул соединений.  Фидбеки всех обработчиков отправляет одна стадия FeedbackSender.  При
+    отзыве партиций смещения уже обработанных сообщений фиксируются до того, как партиции
+    достанутся другому консумеру группы
+
+    Args:
+        producer: продьюсер
+        session_factory: фабрика сессий
+        max_concurrency: сколько обработчиков одновременно работают с БД
+        executor: пул для разбора и проверки сообщений.  По умолчанию - пул потоков
+            цикла событий
+        committer: фиксация смещений обработанных сообщений.  Если не передана, то
+            смещения не отмечаются
+
+    """
+
+    def __init__(
+        self,
+        producer: AIOKafkaProducer,
+        session_factory: Callable[[], AsyncSession],
+        max_concurrency: int = None,
+        executor: Executor = None,
+        committer: OffsetCommitter = None,
+    ):
+        if max_concurrency is None:
+            max_concurrency = settings.kafka.workers_concurrency
+
+        self._producer = producer
+        self._session_factory = session_factory
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = executor
+        self._committer = committer
+        self._redelivery = Redelivery(producer)
+        self._feedback = None
+        self._workers: dict[TopicPartition, PartitionWorker] = {}
+
+    @property
+    def assignment(self) -> frozenset[TopicPartition]:
+        """Партиции, для которых запущены обработчики."""
+
+        return frozenset(self._workers)
+
+    async def on_partitions_revoked(self, revoked: set[TopicPartition]) -> None:
+        await self.stop(revoked)
+
+    async def on_partitions_assigned(self, assigned: set[TopicPartition]) -> None:
+        for tp in assigned:
+            self._get_worker(tp)
+
+    async def dispatch(
+        self,
+        batches: dict[TopicPartition, list[ConsumerRecord]],
+        consumer: AIOKafkaConsumer = None,
+    ):
+        """Распределение сообщений по обработчикам партиций.
+
+        Args:
+            batches: сообщения, сгруппированные по партициям
+            consumer: консумер, на котором приостанавливать партиции с заполненной очередью
+
+        """
+
+        for tp, records in batches.items():
+            await self._get_worker(tp).put(records, consumer)
+
+        if consumer is not None:
+            for worker in self._workers.values():
+                worker.seek(consumer)
+
+    async def stop(self, partitions: set[TopicPartition] = None) -> None:
+        """Останавливает обработчики.
+
+        Args:
+            partitions: партиции, обработчики которых нужно остановить.  Если не переданы,
+                то останавливаются все обработчики, отправка фидбеков и фиксация смещений
+
+        """
+
+        stop_all = partitions is None
+
+        if stop_all:
+            partitions = set(self._workers)
+
+        workers = [self._workers.pop(tp) for tp in partitions if tp in self._workers]
+        await asyncio.gather(*(worker.stop() for worker in workers))
+
+        if stop_all and self._feedback is not None:
+            await self._feedback.stop()
+            self._feedback = None
+        elif workers and self._feedback is not None:
+            # смещения отмечаются после отправки фидбеков, поэтому ее нужно дождаться
+            await self._feedback.join()
+
+        if self._committer is None:
+            return
+
+        if stop_all:
+            await self._committer.stop()
+        else:
+            await self._committer.commit(partitions)
+
+    def _get_worker(self, tp: TopicPartition) -> PartitionWorker:
+        # обработчик создается и здесь, тк при ручном назначении партиций (consumer.assign)
+        # ConsumerRebalanceListener не вызывается
+        if tp not in self._workers:
+            if self._feedback is None:
+                self._feedback = FeedbackSender(
+                    self._producer, self._committer, self._redelivery
+                )
+
+            self._workers[tp] = PartitionWorker(
+                tp,
+                self._session_factory(),
+                self._semaphore,
+                self._feedback,
+                self._redelivery,
+                self._executor,
+            )
+
+        return self._workers[tp]
+
+
+async def consume(consumer: AIOKafkaConsumer, workers: PartitionWorkers) -> None:
+    """Обработка сообщений из топика.
+
+    Сообщения забираются пачками не более settings.kafka.batch_size штук.  Если в буфере
+    консумера сообщений нет, то они ожидаются не дольше settings.kafka.batch_linger_ms.
+    Пачки распределяются по обработчикам партиций
+
+    Args:
+        consumer: консумер
+        workers: обработчики партиций
+
+    """
+
+    try:
+        while True:
+            try:
+                batches = await consumer.getmany(
+                    timeout_ms=settings.kafka.batch_linger_ms,
+                    max_records=settings.kafka.batch_size,
+                )
+            except ConsumerStoppedError:
+                break
+
+            await workers.dispatch(batches, consumer)
 
     finally:
+        await workers.stop()
         await consumer.stop()
+
+
+class Ingestion:
+    """Загрузка пользователей из топика: консумер, обработчики партиций и пул проверки.
+
+    Консумеры всех процессов с загрузкой входят в одну группу settings.kafka.group_id,
+    поэтому партиции топика распределяются между процессами.  Смещения фиксируются вручную
+    после записи пачки в БД и отправки фидбека (OffsetCommitter).  Консумер читает также
+    топики повторной обработки (Redelivery)
+
+    Args:
+        producer: запущенный продьюсер для фидбеков
+        session_factory: фабрика сессий
+
+    """
+
+    def __init__(
+        self,
+        producer: AIOKafkaProducer,
+        session_factory: Callable[[], AsyncSession],
+    ):
+        self._producer = producer
+        self._session_factory = session_factory
+        self._executor = None
+        self._consumer = None
+        self._task = None
+
+    @property
+    def task(self) -> asyncio.Task | None:
+        """Задача обработки сообщений, если загрузка запущена."""
+
+        return self._task
+
+    async def start(self) -> None:
+        self._executor = create_parse_executor()
+        self._consumer = AIOKafkaConsumer(
+            bootstrap_servers=settings.kafka.bootstrap_servers,
+            group_id=settings.kafka.group_id,
+            enable_auto_commit=False,
+        )
+        committer = OffsetCommitter(self._consumer)
+        workers = PartitionWorkers(
+            self._producer,
+            self._session_factory,
+            executor=self._executor,
+            committer=committer,
+        )
+        self._consumer.subscribe(
+            [settings.kafka.consume_topic, *get_retry_topics()], listener=workers
+        )
+        await self._consumer.start()
+        committer.start()
+        self._task = asyncio.create_task(
+            consume(self._consumer, workers), name="kafka-consume"
+        )
+
+    async def stop(self) -> None:
+        """Останавливает загрузку, дождавшись обработки уже полученных сообщений."""
+
+        if self._task is None:
+            return
+
+        # при отмене consume() дожидается обработчиков партиций и останавливает консумер
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._task = None
@@ -0,0 +1,570 @@
+"""Генератор нагрузки на топик пользователей и замер сквозной пропускной способности загрузки.
+
+Генератор отправляет в топик сообщения <ns2:Request> со случайными пользователями, часть из
+которых невалидна (пустое имя, email без @ или некорректная дата рождения).  Email каждого
+пользователя содержит идентификатор запуска и порядковый номер пользователя, поэтому и строку
+в БД, и фидбек, в том числе о невалидном пользователе, можно сопоставить с моментом отправки.
+
+При замере генератор, пока сообщения обрабатываются, опрашивает БД и читает топик фидбеков,
+а затем выводит пропускную способность и перцентили задержек от отправки до появления строки
+в БД и до получения фидбека.  Строка считается появившейся в момент опроса, в котором ее
+увидели, поэтому точность задержки до БД ограничена интервалом опроса
+
+Запуск из директории src:
+
+    python -m app.loadgen --count 10000 --invalid-ratio 0.1 --rate 10000
+
+"""
+
+import argparse
+import asyncio
+import math
+import random
+import re
+import sys
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator
+from xml.sax.saxutils import escape
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer, TopicPartition
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.kafka import MESSAGE_ID_HEADER
+from app.models import User
+from app.parsers import NAMESPACE
+
+EMAIL_DOMAIN = "loadgen.example.com"
+EMAIL_KEY = re.compile(r"^loadgen-(\w+)-(\d+)[@.]")
+
+NAMES = ("Иван", "Петр", "Сергей", "Анна", "Мария", "Ольга", "Алексей", "Елена")
+SURNAMES = ("Иванов", "Петров", "Сидоров", "Смирнов", "Кузнецов", "Попов", "Соколов")
+INVALID_FIELDS = ("name", "email", "birthday")
+
+REQUEST_START = f'<ns2:Request xmlns:ns2="{NAMESPACE}">'
+REQUEST_END = "</ns2:Request>"
+USER = (
+    "<ns2:User>"
+    "<ns2:Name>{}</ns2:Name>"
+    "<ns2:Surname>{}</ns2:Surname>"
+    "<ns2:Email>{}</ns2:Email>"
+    "<ns2:Birthday>{}</ns2:Birthday>"
+    "</ns2:User>"
+)
+
+
+class LoadRun:
+    """Пользователи, отправленные генератором за один запуск.
+
+    Args:
+        run_id: идентификатор запуска.  По умолчанию генерируется
+
+    """
+
+    def __init__(self, run_id: str = None):
+        if run_id is None:
+            run_id = uuid.uuid4().hex[:8]
+
+        self.run_id = run_id
+        self.messages = 0
+        # порядковый номер пользователя -> момент отправки по time.perf_counter
+        self.sent_at: dict[int, float] = {}
+        self.invalid: set[int] = set()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def users(self) -> int:
+        return len(self.sent_at)
+
+    @property
+    def valid(self) -> int:
+        return self.users - len(self.invalid)
+
+
+def generate_user(rng: random.Random, run_id: str, seq: int, invalid: bool) -> dict:
+    """Возвращает данные случайного пользователя в формате сообщения из топика.
+
+    Args:
+        rng: генератор случайных чисел
+        run_id: идентификатор запуска
+        seq: порядковый номер пользователя в запуске
+        invalid: сделать ли пользователя невалидным
+
+    """
+
+    birthday = datetime(1950, 1, 1, tzinfo=timezone(timedelta(hours=3)))
+    birthday += timedelta(seconds=rng.randrange(60 * 365 * 24 * 3600))
+    user_data = {
+        "name": rng.choice(NAMES),
+        "surname": rng.choice(SURNAMES),
+        "email": f"loadgen-{run_id}-{seq}@{EMAIL_DOMAIN}",
+        "birthday": birthday.isoformat(),
+    }
+
+    if invalid:
+        field = rng.choice(INVALID_FIELDS)
+
+        # номер пользователя остается в email, чтобы сопоставить с ним фидбек
+        if field == "name":
+            user_data["name"] = ""
+        elif field == "email":
+            user_data["email"] = f"loadgen-{run_id}-{seq}.{EMAIL_DOMAIN}"
+        else:
+            user_data["birthday"] = "не дата"
+
+    return user_data
+
+
+def render_request(users_data: Iterable[dict]) -> bytes:
+    """Возвращает сообщение <ns2:Request> с пользователями.
+
+    Args:
+        users_data: данные пользователей
+
+    """
+
+    parts = [REQUEST_START]
+    parts += [
+        USER.format(
+            escape(user_data["name"]),
+            escape(user_data["surname"]),
+            escape(user_data["email"]),
+            escape(user_data["birthday"]),
+        )
+        for user_data in users_data
+    ]
+    parts.append(REQUEST_END)
+
+    return "".join(parts).encode()
+
+
+def get_user_seq(run_id: str, email: str) -> int | None:
+    """Возвращает порядковый номер пользователя по email или None для чужого пользователя."""
+
+    match = EMAIL_KEY.match(email or "")
+
+    if match is None or match.group(1) != run_id:
+        return None
+
+    return int(match.group(2))
+
+
+def parse_feedback(msg: bytes) -> Iterator[tuple[str, int | None, str | None]]:
+    """Извлекает из фидбека статусы пользователей.
+
+    Args:
+        msg: фидбек
+
+    Returns:
+        статус и идентификатор пользователя или, для невалидного пользователя, его email
+
+    """
+
+    for elem in ET.fromstring(msg):
+        user_id = elem.findtext(f"{{{NAMESPACE}}}Id")
+        yield (
+            elem.findtext(f"{{{NAMESPACE}}}Status"),
+            int(user_id) if user_id is not None else None,
+            elem.findtext(f"{{{NAMESPACE}}}Email"),
+        )
+
+
+async def produce(
+    producer: AIOKafkaProducer,
+    topic: str,
+    count: int,
+    invalid_ratio: float = 0,
+    users_per_message: int = 1,
+    rate: float = None,
+    seed: int = None,
+    batch_size: int = 1000,
+    run: LoadRun = None,
+) -> LoadRun:
+    """Отправляет в топик сообщения со случайными пользователями.
+
+    Сообщения передаются продьюсеру без ожидания подтверждения каждого, а подтверждения
+    ожидаются пачками по batch_size сообщений
+
+    Args:
+        producer: продьюсер
+        topic: топик
+        count: количество сообщений
+        invalid_ratio: доля невалидных пользователей
+        users_per_message: количество пользователей в сообщении
+        rate: ограничение скорости отправки, сообщений в секунду.  Соблюдается в среднем
+            по пачкам
+        seed: начальное значение генератора случайных чисел
+        batch_size: размер пачки
+        run: запуск, который нужно заполнить, например, чтобы замерять обработку во время
+            отправки.  По умолчанию создается новый
+
+    """
+
+    if run is None:
+        run = LoadRun()
+
+    rng = random.Random(seed)
+    pending = []
+    run.started_at = time.perf_counter()
+
+    for number in range(count):
+        seqs = range(run.users, run.users + users_per_message)
+        users_data = []
+
+        for seq in seqs:
+            invalid = rng.random() < invalid_ratio
+            users_data.append(generate_user(rng, run.run_id, seq, invalid))
+
+            if invalid:
+                run.invalid.add(seq)
+
+        headers = [(MESSAGE_ID_HEADER, f"loadgen-{run.run_id}-{number}".encode())]
+        sent_at = time.perf_counter()
+        pending.append(
+            await producer.send(topic, render_request(users_data), headers=headers)
+        )
+        run.sent_at.update(dict.fromkeys(seqs, sent_at))
+        run.messages += 1
+
+        if len(pending) >= batch_size:
+            await asyncio.gather(*pending)
+            pending.clear()
+
+            if rate:
+                delay = run.started_at + run.messages / rate - time.perf_counter()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+    await asyncio.gather(*pending)
+    run.finished_at = time.perf_counter()
+
+    return run
+
+
+class IngestionReport:
+    """Сквозной замер загрузки пользователей, отправленных генератором.
+
+    Args:
+        run: запуск генератора
+
+    """
+
+    def __init__(self, run: LoadRun):
+        self.run = run
+        # порядковый номер пользователя -> момент появления строки в БД и получения фидбека
+        self.stored_at: dict[int, float] = {}
+        self.feedback_at: dict[int, float] = {}
+        self._seqs: dict[int, int] = {}
+        # фидбеки о пользователях, строки которых еще не видели в БД
+        self._unresolved: dict[int, float] = {}
+
+    @property
+    def done(self) -> bool:
+        return (
+            len(self.stored_at) >= self.run.valid
+            and len(self.feedback_at) >= self.run.users
+        )
+
+    def add_rows(self, rows: Iterable[tuple[int, str]], at: float) -> None:
+        """Отмечает появление строк пользователей в БД.
+
+        Args:
+            rows: идентификаторы и email пользователей
+            at: момент опроса БД
+
+        """
+
+        for user_id, email in rows:
+            seq = get_user_seq(self.run.run_id, email)
+
+            if seq is None or seq in self.stored_at:
+                continue
+
+            self.stored_at[seq] = at
+            self._seqs[user_id] = seq
+
+            if user_id in self._unresolved:
+                self.feedback_at.setdefault(seq, self._unresolved.pop(user_id))
+
+    def add_feedback(self, msg: bytes, at: float) -> None:
+        """Отмечает получение фидбека.
+
+        Args:
+            msg: фидбек
+            at: момент получения
+
+        """
+
+        for status, user_id, email in parse_feedback(msg):
+            if user_id is None:
+                seq = get_user_seq(self.run.run_id, email)
+            else:
+                seq = self._seqs.get(user_id)
+
+                if seq is None:
+                    # фидбек может обогнать опрос БД, либо это чужой пользователь
+                    self._unresolved.setdefault(user_id, at)
+                    continue
+
+            if seq is not None:
+                self.feedback_at.setdefault(seq, at)
+
+    def summary(self) -> str:
+        run = self.run
+        lines = [
+            f"запуск {run.run_id}",
+            f"отправка: сообщений {run.messages}, пользователей {run.users} "
+            f"(невалидных {len(run.invalid)}) за {run.finished_at - run.started_at:.2f} с, "
+            f"{_rate(run.messages, run.finished_at - run.started_at):.0f} сообщений/с",
+            self._throughput("строки в БД", self.stored_at, run.valid),
+            self._throughput("фидбеки", self.feedback_at, run.users),
+            "",
+            f"{'задержка, мс':<24}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}",
+            self._latencies("отправка -> БД", self.stored_at),
+            self._latencies("отправка -> фидбек", self.feedback_at),
+        ]
+
+        return "\n".join(lines)
+
+    def _throughput(self, title: str, arrived: dict[int, float], expected: int) -> str:
+        if not arrived:
+            return f"{title}: 0 из {expected}"
+
+        elapsed = max(arrived.values()) - self.run.started_at
+
+        return (
+            f"{title}: {len(arrived)} из {expected} за {elapsed:.2f} с от начала отправки, "
+            f"{_rate(len(arrived), elapsed):.0f} пользователей/с"
+        )
+
+    def _latencies(self, title: str, arrived: dict[int, float]) -> str:
+        latencies = sorted(
+            (at - self.run.sent_at[seq]) * 1000 for seq, at in arrived.items()
+        )
+
+        if not latencies:
+            return f"{title:<24}{'-':>10}{'-':>10}{'-':>10}{'-':>10}"
+
+        return (
+            f"{title:<24}{percentile(latencies, 50):>10.1f}"
+            f"{percentile(latencies, 90):>10.1f}{percentile(latencies, 99):>10.1f}"
+            f"{latencies[-1]:>10.1f}"
+        )
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Возвращает перцентиль отсортированных значений методом ближайшего ранга.
+
+    Args:
+        values: отсортированные значения
+        q: перцентиль, от 0 до 100
+
+    """
+
+    rank = max(math.ceil(len(values) * q / 100), 1)
+
+    return values[rank - 1]
+
+
+def _rate(count: int, elapsed: float) -> float:
+    return count / elapsed if elapsed > 0 else 0.0
+
+
+async def watch_rows(
+    session: AsyncSession,
+    report: IngestionReport,
+    after_id: int,
+    interval: float,
+    lag: float = 1,
+) -> None:
+    """Опрашивает БД и отмечает появление строк пользователей генератора.
+
+    Обработчики партиций фиксируют транзакции в произвольном порядке, поэтому строка
+    с меньшим id может появиться позже строки с большим.  Опрос поэтому начинается не
+    с наибольшего увиденного id, а с наибольшего id, увиденного lag секунд назад
+
+    Args:
+        session: сессия
+        report: замер
+        after_id: id, после которого искать строки
+        interval: интервал опроса, секунды
+        lag: сколько секунд строка может появиться позже строк с большим id
+
+    """
+
+    prefix = f"loadgen-{report.run.run_id}-%"
+    history = deque([(time.perf_counter(), after_id)])
+    max_id = after_id
+
+    while True:
+        while len(history) > 1 and history[1][0] <= time.perf_counter() - lag:
+            history.popleft()
+
+        stmt = (
+            select(User.id, User.email)
+            .where(User.id > history[0][1], User.email.like(prefix))
+            .order_by(User.id)
+        )
+        rows = (await session.execute(stmt)).all()
+        # транзакция сессии не держится между опросами, чтобы видеть новые строки
+        await session.rollback()
+        now = time.perf_counter()
+        report.add_rows(rows, now)
+
+        if rows:
+            max_id = max(max_id, rows[-1][0])
+
+        history.append((now, max_id))
+        await asyncio.sleep(interval)
+
+
+async def watch_feedback(consumer: AIOKafkaConsumer, report: IngestionReport) -> None:
+    """Читает фидбеки и отмечает их получение.
+
+    Args:
+        consumer: консумер, которому назначены партиции топика фидбеков
+        report: замер
+
+    """
+
+    while True:
+        batches = await consumer.getmany(timeout_ms=100)
+        now = time.perf_counter()
+
+        for records in batches.values():
+            for record in records:
+                report.add_feedback(record.value, now)
+
+
+async def start_feedback_consumer(topic: str) -> AIOKafkaConsumer:
+    """Запускает консумер, читающий топик фидбеков с текущего конца."""
+
+    consumer = AIOKafkaConsumer(bootstrap_servers=settings.kafka.bootstrap_servers)
+    await consumer.start()
+    # метаданные топика нужны, чтобы назначить его партиции без группы консумеров
+    await consumer.topics()
+    partitions = [
+        TopicPartition(topic, partition)
+        for partition in consumer.partitions_for_topic(topic) or ()
+    ]
+    consumer.assign(partitions)
+    await consumer.seek_to_end(*partitions)
+
+    # позиции вычисляются сразу, чтобы в замер не попали фидбеки, отправленные раньше
+    for tp in partitions:
+        await consumer.position(tp)
+
+    return consumer
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.loadgen",
+        description="Генератор нагрузки на топик пользователей",
+    )
+    parser.add_argument("--count", type=int, default=1000, help="количество сообщений")
+    parser.add_argument(
+        "--users-per-message",
+        type=int,
+        default=1,
+        help="количество пользователей в сообщении",
+    )
+    parser.add_argument(
+        "--invalid-ratio",
+        type=float,
+        default=0,
+        help="доля невалидных пользователей, от 0 до 1",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="ограничение скорости отправки, сообщений в секунду",
+    )
+    parser.add_argument("--seed", type=int, help="начальное значение генератора")
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="сколько секунд после отправки ждать обработки сообщений",
+    )
+    parser.add_argument(
+        "--poll-interval", type=float, default=0.1, help="интервал опроса БД, секунды"
+    )
+    parser.add_argument(
+        "--no-wait",
+        action="store_true",
+        help="только отправить сообщения, без замера обработки",
+    )
+
+    return parser.parse_args(argv)
+
+
+async def main(argv: list[str] = None) -> int:
+    args = parse_args(argv)
+    run = LoadRun()
+    producer = AIOKafkaProducer(bootstrap_servers=settings.kafka.bootstrap_servers)
+    await producer.start()
+
+    async def produce_run():
+        await produce(
+            producer,
+            settings.kafka.consume_topic,
+            args.count,
+            args.invalid_ratio,
+            args.users_per_message,
+            args.rate,
+            args.seed,
+            run=run,
+        )
+
+    try:
+        if args.no_wait:
+            await produce_run()
+            print(f"запуск {run.run_id}: отправлено сообщений {run.messages}")
+
+            return 0
+
+        consumer = await start_feedback_consumer(settings.kafka.feedback_topic)
+        report = IngestionReport(run)
+
+        async with SessionLocal() as session:
+            after_id = await session.scalar(select(func.coalesce(func.max(User.id), 0)))
+            await session.rollback()
+            tasks = [
+                asyncio.create_task(
+                    watch_rows(session, report, after_id, args.poll_interval)
+                ),
+                asyncio.create_task(watch_feedback(consumer, report)),
+            ]
+
+            try:
+                await produce_run()
+                deadline = time.perf_counter() + args.timeout
+
+                while not report.done and time.perf_counter() < deadline:
+                    await asyncio.sleep(args.poll_interval)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await consumer.stop()
+    finally:
+        await producer.stop()
+        await engine.dispose()
+
+    print(report.summary())
+
+    return 0 if report.done else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
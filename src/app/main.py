@@ -1,56 +1,92 @@
 import asyncio
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Query
+from starlette.responses import PlainTextResponse
 
-from aiokafka import AIOKafkaConsumer, AIOKafkaProducer
+from aiokafka import AIOKafkaProducer
+from app import loadgen
+from app.cache import users_cache
 from app.config import settings
-from app.database import SessionLocal
-from app.kafka import consume
-from app.repositories import UsersRepository
+from app.database import SessionLocal, engine
+from app.kafka import Ingestion
+from app.metrics import registry
+from app.middleware import RequestMiddleware
+from app.pool import pool_telemetry
 from app.routers import router
 
 app = FastAPI()
 app.include_router(router)
+app.add_middleware(RequestMiddleware)
+
 
 loop = asyncio.get_event_loop()
 
-consumer = AIOKafkaConsumer(
-    settings.kafka.consume_topic,
-    loop=loop,
-    bootstrap_servers=settings.kafka.bootstrap_servers,
-)
 producer = AIOKafkaProducer(
     loop=loop, bootstrap_servers=settings.kafka.bootstrap_servers
 )
+# загрузка из Kafka может выполняться отдельными процессами python -m app.worker, тогда
+# в процессах API она отключается настройкой KAFKA_INGESTION_ENABLED
+ingestion = Ingestion(producer, SessionLocal)
 
 
 @app.on_event("startup")
 async def startup_event():
     await producer.start()
-    await consumer.start()
-    users_repository = UsersRepository(session=SessionLocal())
-    loop.create_task(consume(consumer, producer, users_repository))
+
+    if settings.kafka.ingestion_enabled:
+        await ingestion.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await ingestion.stop()
     await producer.stop()
 
 
 @app.get("/produce")
-async def produce():
-    """Ручка для отправки тестовых сообщений в топик users."""
-
-    msg = """
-        <ns2:Request xmlns:ns2="urn://www.example.com">
-            <ns2:User>
-                <ns2:Name>Иван</ns2:Name>
-                <ns2:Surname>Иванов</ns2:Surname>
-                <ns2:Email>ivan.ivanov.2023.2024@yandex.com</ns2:Email>
-                <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
-            </ns2:User>
-        </ns2:Request>""".encode()
-
-    await producer.send(settings.kafka.consume_topic, msg)
-
-    return "Сообщение отправлено"
+async def produce(
+    count: int = Query(1, gt=0, le=100000, description="Количество сообщений"),
+    invalid_ratio: float = Query(
+        0, ge=0, le=1, description="Доля невалидных пользователей"
+    ),
+):
+    """Ручка для отправки тестовых сообщений в топик users.
+
+    Сообщения содержат случайных пользователей.  Для замера обработки используется
+    python -m app.loadgen
+
+    """
+
+    run = await loadgen.produce(
+        producer, settings.kafka.consume_topic, count, invalid_ratio
+    )
+
+    return {
+        "run_id": run.run_id,
+        "messages": run.messages,
+        "users": run.users,
+        "invalid": len(run.invalid),
+    }
+
+
+@app.get("/cache")
+async def cache_stats():
+    """Статистика кэша пользователей."""
+
+    return users_cache.stats()
+
+
+@app.get("/pool")
+async def pool_stats():
+    """Состояние и телеметрия пула соединений с БД."""
+
+    return pool_telemetry.stats(engine.pool)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Метрики приложения в текстовом формате Prometheus."""
+
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,339 @@
+"""Метрики приложения в текстовом формате Prometheus.
+
+Метрики хранятся в памяти процесса и отдаются ручкой /metrics без внешних сервисов.
+Приложение однопоточное (asyncio), поэтому значения обновляются простым присваиванием,
+без блокировок
+
+Собираются:
+    - длительность обработки HTTP-запросов по ручкам и количество обрабатываемых запросов;
+    - длительность выполнения пользовательских кейсов (декоратор timed);
+    - количество и длительность SQL-запросов по типам (instrument_engine);
+    - состояние пула соединений (app.pool);
+    - очереди и время обработки стадий загрузки из Kafka (app.kafka)
+"""
+
+import abc
+import bisect
+import functools
+import time
+from typing import Callable, Iterable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+# границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class GaugeValue:
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class HistogramValue:
+    """Гистограмма с накопительными корзинами, как в Prometheus."""
+
+    def __init__(self, buckets: Iterable[float] = BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """Возвращает границы корзин и количество значений, не превышающих их."""
+
+        result, total = [], 0
+
+        for bound, count in zip((*self.buckets, float("inf")), self._counts):
+            total += count
+            result.append((bound, total))
+
+        return result
+
+    def clear(self) -> None:
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": {str(bound): count for bound, count in self.cumulative()},
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class Metric(abc.ABC):
+    """Метрика - набор значений по сочетаниям меток.
+
+    Args:
+        name: название
+        documentation: описание
+        labelnames: названия меток
+
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def labels(self, *labelvalues: str):
+        """Возвращает значение метрики для сочетания меток."""
+
+        value = self._values.get(labelvalues)
+
+        if value is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}")
+
+            value = self._values[labelvalues] = self._new_value()
+
+        return value
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def collect(self) -> Iterator[str]:
+        """Возвращает строки метрики в текстовом формате Prometheus."""
+
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+
+        for labelvalues, value in sorted(self._values.items()):
+            yield from self._collect_value(
+                dict(zip(self.labelnames, labelvalues)), value
+            )
+
+    @abc.abstractmethod
+    def _new_value(self):
+        """Возвращает новое значение метрики для сочетания меток."""
+
+    def _collect_value(self, labels: dict, value) -> Iterator[str]:
+        yield f"{self.name}{_format_labels(labels)} {_format_value(value.value)}"
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _new_value(self):
+        return CounterValue()
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def _new_value(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _new_value(self):
+        return HistogramValue(self.buckets)
+
+    def _collect_value(self, labels: dict, value: HistogramValue) -> Iterator[str]:
+        for bound, count in value.cumulative():
+            bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+            yield f"{self.name}_bucket{bucket_labels} {count}"
+
+        yield f"{self.name}_sum{_format_labels(labels)} {_format_value(value.sum)}"
+        yield f"{self.name}_count{_format_labels(labels)} {value.count}"
+
+
+class Registry:
+    """Реестр метрик."""
+
+    def __init__(self):
+        self._metrics: list[Metric] = []
+        self._collectors: list[Callable[[], Iterable[Metric]]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+
+        return metric
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]) -> None:
+        """Добавляет функцию, возвращающую метрики, которые вычисляются при выдаче.
+
+        Args:
+            collector: функция без аргументов
+
+        """
+
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Возвращает все метрики в текстовом формате Prometheus."""
+
+        metrics = list(self._metrics)
+
+        for collector in self._collectors:
+            metrics += collector()
+
+        return "\n".join(line for metric in metrics for line in metric.collect()) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS_IN_FLIGHT = registry.register(
+    Gauge("http_requests_in_flight", "Количество обрабатываемых HTTP-запросов")
+)
+HTTP_REQUEST_DURATION = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Длительность обработки HTTP-запросов",
+        ("method", "route", "status"),
+    )
+)
+USE_CASE_DURATION = registry.register(
+    Histogram(
+        "use_case_duration_seconds",
+        "Длительность выполнения пользовательских кейсов",
+        ("use_case", "outcome"),
+    )
+)
+DB_QUERY_DURATION = registry.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Длительность выполнения SQL-запросов",
+        ("operation",),
+    )
+)
+
+
+def observe_request(method: str, route: str | None, status: int, duration: float):
+    """Учитывает обработанный HTTP-запрос.
+
+    Args:
+        method: метод
+        route: шаблон пути ручки или None, если ручка не найдена.  Метка - шаблон пути,
+            а не сам путь, чтобы количество меток было ограничено
+        status: код ответа
+        duration: длительность обработки, секунды
+
+    """
+
+    HTTP_REQUEST_DURATION.labels(
+        method, route if route is not None else "<unmatched>", str(status)
+    ).observe(duration)
+
+
+def timed(func):
+    """Декоратор, замеряющий длительность выполнения корутины.
+
+    Метка use_case - квалифицированное имя функции, outcome - success или error
+    """
+
+    name = func.__qualname__
+    success = USE_CASE_DURATION.labels(name, "success")
+    error = USE_CASE_DURATION.labels(name, "error")
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+
+        try:
+            result = await func(*args, **kwargs)
+        except BaseException:
+            error.observe(time.perf_counter() - started_at)
+            raise
+
+        success.observe(time.perf_counter() - started_at)
+
+        return result
+
+    return wrapper
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Подписывается на выполнение SQL-запросов движком.
+
+    Args:
+        engine: движок
+
+    """
+
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = getattr(context, "_query_started_at", None)
+
+    if started_at is None:
+        return
+
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+    DB_QUERY_DURATION.labels(operation).observe(time.perf_counter() - started_at)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+
+    pairs = ",".join(
+        f'{name}="{_escape(str(value))}"' for name, value in labels.items()
+    )
+
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
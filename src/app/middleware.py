@@ -0,0 +1,69 @@
+"""HTTP-middleware приложения.
+
+Метрики HTTP-запросов, профилирование и отметка занимающего пул соединений выполняются одним
+ASGI-middleware, а не отдельными слоями BaseHTTPMiddleware, каждый из которых на каждый запрос
+запускает свою задачу и оборачивает поток ответа
+"""
+
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.metrics import HTTP_REQUESTS_IN_FLIGHT, observe_request
+from app.pool import pool_holder
+from app.profiling import ProfiledRequest
+
+
+class RequestMiddleware:
+    """Middleware, замеряющий и при необходимости профилирующий HTTP-запросы.
+
+    Args:
+        app: ASGI-приложение
+
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # в телеметрии пула соединение, занятое при обработке запроса, отмечается ручкой
+        holder = pool_holder.set(f"{scope['method']} {scope['path']}")
+        profiled = ProfiledRequest.start(scope)
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels()
+        in_flight.inc()
+        started_at = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+
+                if profiled is not None:
+                    await profiled.finish(MutableHeaders(scope=message))
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+
+            if profiled is not None:
+                profiled.close()
+
+            pool_holder.reset(holder)
+            # маршрут записывается в scope роутером при обработке запроса
+            route = scope.get("route")
+            observe_request(
+                scope["method"],
+                route.path if route is not None else None,
+                status,
+                time.perf_counter() - started_at,
+            )
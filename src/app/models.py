@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import DateTime, String
+from sqlalchemy import DateTime, Index, String, func
 from sqlalchemy.orm import Mapped, mapped_column
 
 from app.database import Base
@@ -19,3 +19,45 @@ class User(Base):
     birthday: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), comment="Дата и время рождения"
     )
+    source_key: Mapped[str | None] = mapped_column(
+        String(255),
+        comment="Ключ сообщения, из которого создан пользователь.  "
+        "Уникален, чтобы повторная загрузка сообщения не создавала дубликат",
+    )
+
+
+Index("uq_users_source_key", User.source_key, unique=True)
+
+# индексы под фильтры и сортировки GET /users (app.filters.UsersFilter и UsersSorting)
+Index("ix_users_lower_email", func.lower(User.email))
+Index(
+    "ix_users_name_pattern", User.name, postgresql_ops={"name": "varchar_pattern_ops"}
+)
+Index(
+    "ix_users_surname_pattern",
+    User.surname,
+    postgresql_ops={"surname": "varchar_pattern_ops"},
+)
+Index("ix_users_name_id", User.name, User.id)
+Index("ix_users_surname_id", User.surname, User.id)
+Index("ix_users_birthday_id", User.birthday, User.id)
+
+# индексы под поиск GET /users/search (UsersRepository.search), требуют расширения pg_trgm
+Index(
+    "ix_users_name_trgm",
+    User.name,
+    postgresql_using="gin",
+    postgresql_ops={"name": "gin_trgm_ops"},
+)
+Index(
+    "ix_users_surname_trgm",
+    User.surname,
+    postgresql_using="gin",
+    postgresql_ops={"surname": "gin_trgm_ops"},
+)
+Index(
+    "ix_users_email_trgm",
+    User.email,
+    postgresql_using="gin",
+    postgresql_ops={"email": "gin_trgm_ops"},
+)
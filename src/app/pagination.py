@@ -1,18 +1,52 @@
-from typing import Generic, TypeVar
+import base64
+import binascii
+import json
+import math
+from enum import Enum
+from typing import Generic, Sequence, TypeVar
 
 from fastapi import Depends, Query
-from pydantic import AnyUrl, BaseModel, Field
-from sqlalchemy import Select, func, select
+from pydantic import AnyUrl, BaseModel, Field, TypeAdapter, ValidationError
+from pydantic_core import to_json
+from sqlalchemy import Select, func, inspect, select, text, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import InstrumentedAttribute
+from sqlalchemy.sql.expression import ClauseElement, Executable
 from starlette.requests import Request
+from starlette.responses import Response
 
+from app.cache import LRUCache
 from app.dependencies.database import get_session
+from app.exceptions import Http400
 
 M = TypeVar("M")
 
 
+class CountStrategy(str, Enum):
+    """Способ подсчета общего количества записей."""
+
+    exact = "exact"  # отдельный запрос count(*)
+    window = "window"  # count(*) OVER () в запросе страницы, без отдельного запроса
+    cached = "cached"  # результат count(*), закэшированный в count_cache
+    estimated = "estimated"  # оценка планировщика
+    none = "none"  # не считать
+
+
+class CountKind(str, Enum):
+    """Чем является возвращенное количество записей."""
+
+    exact = "exact"
+    cached = "cached"
+    estimated = "estimated"
+    none = "none"
+
+
 class PaginatedResponse(BaseModel, Generic[M]):
-    count: int = Field(description="Общее количество записей", example=22)
+    count: int | None = Field(
+        description="Общее количество записей, если оно считалось",
+        example=22,
+    )
     next: AnyUrl | None = Field(
         description="Ссылка на следующую страницу",
         example="http://localhost:8000/users?page=3&page_size=10",
@@ -21,12 +55,22 @@ class PaginatedResponse(BaseModel, Generic[M]):
         description="Ссылка на предыдущую страницу",
         example="http://localhost:8000/users?page=1&page_size=10",
     )
+    count_kind: CountKind = Field(
+        default=CountKind.exact,
+        description="Чем является общее количество записей",
+        example=CountKind.exact,
+    )
     results: list[M] = Field(description="Результат")
 
 
 class PageNumberPagination:
     """Пагинатор.
 
+    Общее количество записей считается способом count_strategy, который можно переопределить
+    в наследнике для отдельной ручки или параметром запроса count.  Параметр include_count=false
+    отключает подсчет.  Наличие следующей страницы определяется по лишней записи в запросе
+    страницы, поэтому ссылки корректны при любом способе подсчета
+
     Notes:
         Библиотека https://github.com/uriyyo/fastapi-pagination мне не понравилась из-за
         странной инициализации
@@ -37,12 +81,20 @@ class PageNumberPagination:
     """
 
     max_results = 100
+    count_strategy = CountStrategy.exact
+    count_cache = LRUCache(maxsize=1024, ttl=60)
 
     def __init__(
         self,
         request: Request,
         page: int = Query(1, gt=0),
         page_size: int = Query(10, gt=0),
+        count: CountStrategy = Query(
+            None, description="Способ подсчета общего количества записей"
+        ),
+        include_count: bool = Query(
+            True, description="Считать ли общее количество записей"
+        ),
         session: AsyncSession = Depends(get_session),
     ):
         self._request = request
@@ -51,6 +103,10 @@ class PageNumberPagination:
         self._page_size = (
             page_size if page_size <= self.max_results else self.max_results
         )
+        self._count_strategy = count or self.count_strategy
+
+        if not include_count:
+            self._count_strategy = CountStrategy.none
 
     async def get_page(self, stmt: Select) -> PaginatedResponse:
         """Возвращает результат пагинации в соответствии с фильтрами.
@@ -60,16 +116,62 @@ class PageNumberPagination:
 
         """
 
-        count = await self._get_count(stmt)
+        return PaginatedResponse(**await self._get_page_data(stmt))
 
-        return PaginatedResponse(
-            count=count,
-            next=self._get_next_page(count),
-            previous=self._get_previous_page(count),
-            results=await self._get_results(stmt),
-        )
+    async def get_json_page(self, stmt: Select) -> Response:
+        """Возвращает результат пагинации, сериализованный в JSON.
+
+        Предназначен для запросов колонок, а не сущностей: строки не превращаются в объекты
+        ORM и не валидируются, а сразу сериализуются в JSON.  Формат ответа совпадает
+        с PaginatedResponse, если колонки совпадают с полями схемы элемента
+
+        Args:
+            stmt: sql-запрос колонок
+
+        """
+
+        data = await self._get_page_data(stmt)
 
-    async def _get_count(self, stmt: Select) -> int:
+        return Response(content=to_json(data), media_type="application/json")
+
+    async def _get_page_data(self, stmt: Select) -> dict:
+        if self._count_strategy == CountStrategy.window:
+            results, count = await self._get_results_with_count(stmt)
+            count_kind = CountKind.exact
+        else:
+            count, count_kind = await self._get_count(stmt)
+            results = await self._get_results(stmt)
+
+        has_next = len(results) > self._page_size
+
+        return {
+            "count": count,
+            "next": self._get_next_page(has_next),
+            "previous": self._get_previous_page(count, count_kind),
+            "count_kind": count_kind,
+            "results": results[: self._page_size],
+        }
+
+    async def _get_count(self, stmt: Select) -> tuple[int | None, CountKind]:
+        """Возвращает общее количество элементов и чем оно является.
+
+        Args:
+            stmt: sql-запрос
+
+        """
+
+        if self._count_strategy == CountStrategy.none:
+            return None, CountKind.none
+
+        if self._count_strategy == CountStrategy.cached:
+            return await self._get_cached_count(stmt), CountKind.cached
+
+        if self._count_strategy == CountStrategy.estimated:
+            return await self._get_estimated_count(stmt), CountKind.estimated
+
+        return await self._get_exact_count(stmt), CountKind.exact
+
+    async def _get_exact_count(self, stmt: Select) -> int:
         """Возвращает общее количество элементов.
 
         Args:
@@ -83,34 +185,84 @@ class PageNumberPagination:
 
         return count
 
-    def _get_next_page(self, count: int) -> str:
-        """Возвращает ссылку на следующую страницу.
+    async def _get_cached_count(self, stmt: Select) -> int:
+        """Возвращает закэшированное общее количество элементов.
 
         Args:
-            count: общее количество элементов
+            stmt: sql-запрос
 
         """
 
-        total_pages = self._get_total_pages(count)
+        compiled = stmt.compile()
+        key = (str(compiled), tuple(sorted(compiled.params.items())))
+        count = self.count_cache.get(key)
 
-        if self._page >= total_pages:
+        if count is None:
+            count = await self._get_exact_count(stmt)
+            self.count_cache.set(key, count)
+
+        return count
+
+    async def _get_estimated_count(self, stmt: Select) -> int:
+        """Возвращает оценку общего количества элементов планировщиком БД.
+
+        Для запроса без фильтров оценка берется из статистики таблицы pg_class.reltuples,
+        в остальных случаях или если статистика еще не собрана - из плана запроса
+
+        Args:
+            stmt: sql-запрос
+
+        """
+
+        if stmt.whereclause is None and len(stmt.get_final_froms()) == 1:
+            table = stmt.get_final_froms()[0]
+            estimate = await self._session.scalar(
+                text(
+                    "SELECT reltuples::bigint FROM pg_class "
+                    "WHERE oid = to_regclass(:table)"
+                ),
+                {"table": table.name},
+            )
+
+            if estimate is not None and estimate >= 0:
+                return estimate
+
+        plan = await self._session.scalar(Explain(stmt))
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return plan[0]["Plan"]["Plan Rows"]
+
+    def _get_next_page(self, has_next: bool) -> str:
+        """Возвращает ссылку на следующую страницу.
+
+        Args:
+            has_next: есть ли записи после текущей страницы
+
+        """
+
+        if not has_next:
             return
 
         url = self._request.url.include_query_params(page=self._page + 1)
 
         return str(url)
 
-    def _get_previous_page(self, count: int) -> str:
+    def _get_previous_page(self, count: int | None, count_kind: CountKind) -> str:
         """Возвращает ссылку на предыдущую страницу.
 
         Args:
             count: общее количество элементов
+            count_kind: чем является count
 
         """
 
-        total_pages = self._get_total_pages(count)
+        if self._page <= 1:
+            return
 
-        if not (1 < self._page <= total_pages):
+        # по неточному количеству нельзя судить, существует ли текущая страница
+        if count_kind == CountKind.exact and self._page > self._get_total_pages(count):
             return
 
         url = self._request.url.include_query_params(page=self._page - 1)
@@ -125,14 +277,14 @@ class PageNumberPagination:
 
         """
 
-        return count // self._page_size + 1
+        return max(math.ceil(count / self._page_size), 1)
 
     @property
     def offset(self):
         return (self._page - 1) * self._page_size
 
     async def _get_results(self, stmt: Select) -> list[M]:
-        """Возвращает объекты.
+        """Возвращает объекты текущей страницы и первый объект следующей.
 
         Args:
             stmt: sql-запрос
@@ -143,7 +295,199 @@ class PageNumberPagination:
 
         """
 
-        stmt = stmt.limit(self._page_size).offset(self.offset)
-        results = await self._session.scalars(stmt)
+        stmt = stmt.limit(self._page_size + 1).offset(self.offset)
+        result = await self._session.execute(stmt)
+
+        if _selects_entity(stmt):
+            return result.scalars().all()
+
+        return [dict(row) for row in result.mappings()]
+
+    async def _get_results_with_count(self, stmt: Select) -> tuple[list[M], int]:
+        """Возвращает объекты и общее количество элементов одним запросом.
+
+        Args:
+            stmt: sql-запрос
+
+        """
+
+        page_stmt = stmt.add_columns(func.count().over())
+        page_stmt = page_stmt.limit(self._page_size + 1).offset(self.offset)
+        rows = (await self._session.execute(page_stmt)).all()
+
+        if not rows:
+            # за пределами последней страницы оконной функции не к чему примениться
+            return [], await self._get_exact_count(stmt)
+
+        if _selects_entity(stmt):
+            results = [row[0] for row in rows]
+        else:
+            keys = list(stmt.selected_columns.keys())
+            results = [dict(zip(keys, row[:-1])) for row in rows]
+
+        return results, rows[0][-1]
+
+
+def _selects_entity(stmt: Select) -> bool:
+    """Выбирает ли запрос одну сущность ORM, а не колонки."""
+
+    descriptions = stmt.column_descriptions
+
+    return (
+        len(descriptions) == 1 and descriptions[0]["expr"] is descriptions[0]["entity"]
+    )
+
+
+class Explain(Executable, ClauseElement):
+    """Запрос плана выполнения sql-запроса в формате JSON."""
+
+    inherit_cache = False
+
+    def __init__(self, stmt: Select):
+        self.stmt = stmt
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element: Explain, compiler, **kw) -> str:
+    return "EXPLAIN (FORMAT JSON) " + compiler.process(element.stmt, **kw)
+
+
+class CursorPagination:
+    """Пагинатор по ключу (keyset).
+
+    Вместо OFFSET страница отбирается условием по упорядоченному ключу, начиная с ключа последней
+    записи предыдущей страницы, поэтому при наличии индекса по ключу любая страница отбирается
+    одинаково быстро, а записи не дублируются и не пропадают между страницами.  Ключ передается
+    в ссылках на соседние страницы в виде непрозрачного курсора
+
+    Notes:
+        Ключ должен быть уникальным (например, id или (surname, id)), а все его колонки
+        сортируются в одном направлении, тк сравнение кортежей в БД не поддерживает разные
+        направления
+
+    """
+
+    max_results = 100
+
+    def __init__(
+        self,
+        request: Request,
+        cursor: str = Query(None, description="Курсор страницы"),
+        page_size: int = Query(10, gt=0),
+        session: AsyncSession = Depends(get_session),
+    ):
+        self._request = request
+        self._session = session
+        self._cursor = cursor
+        self._page_size = (
+            page_size if page_size <= self.max_results else self.max_results
+        )
+
+    async def get_page(
+        self,
+        stmt: Select,
+        ordering: Sequence[InstrumentedAttribute] = None,
+        descending: bool = False,
+    ) -> PaginatedResponse:
+        """Возвращает страницу, следующую за курсором.
+
+        Args:
+            stmt: sql-запрос
+            ordering: ключ пагинации.  По умолчанию - первичный ключ
+            descending: ключ сортируется по убыванию
+
+        """
+
+        if ordering is None:
+            entity = stmt.column_descriptions[0]["entity"]
+            ordering = inspect(entity).primary_key
+
+        backwards, values = self._decode_cursor(ordering)
+        key = tuple_(*ordering)
+        # при движении назад записи отбираются в обратном порядке
+        reverse = backwards != descending
+
+        if values is not None:
+            stmt = stmt.where(
+                key < tuple_(*values) if reverse else key > tuple_(*values)
+            )
+
+        stmt = stmt.order_by(
+            *(column.desc() if reverse else column for column in ordering)
+        )
+
+        results = await self._session.scalars(stmt.limit(self._page_size + 1))
+        results = results.all()
+        has_more = len(results) > self._page_size
+        results = results[: self._page_size]
+
+        if backwards:
+            results.reverse()
+
+        # при движении назад следующая страница есть всегда - это та, с которой пришли
+        has_next = results and (has_more if not backwards else True)
+        has_previous = results and (has_more if backwards else values is not None)
+
+        return PaginatedResponse(
+            count=None,
+            count_kind=CountKind.none,
+            next=self._get_link(results[-1], ordering) if has_next else None,
+            previous=(
+                self._get_link(results[0], ordering, backwards=True)
+                if has_previous
+                else None
+            ),
+            results=results,
+        )
+
+    def _get_link(
+        self, result, ordering: Sequence[InstrumentedAttribute], backwards=False
+    ) -> str:
+        """Возвращает ссылку на соседнюю страницу.
+
+        Args:
+            result: крайняя запись текущей страницы
+            ordering: ключ пагинации
+            backwards: ссылка на предыдущую страницу
+
+        """
+
+        values = [getattr(result, column.key) for column in ordering]
+        cursor = base64.urlsafe_b64encode(to_json([backwards, values]))
+        url = self._request.url.include_query_params(
+            cursor=cursor.rstrip(b"=").decode()
+        )
+
+        return str(url)
+
+    def _decode_cursor(
+        self, ordering: Sequence[InstrumentedAttribute]
+    ) -> tuple[bool, list | None]:
+        """Возвращает направление и значения ключа из курсора.
+
+        Args:
+            ordering: ключ пагинации
+
+        """
+
+        if not self._cursor:
+            return False, None
+
+        try:
+            cursor = base64.urlsafe_b64decode(
+                self._cursor + "=" * (-len(self._cursor) % 4)
+            )
+            backwards, values = json.loads(cursor)
+
+            if len(values) != len(ordering):
+                raise ValueError
+
+            # значения ключа приводятся к типам колонок, тк в json, например, нет дат
+            values = [
+                TypeAdapter(column.type.python_type).validate_python(value)
+                for column, value in zip(ordering, values)
+            ]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            raise Http400("Некорректный курсор")
 
-        return results.all()
+        return bool(backwards), values
@@ -0,0 +1,115 @@
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Iterable, Iterator
+
+NAMESPACE = "urn://www.example.com"
+
+# квалифицированные имена тегов вычисляются один раз, чтобы при разборе сравнивать строки,
+# а не выполнять поиск по XPath с пространствами имен
+FIELDS = {
+    f"{{{NAMESPACE}}}Name": "name",
+    f"{{{NAMESPACE}}}Surname": "surname",
+    f"{{{NAMESPACE}}}Email": "email",
+    f"{{{NAMESPACE}}}Birthday": "birthday",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ParseError(ValueError):
+    """Сообщение не удалось разобрать."""
+
+
+def iter_users(chunks: Iterable[bytes], partial: bool = False) -> Iterator[dict]:
+    """Потоковое извлечение данных пользователей из документа <ns2:Request>.
+
+    Документ разбирается за один проход по мере поступления частей, а разобранные элементы
+    пользователей сразу удаляются из родительских, поэтому документ с большим количеством
+    <ns2:User> не строится в памяти целиком.  Пользователем считается любой элемент, дочерние элементы
+    которого содержат поля пользователя
+
+    Args:
+        chunks: части XML-документа в байтах
+        partial: возвращать пользователей, у которых не хватает полей, без этих полей,
+            чтобы они были отклонены при проверке, а не прерывали разбор
+
+    Raises:
+        ParseError: если XML некорректен или у пользователя не хватает полей и partial
+            не передан
+
+    """
+
+    parser = ET.XMLPullParser(events=("start", "end"))
+    # открытые элементы от корня до текущего
+    stack = []
+
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from _read_users(parser, stack, partial)
+
+        parser.close()
+    except ET.ParseError as e:
+        raise ParseError(str(e)) from e
+
+    yield from _read_users(parser, stack, partial)
+
+
+def iter_file_users(file: BinaryIO, partial: bool = False) -> Iterator[dict]:
+    """Потоковое извлечение данных пользователей из файла.
+
+    Args:
+        file: файл, открытый в бинарном режиме
+        partial: возвращать пользователей, у которых не хватает полей (см. iter_users)
+
+    """
+
+    return iter_users(iter(lambda: file.read(CHUNK_SIZE), b""), partial)
+
+
+def parse(msg: bytes) -> list[dict]:
+    """Извлечение данных пользователей из сообщения.
+
+    Args:
+        msg: сообщение из топика
+
+    Raises:
+        ParseError: если сообщение не удалось разобрать
+
+    """
+
+    chunks = (msg[i : i + CHUNK_SIZE] for i in range(0, len(msg), CHUNK_SIZE))
+
+    return list(iter_users(chunks))
+
+
+def _read_users(
+    parser: ET.XMLPullParser, stack: list[ET.Element], partial: bool
+) -> Iterator[dict]:
+    for event, elem in parser.read_events():
+        if event == "start":
+            stack.append(elem)
+            continue
+
+        stack.pop()
+
+        # поля нужны родительскому элементу пользователя
+        if elem.tag in FIELDS:
+            continue
+
+        # закрытый элемент - последний дочерний у родителя.  Он удаляется, иначе корень
+        # накапливает все разобранные элементы пользователей
+        if stack:
+            del stack[-1][-1]
+
+        user_data = {
+            FIELDS[child.tag]: child.text or "" for child in elem if child.tag in FIELDS
+        }
+
+        if not user_data:
+            continue
+
+        if len(user_data) != len(FIELDS) and not partial:
+            missing = set(FIELDS.values()) - set(user_data)
+            raise ParseError(f"Не найдены поля пользователя: {sorted(missing)}")
+
+        yield user_data
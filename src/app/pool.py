@@ -0,0 +1,177 @@
+"""Телеметрия пула соединений с БД.
+
+Для пула собираются гистограммы времени ожидания соединения и времени, в течение которого
+соединение было занято, а также самые долгие занятия соединения с указанием того, кто его занимал.
+Занимающий определяется переменной контекста pool_holder (например, ручкой), а если она не задана -
+именем задачи asyncio
+"""
+
+import asyncio
+import heapq
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from app.config import settings
+from app.metrics import Gauge, Histogram, Metric, registry
+
+# кто занимает соединение - например, "GET /users"
+pool_holder: ContextVar[str | None] = ContextVar("pool_holder", default=None)
+
+
+class PoolTelemetry:
+    """Сборщик телеметрии пула соединений.
+
+    Args:
+        slow_holds: сколько самых долгих занятий соединения хранить
+
+    """
+
+    def __init__(self, slow_holds: int = 10):
+        self.wait_time = Histogram(
+            "db_pool_wait_seconds", "Время ожидания соединения из пула"
+        )
+        self.hold_time = Histogram(
+            "db_pool_hold_seconds", "Время, в течение которого соединение было занято"
+        )
+        self.timeouts = 0
+        self._slow_holds = slow_holds
+        # куча из (длительность, кто занимал), на вершине - самое короткое из хранимых
+        self._slowest: list[tuple[float, str]] = []
+        self._pool = None
+        self._max_overflow = None
+
+    def instrument(self, engine: AsyncEngine, max_overflow: int) -> None:
+        """Подписывается на выдачу и возврат соединений пулом движка.
+
+        Args:
+            engine: движок
+            max_overflow: сколько соединений пул движка может открыть сверх pool_size
+
+        """
+
+        event.listen(engine.sync_engine, "checkout", self._on_checkout)
+        event.listen(engine.sync_engine, "checkin", self._on_checkin)
+        self._pool = engine.pool
+        self._max_overflow = max_overflow
+
+    def collect(self) -> list[Metric]:
+        """Возвращает метрики пула для /metrics."""
+
+        if self._pool is None:
+            return []
+
+        gauges = {
+            "db_pool_size": ("Размер пула", self._pool.size()),
+            "db_pool_checked_out": ("Занятые соединения", self._pool.checkedout()),
+            "db_pool_overflow": (
+                "Соединения сверх размера пула",
+                self._pool.overflow(),
+            ),
+            "db_pool_timeouts": ("Количество таймаутов ожидания", self.timeouts),
+        }
+        metrics = []
+
+        for name, (documentation, value) in gauges.items():
+            gauge = Gauge(name, documentation)
+            gauge.set(value)
+            metrics.append(gauge)
+
+        return [*metrics, self.wait_time, self.hold_time]
+
+    def observe_wait(self, duration: float, timed_out: bool = False) -> None:
+        self.wait_time.observe(duration)
+
+        if timed_out:
+            self.timeouts += 1
+
+    def stats(self, pool: AsyncAdaptedQueuePool) -> dict:
+        """Возвращает состояние пула и собранную телеметрию.
+
+        Args:
+            pool: пул соединений
+
+        """
+
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": self._max_overflow,
+            "timeout": pool.timeout(),
+            "timeouts": self.timeouts,
+            "wait_time": self.wait_time.labels().to_dict(),
+            "hold_time": self.hold_time.labels().to_dict(),
+            "slowest_holds": [
+                {"holder": holder, "duration": duration}
+                for duration, holder in sorted(self._slowest, reverse=True)
+            ],
+        }
+
+    def clear(self) -> None:
+        self.wait_time.clear()
+        self.hold_time.clear()
+        self.timeouts = 0
+        self._slowest.clear()
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+        connection_record.info["holder"] = _get_holder()
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        holder = connection_record.info.pop("holder", None)
+
+        if checked_out_at is None:
+            return
+
+        duration = time.perf_counter() - checked_out_at
+        self.hold_time.observe(duration)
+
+        if len(self._slowest) < self._slow_holds:
+            heapq.heappush(self._slowest, (duration, holder))
+        elif duration > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (duration, holder))
+
+
+class TelemetryPool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий время ожидания соединения.
+
+    Время ожидания включает создание нового соединения, если свободных нет, но лимит
+    max_overflow не исчерпан, и проверку соединения, если включен pool_pre_ping
+
+    """
+
+    def connect(self):
+        started_at = time.perf_counter()
+
+        try:
+            connection = super().connect()
+        except TimeoutError:
+            pool_telemetry.observe_wait(time.perf_counter() - started_at, True)
+            raise
+
+        pool_telemetry.observe_wait(time.perf_counter() - started_at)
+
+        return connection
+
+
+def _get_holder() -> str:
+    if (holder := pool_holder.get()) is not None:
+        return holder
+
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+
+    return task.get_name() if task is not None else "-"
+
+
+pool_telemetry = PoolTelemetry(slow_holds=settings.db.pool_slow_holds)
+registry.add_collector(pool_telemetry.collect)
@@ -0,0 +1,221 @@
+"""Профилирование отдельных HTTP-запросов.
+
+Профилирование включается настройкой PROFILING_ENABLED.  Профилируются запросы с заголовком
+X-Profile и доля PROFILING_SAMPLE_RATE остальных запросов.  Для такого запроса собираются все
+SQL-запросы с длительностями, итог отдается заголовками X-Query-Count и X-DB-Time-ms, а
+обработчик выполняется под cProfile.  Если задан PROFILING_DIRECTORY, то полный профиль
+сохраняется на диск: статистика cProfile в <имя>.prof (смотреть через pstats или snakeviz),
+SQL-запросы - в <имя>.sql.json, а имя отдается заголовком X-Profile-Name.  Если один и тот же
+SQL-запрос повторяется PROFILING_REPEATED_QUERIES и более раз (признак N+1), то в лог пишется
+предупреждение
+
+Для потоковых ответов учитываются только запросы, выполненные до начала отправки ответа
+"""
+
+import asyncio
+import cProfile
+import json
+import logging
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import Scope
+
+from app.config import settings
+
+LOGGER = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+
+
+class RequestProfile:
+    """SQL-запросы, выполненные при обработке HTTP-запроса.
+
+    Args:
+        name: название профилируемого запроса, например, "GET /users"
+
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.queries: list[tuple[str, float]] = []
+
+    @property
+    def db_time(self) -> float:
+        """Суммарная длительность SQL-запросов, секунды."""
+
+        return sum(duration for _, duration in self.queries)
+
+    def repeated(self, threshold: int) -> dict[str, int]:
+        """Возвращает SQL-запросы, выполненные не менее threshold раз, и количество их повторов.
+
+        Параметры запросов передаются отдельно от текста, поэтому одинаковый текст означает
+        один и тот же запрос, выполненный с разными параметрами
+
+        Args:
+            threshold: минимальное количество повторов
+
+        """
+
+        counts = Counter(statement for statement, _ in self.queries)
+
+        return {
+            statement: count
+            for statement, count in counts.most_common()
+            if count >= threshold
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "query_count": len(self.queries),
+            "db_time": self.db_time,
+            "queries": [
+                {"statement": statement, "duration": duration}
+                for statement, duration in self.queries
+            ],
+        }
+
+
+# профиль обрабатываемого HTTP-запроса.  Если не задан, то запрос не профилируется
+current_profile: ContextVar[RequestProfile | None] = ContextVar(
+    "current_profile", default=None
+)
+
+# cProfile в потоке может работать только один, поэтому остальные запросы, пришедшие во время
+# профилирования, получают только статистику SQL-запросов
+_profiler_busy = False
+
+
+class ProfiledRequest:
+    """Профилирование HTTP-запроса от начала обработки до начала отправки ответа.
+
+    Args:
+        name: название запроса, например, "GET /users"
+
+    """
+
+    def __init__(self, name: str):
+        global _profiler_busy
+
+        self.profile = RequestProfile(name)
+        self._token = current_profile.set(self.profile)
+        self._profiler = None
+
+        if not _profiler_busy:
+            _profiler_busy = True
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @classmethod
+    def start(cls, scope: Scope) -> "ProfiledRequest | None":
+        """Начинает профилирование, если запрос нужно профилировать.
+
+        Args:
+            scope: ASGI scope запроса
+
+        """
+
+        if not _should_profile(Headers(scope=scope)):
+            return None
+
+        return cls(f"{scope['method']} {scope['path']}")
+
+    async def finish(self, headers: MutableHeaders) -> None:
+        """Останавливает профилирование и добавляет его итоги в заголовки ответа.
+
+        Args:
+            headers: заголовки ответа
+
+        """
+
+        profiler = self._stop_profiler()
+        profile = self.profile
+        headers["X-Query-Count"] = str(len(profile.queries))
+        headers["X-DB-Time-ms"] = f"{profile.db_time * 1000:.1f}"
+
+        for statement, count in profile.repeated(
+            settings.profiling.repeated_queries
+        ).items():
+            LOGGER.warning(
+                f"{profile.name}: SQL-запрос выполнен {count} раз, возможно N+1: {statement}"
+            )
+
+        if settings.profiling.directory is not None:
+            name = await asyncio.to_thread(
+                _save, Path(settings.profiling.directory), profile, profiler
+            )
+            headers["X-Profile-Name"] = name
+
+    def close(self) -> None:
+        """Завершает профилирование после обработки запроса."""
+
+        self._stop_profiler()
+        current_profile.reset(self._token)
+
+    def _stop_profiler(self) -> cProfile.Profile | None:
+        global _profiler_busy
+
+        profiler, self._profiler = self._profiler, None
+
+        if profiler is not None:
+            profiler.disable()
+            _profiler_busy = False
+
+        return profiler
+
+
+def profile_engine(engine: AsyncEngine) -> None:
+    """Подписывается на выполнение SQL-запросов движком для профилирования.
+
+    Args:
+        engine: движок
+
+    """
+
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _should_profile(headers: Headers) -> bool:
+    if not settings.profiling.enabled:
+        return False
+
+    return PROFILE_HEADER in headers or random.random() < settings.profiling.sample_rate
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile.get() is not None:
+        context._profile_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile.get()
+    started_at = getattr(context, "_profile_started_at", None)
+
+    if profile is not None and started_at is not None:
+        profile.queries.append((statement, time.perf_counter() - started_at))
+
+
+def _save(
+    directory: Path, profile: RequestProfile, profiler: cProfile.Profile | None
+) -> str:
+    path = re.sub(r"[^\w.-]+", "_", profile.name).strip("_")
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{path}-{uuid.uuid4().hex[:8]}"
+    directory.mkdir(parents=True, exist_ok=True)
+
+    if profiler is not None:
+        profiler.dump_stats(directory / f"{name}.prof")
+
+    with open(directory / f"{name}.sql.json", "w", encoding="utf-8") as file:
+        json.dump(profile.to_dict(), file, ensure_ascii=False, indent=2)
+
+    return name
@@ -1,9 +1,27 @@
 from typing import Any
 
 import sqlalchemy.exc
-from sqlalchemy import BinaryExpression, select
+from sqlalchemy import (
+    BinaryExpression,
+    Row,
+    RowMapping,
+    any_,
+    bindparam,
+    delete,
+    func,
+    insert,
+    inspect,
+    literal,
+    literal_column,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.filters import escape_like
 from app.models import User
 
 
@@ -37,6 +55,129 @@ class Repository:
 
         return instance
 
+    async def create_returning(self, **create_data) -> Row:
+        """Создание объекта одним запросом INSERT ... RETURNING.
+
+        Args:
+            create_data: данные, из которых должен быть создан объект
+
+        Returns:
+            созданная строка таблицы
+
+        Notes:
+            В отличие от create объект в сессию не добавляется, а запрос выполняется сразу
+
+        """
+
+        stmt = insert(self.model).values(**create_data).returning(*self._columns)
+        result = await self._session.execute(stmt)
+
+        return result.one()
+
+    async def create_many(self, create_data: list[dict]) -> list:
+        """Создание объектов одним запросом INSERT ... RETURNING.
+
+        Args:
+            create_data: список данных, из которых должны быть созданы объекты
+
+        Returns:
+            значения первичных ключей созданных объектов в порядке create_data
+
+        Notes:
+            В отличие от create объекты в сессию не добавляются, а запрос выполняется сразу
+
+        """
+
+        if not create_data:
+            return []
+
+        pk = inspect(self.model).primary_key[0]
+        stmt = insert(self.model).returning(pk, sort_by_parameter_order=True)
+        result = await self._session.scalars(stmt, create_data)
+
+        return result.all()
+
+    async def upsert_many(
+        self, create_data: list[dict], conflict_key: str
+    ) -> list[tuple[Any, bool]]:
+        """Идемпотентное создание объектов одним запросом INSERT ... ON CONFLICT ... RETURNING.
+
+        Если объект с таким же значением conflict_key уже есть, то новый не создается, а
+        возвращается первичный ключ существующего.  Существующий объект не изменяется
+
+        Args:
+            create_data: список данных, из которых должны быть созданы объекты.  Значения
+                conflict_key в списке должны быть уникальны
+            conflict_key: поле с уникальным индексом
+
+        Returns:
+            значения первичных ключей и признаки того, что объект создан, в порядке create_data
+
+        Notes:
+            ON CONFLICT DO NOTHING не возвращает существующие строки, поэтому используется
+            DO UPDATE с присвоением того же значения.  Строка, вставленная этим запросом,
+            отличается от обновленной нулевым xmax
+
+        """
+
+        if not create_data:
+            return []
+
+        pk = inspect(self.model).primary_key[0]
+        key = self.model.__table__.c[conflict_key]
+        stmt = postgresql.insert(self.model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[key], set_={conflict_key: stmt.excluded[conflict_key]}
+        )
+        # sort_by_parameter_order с ON CONFLICT генерирует некорректный запрос, поэтому
+        # строки сопоставляются с данными по значению conflict_key
+        stmt = stmt.returning(key, pk, literal_column("xmax = 0"))
+        result = await self._session.execute(stmt, create_data)
+        rows = {
+            key_value: (pk_value, created) for key_value, pk_value, created in result
+        }
+
+        return [rows[data[conflict_key]] for data in create_data]
+
+    async def copy_many(self, create_data: list[dict]) -> list:
+        """Создание объектов через COPY.
+
+        COPY не умеет возвращать созданные строки, поэтому значения первичного ключа заранее
+        выделяются из последовательности одним запросом и передаются явно
+
+        Args:
+            create_data: список данных с одинаковым набором полей, из которых должны быть
+                созданы объекты
+
+        Returns:
+            значения первичных ключей созданных объектов в порядке create_data
+
+        """
+
+        if not create_data:
+            return []
+
+        table = self.model.__table__
+        pk = inspect(self.model).primary_key[0]
+        sequence = func.pg_get_serial_sequence(table.fullname, pk.name)
+        stmt = select(func.nextval(sequence)).select_from(
+            func.generate_series(1, len(create_data))
+        )
+        pk_values = (await self._session.scalars(stmt)).all()
+
+        columns = [pk.name, *create_data[0]]
+        records = [
+            (pk_value, *data.values()) for pk_value, data in zip(pk_values, create_data)
+        ]
+
+        connection = await self._session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            table.name, records=records, columns=columns, schema_name=table.schema
+        )
+
+        return pk_values
+
     async def get(self, *whereclause: BinaryExpression, pk_value: Any = None):
         """Возвращает единственный объект.
 
@@ -63,6 +204,23 @@ class Repository:
 
         return result.one()
 
+    async def get_values(self, *columns, pk_value: Any) -> RowMapping:
+        """Возвращает значения колонок объекта по первичному ключу без создания объекта ORM.
+
+        Args:
+            columns: колонки
+            pk_value: значение первичного ключа
+
+        Raises:
+            sqlalchemy.exc.NoResultFound: если объекта нет
+
+        """
+
+        pk = inspect(self.model).primary_key[0]
+        result = await self._session.execute(select(*columns).where(pk == pk_value))
+
+        return result.mappings().one()
+
     async def update(self, instance, **update_data):
         """Обновление объекта.
 
@@ -79,6 +237,114 @@ class Repository:
 
         return instance
 
+    async def update_returning(self, pk_value: Any, **update_data) -> Row:
+        """Обновление объекта одним запросом UPDATE ... WHERE pk = :pk_value RETURNING.
+
+        Args:
+            pk_value: значение первичного ключа объекта для обновления
+            update_data: данные для обновления
+
+        Returns:
+            обновленная строка таблицы
+
+        Raises:
+            sqlalchemy.exc.NoResultFound: если объекта нет
+
+        """
+
+        pk = inspect(self.model).primary_key[0]
+        stmt = (
+            update(self.model)
+            .where(pk == pk_value)
+            .values(**update_data)
+            .returning(*self._columns)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self._session.execute(stmt)
+
+        return result.one()
+
+    async def update_many(self, pk_values: list, **update_data) -> list:
+        """Обновление объектов одним запросом UPDATE ... WHERE pk = ANY(...) RETURNING.
+
+        Args:
+            pk_values: значения первичных ключей объектов для обновления
+            update_data: данные для обновления
+
+        Returns:
+            обновленные объекты.  Объекты, которых нет, пропускаются
+
+        """
+
+        stmt = (
+            update(self.model)
+            .where(self._pk_in(pk_values))
+            .values(**update_data)
+            .returning(self.model)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self._session.scalars(stmt)
+
+        return result.all()
+
+    async def delete_returning(self, pk_value: Any) -> Any:
+        """Удаление объекта одним запросом DELETE ... WHERE pk = :pk_value RETURNING pk.
+
+        Args:
+            pk_value: значение первичного ключа объекта для удаления
+
+        Returns:
+            значение первичного ключа удаленного объекта
+
+        Raises:
+            sqlalchemy.exc.NoResultFound: если объекта нет
+
+        """
+
+        pk = inspect(self.model).primary_key[0]
+        stmt = (
+            delete(self.model)
+            .where(pk == pk_value)
+            .returning(pk)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self._session.scalars(stmt)
+
+        return result.one()
+
+    async def delete_many(self, pk_values: list) -> list:
+        """Удаление объектов одним запросом DELETE ... WHERE pk = ANY(...) RETURNING.
+
+        Args:
+            pk_values: значения первичных ключей объектов для удаления
+
+        Returns:
+            значения первичных ключей удаленных объектов
+
+        """
+
+        pk = inspect(self.model).primary_key[0]
+        stmt = (
+            delete(self.model)
+            .where(self._pk_in(pk_values))
+            .returning(pk)
+            .execution_options(synchronize_session=False)
+        )
+        result = await self._session.scalars(stmt)
+
+        return result.all()
+
+    @property
+    def _columns(self) -> list:
+        return list(self.model.__table__.columns)
+
+    def _pk_in(self, pk_values: list) -> BinaryExpression:
+        # значения передаются одним параметром-массивом, а не параметром на каждое значение,
+        # поэтому текст запроса не зависит от их количества
+        pk = inspect(self.model).primary_key[0]
+
+        return pk == any_(bindparam("pk_values", pk_values, type_=ARRAY(pk.type)))
+
     async def delete(self, instance: object):
         """Удаляет объект.
 
@@ -89,6 +355,25 @@ class Repository:
 
         await self._session.delete(instance)
 
+    async def set_local(self, parameters: dict[str, Any]) -> None:
+        """Устанавливает параметры сеанса БД до конца текущей транзакции (SET LOCAL).
+
+        Все параметры устанавливаются одним запросом
+
+        Args:
+            parameters: названия и значения параметров, например {"statement_timeout": 500}
+
+        """
+
+        await self._session.execute(
+            select(
+                *(
+                    func.set_config(name, str(value), True)
+                    for name, value in parameters.items()
+                )
+            )
+        )
+
     async def commit(self):
         await self._session.commit()
 
@@ -100,3 +385,41 @@ class UsersRepository(Repository):
     """Репозиторий для работы с пользователями."""
 
     model = User
+
+    async def search(self, query: str, limit: int) -> list[User]:
+        """Поиск пользователей по части имени, фамилии или email.
+
+        Пользователь находится, если запрос входит в поле как подстрока или похож
+        на слово в нем.  Оба условия используют триграммные GIN-индексы pg_trgm
+
+        Args:
+            query: поисковый запрос
+            limit: максимальное количество пользователей
+
+        Notes:
+            Порог схожести задается параметром сеанса pg_trgm.word_similarity_threshold
+
+        Returns:
+            пользователи по убыванию схожести
+
+        """
+
+        pattern = "%" + escape_like(query) + "%"
+        columns = (User.name, User.surname, User.email)
+        rank = func.greatest(
+            *(func.word_similarity(query, column) for column in columns)
+        )
+        stmt = (
+            select(User)
+            .where(
+                or_(
+                    *(column.ilike(pattern, escape="\\") for column in columns),
+                    *(literal(query).op("<%")(column) for column in columns),
+                )
+            )
+            .order_by(rank.desc(), User.id)
+            .limit(limit)
+        )
+        result = await self._session.scalars(stmt)
+
+        return result.all()
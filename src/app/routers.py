@@ -1,16 +1,34 @@
 import logging
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Response
 from sqlalchemy import select
 from starlette import status
+from starlette.responses import StreamingResponse
 
+from app.dependencies.bulk import get_bulk_rows
+from app.export import StreamingExport
+from app.filters import UsersFilter, UsersSorting
 from app.models import User
-from app.pagination import PageNumberPagination, PaginatedResponse
-from app.schemas import UserCreateData, UserSchema, UserUpdateData
+from app.pagination import CursorPagination, PageNumberPagination, PaginatedResponse
+from app.schemas import (
+    BulkCreateResult,
+    BulkDeleteData,
+    BulkDeleteResult,
+    BulkUpdateData,
+    BulkUpdateResult,
+    UserCreateData,
+    UserSchema,
+    UserUpdateData,
+)
 from app.usecases import (
+    USER_COLUMNS,
+    BulkCreateUsersUseCase,
+    BulkDeleteUsersUseCase,
+    BulkUpdateUsersUseCase,
     CreateUserUseCase,
     DeleteUserUseCase,
     GetUserUseCase,
+    SearchUsersUseCase,
     UpdateUserUseCase,
 )
 
@@ -20,15 +38,118 @@ router = APIRouter(prefix="/users", tags=["Пользователи"])
 
 
 @router.get("", response_model=PaginatedResponse[UserSchema])
-async def list_users(paginator: PageNumberPagination = Depends()):
-    stmt = select(User)
+async def list_users(
+    users_filter: UsersFilter = Depends(),
+    sorting: UsersSorting = Depends(),
+    paginator: PageNumberPagination = Depends(),
+):
+    stmt = sorting.sort(users_filter.filter(select(*USER_COLUMNS)))
+
+    # строки сериализуются сразу, минуя объекты ORM и response_model
+    return await paginator.get_json_page(stmt=stmt)
+
+
+@router.get(
+    "/cursor",
+    response_model=PaginatedResponse[UserSchema],
+    summary="Возвращает пользователей с пагинацией по курсору",
+)
+async def list_users_by_cursor(
+    users_filter: UsersFilter = Depends(),
+    sorting: UsersSorting = Depends(),
+    paginator: CursorPagination = Depends(),
+):
+    stmt = users_filter.filter(select(User))
+    ordering, descending = sorting.ordering
+
+    return await paginator.get_page(stmt=stmt, ordering=ordering, descending=descending)
 
-    return await paginator.get_page(stmt=stmt)
+
+@router.get(
+    "/export",
+    summary="Выгружает всех пользователей",
+    description="Отдает пользователей потоком в формате NDJSON или CSV в порядке ID.  "
+    "Прерванную выгрузку можно продолжить, передав в after_id последний полученный ID",
+    response_class=StreamingResponse,
+)
+async def export_users(
+    users_filter: UsersFilter = Depends(), exporter: StreamingExport = Depends()
+):
+    # выгрузка всегда упорядочена по id, чтобы ее можно было продолжить, поэтому
+    # сортировка не принимается
+    stmt = users_filter.filter(select(User))
+
+    return exporter.get_response(stmt=stmt, schema=UserSchema, filename="users")
+
+
+@router.get(
+    "/search",
+    response_model=list[UserSchema],
+    summary="Ищет пользователей",
+    description="Ищет пользователей по части имени, фамилии или email с учетом опечаток.  "
+    "Пользователи упорядочены по убыванию схожести с запросом",
+)
+async def search_users(
+    q: str = Query(min_length=3, max_length=255, description="Поисковый запрос"),
+    limit: int = Query(10, gt=0, description="Количество пользователей"),
+    use_case: SearchUsersUseCase = Depends(),
+):
+    return await use_case.search_users(q, limit)
+
+
+@router.post(
+    "/bulk",
+    response_model=BulkCreateResult,
+    summary="Создает пользователей пачкой",
+    description="Принимает JSON-массив или NDJSON (Content-Type: application/x-ndjson) "
+    "с данными пользователей.  Невалидные строки пропускаются и возвращаются в errors",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "items": {"$ref": "#/components/schemas/UserCreateData"},
+                    }
+                },
+                "application/x-ndjson": {
+                    "schema": {"$ref": "#/components/schemas/UserCreateData"}
+                },
+            },
+        }
+    },
+)
+async def bulk_create_users(
+    rows=Depends(get_bulk_rows), use_case: BulkCreateUsersUseCase = Depends()
+):
+    return await use_case.create_users(rows)
+
+
+@router.patch(
+    "/bulk", response_model=BulkUpdateResult, summary="Обновляет пользователей пачкой"
+)
+async def bulk_update_users(
+    update_data: BulkUpdateData, use_case: BulkUpdateUsersUseCase = Depends()
+):
+    return await use_case.update_users(update_data)
+
+
+@router.delete(
+    "/bulk", response_model=BulkDeleteResult, summary="Удаляет пользователей пачкой"
+)
+async def bulk_delete_users(
+    delete_data: BulkDeleteData, use_case: BulkDeleteUsersUseCase = Depends()
+):
+    return await use_case.delete_users(delete_data)
 
 
 @router.get("/{user_id}", response_model=UserSchema, summary="Возвращает пользователя")
 async def get_user(user_id: int, use_case: GetUserUseCase = Depends()):
-    return await use_case.get_user_or_404(user_id)
+    content = await use_case.get_user_or_404(user_id)
+
+    # пользователь уже сериализован, поэтому отдается как есть, минуя response_model
+    return Response(content=content, media_type="application/json")
 
 
 @router.post(
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Any
 
 from pydantic import BaseModel, EmailStr, Field
 
@@ -34,3 +35,32 @@ class UserUpdateData(BaseModel):
         default=None, max_length=255, title="Email", example="serg.ivanov@rtk.ru"
     )
     birthday: datetime = Field(default=None, title="Дата и время рождения")
+
+
+class BulkRowError(BaseModel):
+    index: int = Field(title="Номер строки", example=0)
+    errors: list[dict[str, Any]] = Field(title="Ошибки валидации")
+
+
+class BulkCreateResult(BaseModel):
+    ids: list[int] = Field(title="ID созданных пользователей", example=[1, 2])
+    errors: list[BulkRowError] = Field(title="Невалидные строки")
+
+
+class BulkUpdateData(BaseModel):
+    ids: list[int] = Field(min_length=1, title="ID пользователей", example=[1, 2])
+    changes: UserUpdateData = Field(title="Изменения")
+
+
+class BulkUpdateResult(BaseModel):
+    updated: list[UserSchema] = Field(title="Обновленные пользователи")
+    not_found: list[int] = Field(title="ID ненайденных пользователей", example=[3])
+
+
+class BulkDeleteData(BaseModel):
+    ids: list[int] = Field(min_length=1, title="ID пользователей", example=[1, 2])
+
+
+class BulkDeleteResult(BaseModel):
+    deleted: list[int] = Field(title="ID удаленных пользователей", example=[1, 2])
+    not_found: list[int] = Field(title="ID ненайденных пользователей", example=[3])
@@ -3,17 +3,39 @@
 """
 
 import logging
+import time
+from typing import AsyncIterator
 
 import sqlalchemy.exc
 from fastapi import Depends
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from pydantic_core import to_json
 
+from app.cache import users_cache
+from app.config import settings
 from app.dependencies.repositories import get_users_repository
-from app.exceptions import Http404
+from app.exceptions import Http400, Http404, Http503
+from app.metrics import timed
+from app.models import User
 from app.repositories import UsersRepository
-from app.schemas import UserCreateData, UserUpdateData
+from app.schemas import (
+    BulkCreateResult,
+    BulkDeleteData,
+    BulkDeleteResult,
+    BulkRowError,
+    BulkUpdateData,
+    BulkUpdateResult,
+    UserCreateData,
+    UserSchema,
+    UserUpdateData,
+)
 
 LOGGER = logging.getLogger(__name__)
 
+# колонки пользователя, соответствующие полям UserSchema, для чтения без объектов ORM
+USER_COLUMNS = [getattr(User, field) for field in UserSchema.model_fields]
+
 
 class GetUserUseCase:
     def __init__(
@@ -21,13 +43,30 @@ class GetUserUseCase:
     ):
         self._users_repository = users_repository
 
-    async def get_user_or_404(self, user_id: int):
+    @timed
+    async def get_user_or_404(self, user_id: int) -> bytes:
+        """Возвращает пользователя, сериализованного в JSON.
+
+        Пользователи кэшируются в users_cache, одновременные запросы одного и того же
+        отсутствующего в кэше пользователя выполняют один запрос к БД
+
+        Args:
+            user_id: идентификатор пользователя
+
+        """
+
+        return await users_cache.get_or_load(user_id, lambda: self._load(user_id))
+
+    async def _load(self, user_id: int) -> bytes:
+        # строка из БД сериализуется сразу, без объекта ORM и валидации UserSchema
         try:
-            user = await self._users_repository.get(pk_value=user_id)
+            user = await self._users_repository.get_values(
+                *USER_COLUMNS, pk_value=user_id
+            )
         except sqlalchemy.exc.NoResultFound:
             raise Http404
 
-        return user
+        return to_json(dict(user))
 
 
 class CreateUserUseCase:
@@ -36,12 +75,82 @@ class CreateUserUseCase:
     ):
         self._users_repository = users_repository
 
-    async def create_user(self, create_data: UserCreateData):
-        user = await self._users_repository.create(**create_data.model_dump())
+    @timed
+    async def create_user(self, create_data: UserCreateData) -> UserSchema:
+        # созданная строка возвращается тем же запросом, поэтому перечитывать ее не нужно
+        user = await self._users_repository.create_returning(**create_data.model_dump())
         await self._users_repository.commit()
-        await self._users_repository.refresh(user)
 
-        return user
+        return UserSchema.model_validate(user)
+
+
+class BulkCreateUsersUseCase:
+    """Массовое создание пользователей.
+
+    Строки валидируются и загружаются пачками по chunk_size.  Пачки не меньше copy_threshold
+    строк загружаются через COPY, остальные - одним INSERT ... RETURNING.  Все пачки загружаются
+    в одной транзакции
+
+    """
+
+    chunk_size = 5000
+    copy_threshold = 100
+
+    def __init__(
+        self, users_repository: UsersRepository = Depends(get_users_repository)
+    ):
+        self._users_repository = users_repository
+
+    @timed
+    async def create_users(self, rows: AsyncIterator[dict | bytes]) -> BulkCreateResult:
+        """Создает пользователей из валидных строк.
+
+        Args:
+            rows: строки - данные пользователя или JSON с ними
+
+        Returns:
+            идентификаторы созданных пользователей и ошибки валидации невалидных строк
+
+        """
+
+        started_at = time.perf_counter()
+        ids, errors, chunk, index = [], [], [], 0
+
+        async for row in rows:
+            try:
+                if isinstance(row, bytes):
+                    create_data = UserCreateData.model_validate_json(row)
+                else:
+                    create_data = UserCreateData.model_validate(row)
+            except ValidationError as e:
+                errors.append(
+                    BulkRowError(index=index, errors=jsonable_encoder(e.errors()))
+                )
+            else:
+                chunk.append(create_data.model_dump())
+
+            index += 1
+
+            if len(chunk) == self.chunk_size:
+                ids += await self._create(chunk)
+                chunk = []
+
+        ids += await self._create(chunk)
+        await self._users_repository.commit()
+
+        elapsed = time.perf_counter() - started_at
+        LOGGER.info(
+            f"Создано {len(ids)} пользователей из {index} строк за {elapsed:.3f} с "
+            f"({index / elapsed:.0f} строк/с)"
+        )
+
+        return BulkCreateResult(ids=ids, errors=errors)
+
+    async def _create(self, chunk: list[dict]) -> list[int]:
+        if len(chunk) < self.copy_threshold:
+            return await self._users_repository.create_many(chunk)
+
+        return await self._users_repository.copy_many(chunk)
 
 
 class UpdateUserUseCase:
@@ -50,32 +159,156 @@ class UpdateUserUseCase:
     ):
         self._users_repository = users_repository
 
-    async def update_user_or_404(self, user_id: int, update_data: UserUpdateData):
+    @timed
+    async def update_user_or_404(
+        self, user_id: int, update_data: UserUpdateData
+    ) -> UserSchema:
+        changes = update_data.model_dump(exclude_unset=True)
+
         try:
-            user = await self._users_repository.get(pk_value=user_id)
+            if changes:
+                user = await self._users_repository.update_returning(user_id, **changes)
+            else:
+                # обновлять нечего, но ответ должен быть таким же, как при обновлении
+                user = await self._users_repository.get(pk_value=user_id)
         except sqlalchemy.exc.NoResultFound:
             raise Http404
 
-        user = await self._users_repository.update(
-            user, **update_data.model_dump(exclude_unset=True)
-        )
+        user = UserSchema.model_validate(user)
         await self._users_repository.commit()
-        await self._users_repository.refresh(user)
+        users_cache.delete(user_id)
 
         return user
 
 
+class BulkUpdateUsersUseCase:
+    """Массовое обновление пользователей.
+
+    Пользователи обновляются пачками по chunk_size идентификаторов, по одному запросу на пачку
+
+    """
+
+    chunk_size = 5000
+
+    def __init__(
+        self, users_repository: UsersRepository = Depends(get_users_repository)
+    ):
+        self._users_repository = users_repository
+
+    @timed
+    async def update_users(self, update_data: BulkUpdateData) -> BulkUpdateResult:
+        changes = update_data.changes.model_dump(exclude_unset=True)
+
+        if not changes:
+            raise Http400("Не переданы изменения")
+
+        ids = list(dict.fromkeys(update_data.ids))
+        updated = []
+
+        for i in range(0, len(ids), self.chunk_size):
+            chunk = ids[i : i + self.chunk_size]
+            users = await self._users_repository.update_many(chunk, **changes)
+            # после коммита объекты будут просрочены, поэтому сериализуются сразу
+            updated += [UserSchema.model_validate(user) for user in users]
+
+        await self._users_repository.commit()
+
+        updated_ids = {user.id for user in updated}
+
+        for user_id in updated_ids:
+            users_cache.delete(user_id)
+
+        return BulkUpdateResult(
+            updated=updated,
+            not_found=[user_id for user_id in ids if user_id not in updated_ids],
+        )
+
+
 class DeleteUserUseCase:
     def __init__(
         self, users_repository: UsersRepository = Depends(get_users_repository)
     ):
         self._users_repository = users_repository
 
+    @timed
     async def delete_user_or_404(self, user_id: int):
         try:
-            user = await self._users_repository.get(pk_value=user_id)
+            await self._users_repository.delete_returning(user_id)
         except sqlalchemy.exc.NoResultFound:
             raise Http404
 
-        await self._users_repository.delete(user)
         await self._users_repository.commit()
+        users_cache.delete(user_id)
+
+
+class BulkDeleteUsersUseCase:
+    """Массовое удаление пользователей.
+
+    Пользователи удаляются пачками по chunk_size идентификаторов, по одному запросу на пачку
+
+    """
+
+    chunk_size = 5000
+
+    def __init__(
+        self, users_repository: UsersRepository = Depends(get_users_repository)
+    ):
+        self._users_repository = users_repository
+
+    @timed
+    async def delete_users(self, delete_data: BulkDeleteData) -> BulkDeleteResult:
+        ids = list(dict.fromkeys(delete_data.ids))
+        deleted = []
+
+        for i in range(0, len(ids), self.chunk_size):
+            chunk = ids[i : i + self.chunk_size]
+            deleted += await self._users_repository.delete_many(chunk)
+
+        await self._users_repository.commit()
+
+        for user_id in deleted:
+            users_cache.delete(user_id)
+
+        deleted_ids = set(deleted)
+
+        return BulkDeleteResult(
+            deleted=[user_id for user_id in ids if user_id in deleted_ids],
+            not_found=[user_id for user_id in ids if user_id not in deleted_ids],
+        )
+
+
+class SearchUsersUseCase:
+    """Поиск пользователей по части имени, фамилии или email.
+
+    Количество найденных пользователей и время выполнения запроса ограничены, чтобы
+    слишком общий запрос не занимал соединение с БД
+
+    """
+
+    def __init__(
+        self, users_repository: UsersRepository = Depends(get_users_repository)
+    ):
+        self._users_repository = users_repository
+
+    @timed
+    async def search_users(self, query: str, limit: int) -> list[UserSchema]:
+        await self._users_repository.set_local(
+            {
+                "statement_timeout": settings.search.statement_timeout_ms,
+                "pg_trgm.word_similarity_threshold": (
+                    settings.search.similarity_threshold
+                ),
+            }
+        )
+
+        try:
+            users = await self._users_repository.search(
+                query, min(limit, settings.search.max_results)
+            )
+        except sqlalchemy.exc.DBAPIError as e:
+            # query_canceled - запрос прерван по statement_timeout
+            if getattr(e.orig, "sqlstate", None) == "57014":
+                raise Http503("Поиск не уложился в отведенное время, уточните запрос")
+            raise
+
+        return [UserSchema.model_validate(user) for user in users]
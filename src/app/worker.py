@@ -0,0 +1,193 @@
+"""Процессы загрузки пользователей из Kafka отдельно от API.
+
+Супервизор запускает несколько процессов, в каждом из которых свой цикл событий, свой движок
+с пулом соединений (settings.db.pool_size на процесс) и свой консумер.  Консумеры входят
+в одну группу, поэтому партиции топика распределяются между процессами, в том числе
+запущенными на других узлах.  Упавший процесс перезапускается.  По SIGTERM или SIGINT
+процессы останавливаются, дождавшись обработки уже полученных сообщений
+
+Загрузку в процессах API при этом нужно отключить настройкой KAFKA_INGESTION_ENABLED=false.
+
+Запуск из директории src:
+
+    python -m app.worker --processes 4
+
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Callable
+
+from aiokafka import AIOKafkaProducer
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.kafka import Ingestion
+
+LOGGER = logging.getLogger(__name__)
+
+
+async def serve() -> int:
+    """Загрузка пользователей в текущем процессе до сигнала остановки.
+
+    Returns:
+        код завершения процесса
+
+    """
+
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+
+    producer = AIOKafkaProducer(bootstrap_servers=settings.kafka.bootstrap_servers)
+    await producer.start()
+    ingestion = Ingestion(producer, SessionLocal)
+
+    try:
+        await ingestion.start()
+        stop = asyncio.create_task(stopping.wait())
+        await asyncio.wait({stop, ingestion.task}, return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+        # загрузка не должна завершаться сама, иначе процесс перезапускается
+        failed = not stopping.is_set()
+
+        if failed and not ingestion.task.cancelled():
+            if (error := ingestion.task.exception()) is not None:
+                LOGGER.error("Загрузка завершилась с ошибкой", exc_info=error)
+    finally:
+        await ingestion.stop()
+        await producer.stop()
+        await engine.dispose()
+
+    return 1 if failed else 0
+
+
+def run_process() -> None:
+    """Точка входа процесса загрузки."""
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(serve()))
+
+
+class Supervisor:
+    """Супервизор процессов загрузки.
+
+    Args:
+        processes: количество процессов
+        restart_delay: через сколько секунд перезапускать упавший процесс
+        target: точка входа процесса
+
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        restart_delay: float = 1,
+        target: Callable[[], None] = run_process,
+    ):
+        self.restarts = 0
+        self._processes = processes
+        self._restart_delay = restart_delay
+        self._target = target
+        # процессы запускаются заново, а не форком супервизора, чтобы не унаследовать
+        # его состояние
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: dict[int, BaseProcess] = {}
+        self._stopping = False
+
+    def run(self) -> int:
+        """Запускает процессы и перезапускает упавшие до вызова stop()."""
+
+        for index in range(self._processes):
+            self._start(index)
+
+        while not self._stopping:
+            wait([worker.sentinel for worker in self._workers.values()], timeout=1)
+
+            for index, worker in list(self._workers.items()):
+                if worker.is_alive() or self._stopping:
+                    continue
+
+                LOGGER.error(
+                    f"Процесс загрузки {worker.pid} завершился с кодом {worker.exitcode}, "
+                    f"перезапуск через {self._restart_delay} с"
+                )
+                time.sleep(self._restart_delay)
+
+                if not self._stopping:
+                    self._start(index)
+                    self.restarts += 1
+
+        return self._shutdown()
+
+    def _start(self, index: int) -> None:
+        worker = self._context.Process(
+            target=self._target, name=f"ingestion-worker-{index}"
+        )
+        worker.start()
+        self._workers[index] = worker
+        LOGGER.info(f"Запущен процесс загрузки {worker.pid}")
+
+    def stop(self) -> None:
+        """Останавливает процессы.  Может вызываться из обработчика сигнала."""
+
+        self._stopping = True
+
+    def _shutdown(self, timeout: float = 30) -> int:
+        for worker in self._workers.values():
+            if worker.is_alive():
+                worker.terminate()
+
+        deadline = time.monotonic() + timeout
+
+        for worker in self._workers.values():
+            worker.join(max(deadline - time.monotonic(), 0))
+
+            if worker.is_alive():
+                LOGGER.error(f"Процесс загрузки {worker.pid} не остановился, kill")
+                worker.kill()
+                worker.join()
+
+        return 0
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m app.worker",
+        description="Процессы загрузки пользователей из Kafka",
+    )
+    parser.add_argument(
+        "--processes", type=int, default=1, help="количество процессов загрузки"
+    )
+    parser.add_argument(
+        "--restart-delay",
+        type=float,
+        default=1,
+        help="через сколько секунд перезапускать упавший процесс",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    supervisor = Supervisor(args.processes, args.restart_delay)
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: supervisor.stop())
+
+    return supervisor.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
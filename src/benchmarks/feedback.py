@@ -0,0 +1,104 @@
+"""Сравнение app.feedback с прежними шаблонами фидбеков.
+
+Прежние шаблоны собирают XML с отступами через f-строку или format_map, обрезают и кодируют
+его на каждого пользователя.  Пачка из 500 пользователей сравнивается с отправкой 500 отдельных
+фидбеков.
+
+Запуск из директории src:
+
+    python -m benchmarks.feedback
+
+"""
+
+import timeit
+
+from app.feedback import render_batch
+
+USER_DATA = {
+    "name": "Иван",
+    "surname": "Иванов",
+    "email": "ivan.ivanov.2023.2024@yandex.com",
+    "birthday": "2005-10-23T04:00:00+03:00",
+}
+
+
+def legacy_success(user_id: int) -> bytes:
+    msg = f"""
+        <ns2:Response xmlns:ns2="urn://www.example.com">
+            <ns2:KafkaUser>
+                <ns2:Id>{user_id}</ns2:Id>
+                <ns2:Status>SUCCESS</ns2:Status>
+            </ns2:KafkaUser>
+        </ns2:Response>
+    """
+
+    return msg.strip().encode()
+
+
+def legacy_failed(user_data: dict) -> bytes:
+    msg = """
+        <ns2:Response xmlns:ns2="urn://www.example.com">
+            <ns2:KafkaUser>
+                <ns2:Name>{name}</ns2:Name>
+                <ns2:Surname>{surname}</ns2:Surname>
+                <ns2:Email>{email}</ns2:Email>
+                <ns2:Birthday>{birthday}</ns2:Birthday>
+                <ns2:Status>FAILED</ns2:Status
+            </ns2:KafkaUser>
+        </ns2:Response>
+    """.format_map(
+        user_data
+    )
+
+    return msg.strip().encode()
+
+
+def measure(func, number: int) -> float:
+    """Возвращает лучшее время одного вызова в микросекундах."""
+
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    user_ids = list(range(1, 501))
+    failed = [USER_DATA] * 500
+
+    rows = [
+        (
+            "успешный фидбек",
+            measure(lambda: legacy_success(1), 100000),
+            measure(lambda: render_batch([1], []), 100000),
+        ),
+        (
+            "неуспешный фидбек",
+            measure(lambda: legacy_failed(USER_DATA), 100000),
+            measure(lambda: render_batch([], [USER_DATA]), 100000),
+        ),
+        (
+            "пачка 500 + 500 пользователей",
+            measure(
+                lambda: (
+                    [legacy_success(user_id) for user_id in user_ids],
+                    [legacy_failed(user_data) for user_data in failed],
+                ),
+                200,
+            ),
+            measure(lambda: render_batch(user_ids, failed), 200),
+        ),
+    ]
+
+    print(f"{'фидбек':<32}{'legacy, мкс':>14}{'feedback, мкс':>16}{'ускорение':>12}")
+
+    for title, legacy, current in rows:
+        print(f"{title:<32}{legacy:>14.2f}{current:>16.2f}{legacy / current:>11.2f}x")
+
+    print()
+    print("размер фидбека на пачку, байт:")
+    legacy_size = sum(len(legacy_success(user_id)) for user_id in user_ids)
+    legacy_size += sum(len(legacy_failed(user_data)) for user_data in failed)
+    print(f"  legacy:   {legacy_size}")
+    print(f"  feedback: {len(render_batch(user_ids, failed))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Сравнение app.parsers.parse с прежней реализацией разбора сообщений.
+
+Прежняя реализация декодирует сообщение в строку, строит дерево целиком и выполняет четыре
+поиска по XPath, при этом читает только первого пользователя.  Поэтому большой документ
+сравнивается с эквивалентным количеством сообщений с одним пользователем.  Потребление
+памяти на большом документе сравнивается с построением дерева целиком.
+
+Запуск из директории src:
+
+    python -m benchmarks.parse
+
+"""
+
+import timeit
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from app.parsers import parse
+
+USER = """
+    <ns2:User>
+        <ns2:Name>Иван</ns2:Name>
+        <ns2:Surname>Иванов</ns2:Surname>
+        <ns2:Email>ivan.ivanov.{i}@yandex.com</ns2:Email>
+        <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+    </ns2:User>
+"""
+
+
+def legacy_parse(msg: str) -> dict:
+    xml = ET.fromstring(msg)
+    namespaces = {"ns2": "urn://www.example.com"}
+    name = xml.find(".//ns2:Name", namespaces).text
+    surname = xml.find(".//ns2:Surname", namespaces).text
+    email = xml.find(".//ns2:Email", namespaces).text
+    birthday = xml.find(".//ns2:Birthday", namespaces).text
+
+    return {
+        "name": name or "",
+        "surname": surname or "",
+        "email": email or "",
+        "birthday": birthday or "",
+    }
+
+
+def make_payload(users: int) -> bytes:
+    body = "".join(USER.format(i=i) for i in range(users))
+
+    return (
+        f'<ns2:Request xmlns:ns2="urn://www.example.com">{body}</ns2:Request>'.encode()
+    )
+
+
+def measure(func, number: int) -> float:
+    """Возвращает лучшее время одного вызова в микросекундах."""
+
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def peak_memory(func) -> int:
+    """Возвращает пиковое потребление памяти вызовом в килобайтах."""
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak // 1024
+
+
+def main():
+    small = make_payload(1)
+    singles = [make_payload(1) for _ in range(500)]
+    large = make_payload(500)
+
+    rows = [
+        (
+            "1 пользователь",
+            measure(lambda: legacy_parse(small.decode()), 10000),
+            measure(lambda: parse(small), 10000),
+        ),
+        (
+            "500 сообщений по 1 пользователю",
+            measure(lambda: [legacy_parse(msg.decode()) for msg in singles], 20),
+            measure(lambda: [parse(msg) for msg in singles], 20),
+        ),
+        (
+            "1 сообщение с 500 пользователями",
+            # прежняя реализация не умеет читать больше одного пользователя
+            None,
+            measure(lambda: parse(large), 20),
+        ),
+    ]
+
+    print(f"{'нагрузка':<36}{'legacy, мкс':>14}{'parse, мкс':>14}{'ускорение':>12}")
+
+    for title, legacy, current in rows:
+        if legacy is None:
+            print(f"{title:<36}{'-':>14}{current:>14.1f}{'-':>12}")
+        else:
+            print(
+                f"{title:<36}{legacy:>14.1f}{current:>14.1f}{legacy / current:>11.2f}x"
+            )
+
+    print()
+    print("пиковая память на 500 пользователях, КБ:")
+    print(f"  ElementTree.fromstring: {peak_memory(lambda: ET.fromstring(large))}")
+    print(f"  parse:                  {peak_memory(lambda: parse(large))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Сравнение чтения страницы пользователей через ORM и через колонки Core.
+
+Прежний путь загружает объекты ORM, после чего FastAPI валидирует их в
+PaginatedResponse[UserSchema] и сериализует в JSON.  Новый путь выбирает колонки, получает
+строки и сериализует их в JSON сразу.  Замеряется получение строк из БД вместе
+с сериализацией и отдельно только сериализация уже полученной страницы.
+
+Бенчмарку нужна БД из настроек приложения.  Пользователи создаются в транзакции, которая
+в конце откатывается.
+
+Запуск из директории src:
+
+    python -m benchmarks.read_path
+
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime, timezone
+
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import engine
+from app.models import User
+from app.pagination import CountKind, PaginatedResponse
+from app.repositories import UsersRepository
+from app.schemas import UserSchema
+from app.usecases import USER_COLUMNS
+
+PAGE_SIZE = 100
+
+RESPONSE_ADAPTER = TypeAdapter(PaginatedResponse[UserSchema])
+
+
+def legacy_serialize(users: list) -> bytes:
+    # так ответ сериализует FastAPI: валидация в response_model, затем json.dumps
+    page = PaginatedResponse(
+        count=None, count_kind=CountKind.none, next=None, previous=None, results=users
+    )
+    content = RESPONSE_ADAPTER.dump_python(
+        RESPONSE_ADAPTER.validate_python(page, from_attributes=True), mode="json"
+    )
+
+    return json.dumps(content, ensure_ascii=False).encode()
+
+
+def serialize(rows: list[dict]) -> bytes:
+    page = {
+        "count": None,
+        "next": None,
+        "previous": None,
+        "count_kind": CountKind.none,
+        "results": rows,
+    }
+
+    return to_json(page)
+
+
+async def legacy_read(session: AsyncSession) -> bytes:
+    users = (await session.scalars(select(User).limit(PAGE_SIZE))).all()
+    content = legacy_serialize(users)
+    # объекты остаются в сессии до конца запроса, здесь их нужно убрать явно
+    session.expunge_all()
+
+    return content
+
+
+async def read(session: AsyncSession) -> bytes:
+    result = await session.execute(select(*USER_COLUMNS).limit(PAGE_SIZE))
+
+    return serialize([dict(row) for row in result.mappings()])
+
+
+async def measure(func, number: int) -> float:
+    """Возвращает лучшее время одного вызова в микросекундах."""
+
+    timings = []
+
+    for _ in range(5):
+        started_at = time.perf_counter()
+
+        for _ in range(number):
+            await func()
+
+        timings.append(time.perf_counter() - started_at)
+
+    return min(timings) / number * 1e6
+
+
+async def main():
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        session = AsyncSession(bind=conn)
+        await UsersRepository(session).create_many(
+            [
+                {
+                    "name": "Иван",
+                    "surname": "Иванов",
+                    "email": f"ivan.ivanov.{i}@yandex.com",
+                    "birthday": datetime(2005, 10, 23, tzinfo=timezone.utc),
+                }
+                for i in range(PAGE_SIZE)
+            ]
+        )
+
+        users = (await session.scalars(select(User).limit(PAGE_SIZE))).all()
+        result = await session.execute(select(*USER_COLUMNS).limit(PAGE_SIZE))
+        rows = [dict(row) for row in result.mappings()]
+
+        assert json.loads(legacy_serialize(users)) == json.loads(serialize(rows))
+
+        results = [
+            (
+                f"БД + сериализация, {PAGE_SIZE} строк",
+                await measure(lambda: legacy_read(session), 200),
+                await measure(lambda: read(session), 200),
+            ),
+            (
+                f"только сериализация, {PAGE_SIZE} строк",
+                await measure(_sync(lambda: legacy_serialize(users)), 2000),
+                await measure(_sync(lambda: serialize(rows)), 2000),
+            ),
+        ]
+
+        await session.close()
+        await trans.rollback()
+
+    await engine.dispose()
+
+    print(f"{'нагрузка':<36}{'ORM, мкс':>12}{'Core, мкс':>12}{'ускорение':>12}")
+
+    for title, legacy, current in results:
+        print(f"{title:<36}{legacy:>12.1f}{current:>12.1f}{legacy / current:>11.2f}x")
+
+
+def _sync(func):
+    async def wrapper():
+        return func()
+
+    return wrapper
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
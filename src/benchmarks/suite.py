@@ -0,0 +1,277 @@
+"""Набор микробенчмарков горячих путей загрузки из Kafka и API.
+
+Для каждого случая замеряется количество операций в секунду и пиковая память, выделяемая
+одной операцией.  Kafka и БД не нужны: запросы только компилируются, а не выполняются.
+
+Результаты можно сохранить как базовые и сравнить с ними результаты другого коммита.  Если
+какой-то случай стал медленнее больше, чем на --threshold процентов, то команда завершается
+с кодом 1.
+
+Запуск из директории src:
+
+    python -m benchmarks.suite --save baseline.json
+    python -m benchmarks.suite --compare baseline.json
+    python -m benchmarks.suite --filter parse
+
+"""
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+from pydantic import TypeAdapter
+from pydantic_core import to_json
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql.asyncpg import dialect as asyncpg_dialect
+from starlette.requests import Request
+
+from app.feedback import render_batch
+from app.filters import UsersFilter, UsersOrdering, UsersSorting
+from app.kafka import KafkaUser
+from app.pagination import CountKind, PageNumberPagination, PaginatedResponse
+from app.parsers import parse
+from app.schemas import UserSchema
+from app.usecases import USER_COLUMNS
+from benchmarks.parse import make_payload
+
+PAGE_SIZE = 100
+
+RESPONSE_ADAPTER = TypeAdapter(PaginatedResponse[UserSchema])
+
+DIALECT = asyncpg_dialect()
+
+
+class Case:
+    """Случай бенчмарка.
+
+    Args:
+        key: ключ для сохранения и сравнения результатов
+        title: описание
+        func: замеряемая функция без аргументов
+
+    """
+
+    def __init__(self, key: str, title: str, func: Callable[[], object]):
+        self.key = key
+        self.title = title
+        self.func = func
+
+
+def get_cases() -> list[Case]:
+    small, large = make_payload(1), make_payload(500)
+    users_data = parse(large)
+    user_ids = list(range(1, 501))
+    rows = [
+        {
+            "id": i,
+            "name": "Иван",
+            "surname": "Иванов",
+            "email": f"ivan.ivanov.{i}@yandex.com",
+            "birthday": datetime(2005, 10, 23, tzinfo=timezone.utc),
+        }
+        for i in range(1, PAGE_SIZE + 1)
+    ]
+    page = {
+        "count": 1000,
+        "next": "http://localhost:8000/users?page=3&page_size=100",
+        "previous": "http://localhost:8000/users?page=1&page_size=100",
+        "count_kind": CountKind.exact,
+        "results": rows,
+    }
+    paginator = PageNumberPagination(
+        request=Request(
+            {
+                "type": "http",
+                "method": "GET",
+                "scheme": "http",
+                "server": ("localhost", 8000),
+                "path": "/users",
+                "query_string": b"page=2&page_size=100&surname=%D0%98%D0%B2",
+                "headers": [(b"host", b"localhost:8000")],
+            }
+        ),
+        page=2,
+        page_size=PAGE_SIZE,
+        count=None,
+        include_count=True,
+        session=None,
+    )
+
+    def list_query() -> str:
+        users_filter = UsersFilter(
+            email=None,
+            name=None,
+            surname="Ив",
+            birthday_from=datetime(2000, 1, 1, tzinfo=timezone.utc),
+            birthday_to=None,
+        )
+        sorting = UsersSorting(ordering=UsersOrdering.surname)
+        stmt = sorting.sort(users_filter.filter(select(*USER_COLUMNS)))
+        stmt = stmt.limit(PAGE_SIZE + 1).offset(paginator.offset)
+
+        return str(stmt.compile(dialect=DIALECT))
+
+    return [
+        Case("parse_1", "parse, 1 пользователь", lambda: parse(small)),
+        Case("parse_500", "parse, 500 пользователей", lambda: parse(large)),
+        Case(
+            "kafka_user_1",
+            "KafkaUser, 1 пользователь",
+            lambda: KafkaUser(**users_data[0]),
+        ),
+        Case(
+            "kafka_user_500",
+            "KafkaUser, 500 пользователей",
+            lambda: [KafkaUser(**user_data) for user_data in users_data],
+        ),
+        Case(
+            "feedback_batch",
+            "фидбек, пачка 500 + 500",
+            lambda: render_batch(user_ids, users_data),
+        ),
+        Case(
+            "user_schema_page",
+            f"UserSchema, страница {PAGE_SIZE} строк",
+            lambda: RESPONSE_ADAPTER.dump_json(RESPONSE_ADAPTER.validate_python(page)),
+        ),
+        Case(
+            "to_json_page",
+            f"to_json, страница {PAGE_SIZE} строк",
+            lambda: to_json(page),
+        ),
+        Case(
+            "pagination_links",
+            "ссылки пагинации",
+            lambda: (
+                paginator._get_next_page(True),
+                paginator._get_previous_page(1000, CountKind.exact),
+            ),
+        ),
+        Case("list_query", "компиляция запроса списка", list_query),
+    ]
+
+
+def measure(func: Callable[[], object]) -> float:
+    """Возвращает количество операций в секунду по лучшему из повторов."""
+
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+
+    return number / min(timer.repeat(number=number, repeat=5))
+
+
+def peak_memory(func: Callable[[], object]) -> float:
+    """Возвращает пиковую память, выделяемую одним вызовом, в килобайтах."""
+
+    # первый вызов заполняет кэши, которые не должны попасть в замер
+    func()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak / 1024
+
+
+def run(cases: list[Case]) -> dict:
+    results = {}
+
+    for case in cases:
+        results[case.key] = {
+            "title": case.title,
+            "ops": measure(case.func),
+            "memory_kb": peak_memory(case.func),
+        }
+
+    return {
+        "python": platform.python_version(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "results": results,
+    }
+
+
+def report(current: dict, baseline: dict = None, threshold: float = 10) -> bool:
+    """Печатает результаты и сравнение с базовыми.
+
+    Returns:
+        были ли случаи, ставшие медленнее больше, чем на threshold процентов
+
+    """
+
+    regressed = False
+    header = f"{'случай':<36}{'оп/с':>14}{'мкс/оп':>12}{'память, КБ':>12}"
+
+    if baseline is not None:
+        header += f"{'база, оп/с':>14}{'изменение':>12}"
+
+    print(header)
+
+    for key, result in current["results"].items():
+        line = (
+            f"{result['title']:<36}{result['ops']:>14.0f}"
+            f"{1e6 / result['ops']:>12.2f}{result['memory_kb']:>12.1f}"
+        )
+        base = (baseline or {}).get("results", {}).get(key)
+
+        if base is not None:
+            change = (result["ops"] / base["ops"] - 1) * 100
+            line += f"{base['ops']:>14.0f}{change:>+11.1f}%"
+
+            if change < -threshold:
+                regressed = True
+                line += "  медленнее"
+        elif baseline is not None:
+            line += f"{'-':>14}{'-':>12}"
+
+        print(line)
+
+    return regressed
+
+
+def parse_args(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.suite",
+        description="Микробенчмарки горячих путей загрузки из Kafka и API",
+    )
+    parser.add_argument(
+        "--filter", help="запускать только случаи, ключ которых содержит подстроку"
+    )
+    parser.add_argument("--save", type=Path, help="сохранить результаты в файл")
+    parser.add_argument("--compare", type=Path, help="сравнить с результатами из файла")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10,
+        help="допустимое замедление при сравнении, проценты",
+    )
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None) -> int:
+    args = parse_args(argv)
+    cases = [
+        case for case in get_cases() if args.filter is None or args.filter in case.key
+    ]
+    baseline = None
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+
+    current = run(cases)
+    regressed = report(current, baseline, args.threshold)
+
+    if args.save is not None:
+        args.save.write_text(json.dumps(current, ensure_ascii=False, indent=2))
+
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,10 @@
 import asyncio
 import logging
+from datetime import datetime, timezone
 
 import pytest
 from httpx import AsyncClient
-from sqlalchemy import URL
+from sqlalchemy import URL, event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from tests.database import (
     create_database,
@@ -12,9 +13,11 @@ from tests.database import (
     migrate,
 )
 
+from app.cache import users_cache
 from app.config import settings
 from app.dependencies.database import get_session
 from app.main import app
+from app.pagination import PageNumberPagination
 from app.repositories import UsersRepository
 
 LOGGER = logging.getLogger(__name__)
@@ -70,11 +73,14 @@ async def engine(database):
 
 @pytest.fixture
 async def session(engine):
-    session_ = AsyncSession(engine)
-    session_.begin_nested()
-    yield session_
-    await session_.rollback()
-    await session_.close()
+    # коммиты внутри теста фиксируют только savepoint, а внешняя транзакция откатывается,
+    # поэтому данные между тестами не пересекаются
+    async with engine.connect() as conn:
+        trans = await conn.begin()
+        session_ = AsyncSession(bind=conn, join_transaction_mode="create_savepoint")
+        yield session_
+        await session_.close()
+        await trans.rollback()
 
 
 @pytest.fixture
@@ -82,6 +88,42 @@ async def users_repository(session):
     return UsersRepository(session)
 
 
+@pytest.fixture
+def create_users(users_repository):
+    """Фабрика пользователей: создает пользователей, фиксирует их и возвращает их ID.
+
+    Без rows создается count пользователей "Иван Иванов" с разными email.  Поля, не
+    переданные в rows, заполняются значениями по умолчанию
+
+    """
+
+    async def create_users(count: int = 5, rows: list[dict] = None) -> list[int]:
+        if rows is None:
+            rows = [{"email": f"ivan.ivanov.{i}@yandex.com"} for i in range(count)]
+
+        user_ids = await users_repository.create_many(
+            [
+                {
+                    "name": "Иван",
+                    "surname": "Иванов",
+                    "birthday": datetime(2005, 10, 23, tzinfo=timezone.utc),
+                    **row,
+                }
+                for row in rows
+            ]
+        )
+        await users_repository.commit()
+
+        return user_ids
+
+    return create_users
+
+
+@pytest.fixture
+async def user_ids(create_users):
+    return await create_users()
+
+
 @pytest.fixture()
 async def client():
     async with AsyncClient(app=app, base_url="http://test") as client:
@@ -94,3 +136,28 @@ async def session_override(session):
         yield session
 
     app.dependency_overrides[get_session] = get_session_override
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    users_cache.clear()
+    PageNumberPagination.count_cache.clear()
+
+
+@pytest.fixture
+def queries(engine):
+    """Запросы, выполненные к БД во время теста.
+
+    Точки сохранения, которыми тестовая сессия заменяет транзакции, не учитываются
+
+    """
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if "SAVEPOINT" not in statement:
+            statements.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
@@ -1,7 +1,25 @@
+import json
+from datetime import datetime, timezone
+from unittest import mock
+
 import dateutil.parser
 import pytest
+import sqlalchemy.exc
+from httpx import URL
+from sqlalchemy import select, text
 from starlette import status
 
+from app.cache import users_cache
+from app.config import settings
+from app.export import StreamingExport
+from app.filters import UsersFilter, UsersOrdering, UsersSorting
+from app.main import app
+from app.models import User
+from app.pagination import Explain
+from app.repositories import UsersRepository
+from app.schemas import UserSchema
+from app.usecases import BulkCreateUsersUseCase
+
 
 class TestCreateUser:
     async def test_empty_body(self, client):
@@ -60,6 +78,59 @@ class TestCreateUser:
         assert dateutil.parser.parse(resp_body["birthday"]) == user.birthday
 
 
+class TestWriteQueries:
+    """Каждая запись пользователя выполняется одним запросом к БД."""
+
+    @pytest.fixture
+    async def user_id(self, create_users):
+        user_ids = await create_users(1)
+
+        return user_ids[0]
+
+    async def test_create(self, client, queries):
+        payload = {
+            "name": "Иван",
+            "surname": "Иванов",
+            "email": "ivan.ivanov.2023.2024@yandex.com",
+            "birthday": "2005-10-23T04:00:00+03:00",
+        }
+
+        resp = await client.post("/users", json=payload)
+
+        assert resp.status_code == status.HTTP_201_CREATED
+        assert len(queries) == 1
+        assert queries[0].startswith("INSERT")
+
+    async def test_update(self, client, user_id, queries):
+        resp = await client.patch(f"/users/{user_id}", json={"name": "Сергей"})
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.json()["name"] == "Сергей"
+        assert resp.json()["surname"] == "Иванов"
+        assert len(queries) == 1
+        assert queries[0].startswith("UPDATE")
+
+    async def test_delete(self, client, user_id, queries):
+        resp = await client.delete(f"/users/{user_id}")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert len(queries) == 1
+        assert queries[0].startswith("DELETE")
+
+    async def test_update_without_changes(self, client, user_id):
+        resp = await client.patch(f"/users/{user_id}", json={})
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.json()["id"] == user_id
+
+    @pytest.mark.parametrize("method", ["patch", "delete"])
+    async def test_404(self, method, client, user_id):
+        kwargs = {"json": {"name": "Сергей"}} if method == "patch" else {}
+        resp = await client.request(method, f"/users/{user_id + 1}", **kwargs)
+
+        assert resp.status_code == status.HTTP_404_NOT_FOUND
+
+
 class TestGetUser:
     async def test_404(self, client):
         resp = await client.get("/user/1")
@@ -88,6 +159,23 @@ class TestGetUser:
 
         assert get_user_resp_body == create_user_resp_body
 
+    async def test_cached(self, client, create_users):
+        user_ids = await create_users(1)
+        hits = users_cache.hits
+
+        with mock.patch.object(
+            UsersRepository,
+            "get_values",
+            autospec=True,
+            side_effect=UsersRepository.get_values,
+        ) as get:
+            responses = [await client.get(f"/users/{user_ids[0]}") for _ in range(3)]
+
+        assert all(resp.status_code == status.HTTP_200_OK for resp in responses)
+        assert responses[0].json() == responses[2].json()
+        assert get.call_count == 1
+        assert users_cache.hits == hits + 2
+
 
 class TestDeleteUser:
     async def test_404(self, client):
@@ -162,3 +250,455 @@ class TestUpdateUser:
         assert dateutil.parser.parse(
             update_user_resp_body["birthday"]
         ) == dateutil.parser.parse(update_data["birthday"])
+
+        # пользователь был закэширован до обновления
+        resp = await client.get(f"/users/{user_id}")
+
+        assert resp.json() == update_user_resp_body
+
+
+class TestListUsersByCursor:
+    async def test_pages(self, client, user_ids):
+        pages, url = [], "/users/cursor?page_size=2"
+
+        while url:
+            resp = await client.get(url)
+
+            assert resp.status_code == status.HTTP_200_OK
+
+            resp_body = resp.json()
+            pages.append([user["id"] for user in resp_body["results"]])
+            url = resp_body["next"]
+
+        assert pages == [user_ids[:2], user_ids[2:4], user_ids[4:]]
+
+        previous_pages, url = [], resp_body["previous"]
+
+        while url:
+            resp_body = (await client.get(url)).json()
+            previous_pages.append([user["id"] for user in resp_body["results"]])
+            url = resp_body["previous"]
+
+        assert previous_pages == [user_ids[2:4], user_ids[:2]]
+
+    @pytest.mark.parametrize(
+        "query", ["ordering=surname", "ordering=-birthday", "ordering=-name&name=П"]
+    )
+    async def test_ordering(self, client, create_users, query):
+        # у части пользователей значения ключа сортировки совпадают, порядок среди них
+        # задает id
+        await create_users(
+            rows=[
+                {
+                    "name": name,
+                    "surname": surname,
+                    "email": f"user.{i}@yandex.com",
+                    "birthday": datetime(2000 + i % 3, 1, 1, tzinfo=timezone.utc),
+                }
+                for i, (name, surname) in enumerate(
+                    [
+                        ("Петр", "Петров"),
+                        ("Иван", "Иванов"),
+                        ("Павел", "Петров"),
+                        ("Анна", "Антонова"),
+                        ("Петр", "Иванов"),
+                    ]
+                )
+            ]
+        )
+        list_resp = await client.get(f"/users?{query}&page_size=100")
+        expected = [user["id"] for user in list_resp.json()["results"]]
+        pages, url = [], f"/users/cursor?{query}&page_size=2"
+
+        while url:
+            resp = await client.get(url)
+
+            assert resp.status_code == status.HTTP_200_OK
+
+            resp_body = resp.json()
+            pages.append([user["id"] for user in resp_body["results"]])
+            url = resp_body["next"]
+
+        assert sum(pages, []) == expected
+
+        previous_pages, url = [], resp_body["previous"]
+
+        while url:
+            resp_body = (await client.get(url)).json()
+            previous_pages.insert(0, [user["id"] for user in resp_body["results"]])
+            url = resp_body["previous"]
+
+        assert previous_pages == pages[:-1]
+
+    async def test_bad_cursor(self, client):
+        resp = await client.get("/users/cursor?cursor=NOT-CURSOR")
+
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestExportUsers:
+    @pytest.fixture(autouse=True)
+    def yield_per(self):
+        # чтобы выгрузка состояла из нескольких пачек
+        with mock.patch.object(StreamingExport, "yield_per", 2):
+            yield
+
+    async def test_ndjson(self, client, user_ids):
+        resp = await client.get("/users/export")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.headers["content-type"] == "application/x-ndjson"
+
+        users = [json.loads(line) for line in resp.text.splitlines()]
+
+        assert [user["id"] for user in users] == user_ids
+        assert users[0] == {
+            "id": user_ids[0],
+            "name": "Иван",
+            "surname": "Иванов",
+            "email": "ivan.ivanov.0@yandex.com",
+            "birthday": "2005-10-23T00:00:00Z",
+        }
+
+    async def test_csv(self, client, user_ids):
+        resp = await client.get("/users/export?format=csv")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.headers["content-type"].startswith("text/csv")
+
+        lines = resp.text.splitlines()
+
+        assert lines[0] == "id,name,surname,email,birthday"
+        assert lines[1] == (
+            f"{user_ids[0]},Иван,Иванов,ivan.ivanov.0@yandex.com,2005-10-23T00:00:00Z"
+        )
+        assert len(lines) == len(user_ids) + 1
+
+    async def test_after_id(self, client, user_ids):
+        resp = await client.get(f"/users/export?after_id={user_ids[2]}")
+        users = [json.loads(line) for line in resp.text.splitlines()]
+
+        assert [user["id"] for user in users] == user_ids[3:]
+
+    async def test_no_ordering(self, client, user_ids):
+        parameters = app.openapi()["paths"]["/users/export"]["get"]["parameters"]
+
+        assert "ordering" not in {parameter["name"] for parameter in parameters}
+
+        # переданная сортировка не влияет на порядок, поэтому выгрузку можно продолжить
+        resp = await client.get(f"/users/export?ordering=-id&after_id={user_ids[2]}")
+        users = [json.loads(line) for line in resp.text.splitlines()]
+
+        assert [user["id"] for user in users] == user_ids[3:]
+
+    async def test_empty_csv(self, client):
+        resp = await client.get("/users/export?format=csv")
+
+        assert resp.text.splitlines() == ["id,name,surname,email,birthday"]
+
+
+class TestListUsers:
+    @pytest.mark.parametrize(
+        "count,count_kind",
+        [
+            ("exact", "exact"),
+            ("window", "exact"),
+            ("cached", "cached"),
+        ],
+    )
+    async def test_count(self, count, count_kind, client, user_ids):
+        resp = await client.get(f"/users?page=2&page_size=2&count={count}")
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        resp_body = resp.json()
+
+        assert resp_body["count"] == len(user_ids)
+        assert resp_body["count_kind"] == count_kind
+        assert [user["id"] for user in resp_body["results"]] == user_ids[2:4]
+        assert URL(resp_body["next"]).params["page"] == "3"
+        assert URL(resp_body["previous"]).params["page"] == "1"
+
+    async def test_wire_format(self, client, user_ids, users_repository):
+        resp = await client.get("/users?page_size=1")
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        user = await users_repository.get(pk_value=user_ids[0])
+
+        # строки сериализуются без UserSchema, но формат должен совпадать
+        assert resp.json() == {
+            "count": len(user_ids),
+            "next": "http://test/users?page_size=1&page=2",
+            "previous": None,
+            "count_kind": "exact",
+            "results": [UserSchema.model_validate(user).model_dump(mode="json")],
+        }
+
+    async def test_estimated_count(self, client, user_ids):
+        resp = await client.get("/users?count=estimated")
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        resp_body = resp.json()
+
+        assert isinstance(resp_body["count"], int)
+        assert resp_body["count_kind"] == "estimated"
+
+    async def test_without_count(self, client, user_ids):
+        resp = await client.get("/users?page=3&page_size=2&include_count=false")
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        resp_body = resp.json()
+
+        assert resp_body["count"] is None
+        assert resp_body["count_kind"] == "none"
+        assert [user["id"] for user in resp_body["results"]] == user_ids[4:]
+        assert resp_body["next"] is None
+        assert resp_body["previous"] is not None
+
+
+class TestFilterUsers:
+    @pytest.fixture
+    async def user_ids(self, create_users):
+        return await create_users(
+            rows=[
+                {
+                    "name": name,
+                    "surname": surname,
+                    "email": email,
+                    "birthday": datetime(year, 1, 1, tzinfo=timezone.utc),
+                }
+                for name, surname, email, year in [
+                    ("Иван", "Иванов", "Ivan.Ivanov@yandex.com", 2001),
+                    ("Петр", "Петров", "petr.petrov@yandex.com", 2002),
+                    ("Петр", "Иванченко", "petr.ivanchenko@yandex.com", 2003),
+                    ("Анна", "Ива_нова", "anna.ivanova@yandex.com", 2004),
+                ]
+            ]
+        )
+
+    @pytest.mark.parametrize(
+        "query,indexes",
+        [
+            ("email=ivan.ivanov@YANDEX.com", [0]),
+            ("surname=Иван", [0, 2]),
+            ("surname=Ива_", [3]),
+            ("name=Петр&surname=Иван", [2]),
+            (
+                "birthday_from=2002-01-01T00:00:00Z&birthday_to=2004-01-01T00:00:00Z",
+                [1, 2],
+            ),
+            ("ordering=-birthday", [3, 2, 1, 0]),
+            ("ordering=name", [3, 0, 1, 2]),
+            ("ordering=-name", [2, 1, 0, 3]),
+        ],
+    )
+    async def test_filter(self, query, indexes, client, user_ids):
+        resp = await client.get(f"/users?{query}")
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        resp_body = resp.json()
+
+        assert [user["id"] for user in resp_body["results"]] == [
+            user_ids[i] for i in indexes
+        ]
+        assert resp_body["count"] == len(indexes)
+
+    @pytest.mark.parametrize(
+        "filters",
+        [
+            {"email": "ivan.ivanov@yandex.com"},
+            {"name": "Иван"},
+            {"surname": "Иван"},
+            {"birthday_from": datetime(2002, 1, 1, tzinfo=timezone.utc)},
+            {"birthday_to": datetime(2002, 1, 1, tzinfo=timezone.utc)},
+            {"ordering": UsersOrdering.name},
+            {"ordering": UsersOrdering.surname_desc},
+            {"ordering": UsersOrdering.birthday},
+            {"ordering": UsersOrdering.id_desc},
+        ],
+    )
+    async def test_index_scan(self, filters, session, user_ids):
+        params = {
+            "email": None,
+            "name": None,
+            "surname": None,
+            "birthday_from": None,
+            "birthday_to": None,
+            "ordering": UsersOrdering.id,
+        }
+        params.update(filters)
+        ordering = params.pop("ordering")
+        stmt = UsersSorting(ordering).sort(UsersFilter(**params).filter(select(User)))
+        stmt = stmt.limit(10)
+
+        # на маленькой таблице полный просмотр дешевле, поэтому он запрещается, чтобы
+        # проверить, что индекс вообще может быть использован
+        await session.execute(text("SET LOCAL enable_seqscan = off"))
+        plan = await session.scalar(Explain(stmt))
+        plan = json.dumps(plan if not isinstance(plan, str) else json.loads(plan))
+
+        assert "Seq Scan" not in plan
+
+        # отфильтрованные по индексу записи сортируются отдельно, а без фильтров записи
+        # должны читаться из индекса уже упорядоченными
+        if list(filters) == ["ordering"]:
+            assert '"Sort"' not in plan
+
+
+class TestSearchUsers:
+    @pytest.fixture
+    async def user_ids(self, create_users):
+        return await create_users(
+            rows=[
+                {"name": name, "surname": surname, "email": email}
+                for name, surname, email in [
+                    ("Иван", "Иванов", "ivan.ivanov@yandex.com"),
+                    ("Петр", "Петров", "petr.petrov@yandex.com"),
+                    ("Анна", "Иванова", "anna.ivanova@yandex.com"),
+                ]
+            ]
+        )
+
+    async def test_substring(self, client, user_ids):
+        resp = await client.get("/users/search?q=petrov@")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert [user["id"] for user in resp.json()] == [user_ids[1]]
+
+    async def test_ranked(self, client, user_ids):
+        resp = await client.get("/users/search?q=Иванов")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert [user["id"] for user in resp.json()] == [user_ids[0], user_ids[2]]
+
+    async def test_typo(self, client, user_ids):
+        resp = await client.get("/users/search?q=Пертов")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert user_ids[1] in [user["id"] for user in resp.json()]
+
+    async def test_limit(self, client, user_ids):
+        with mock.patch.object(settings.search, "max_results", 1):
+            resp = await client.get("/users/search?q=yandex&limit=10")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert len(resp.json()) == 1
+
+    async def test_short_query(self, client):
+        resp = await client.get("/users/search?q=Ив")
+
+        assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    async def test_timeout(self, client):
+        orig = Exception("canceling statement due to statement timeout")
+        orig.sqlstate = "57014"
+        error = sqlalchemy.exc.DBAPIError("SELECT", {}, orig)
+
+        with mock.patch.object(UsersRepository, "search", side_effect=error):
+            resp = await client.get("/users/search?q=Иванов")
+
+        assert resp.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+
+class TestBulkCreateUsers:
+    @staticmethod
+    def make_payload(count: int) -> list[dict]:
+        return [
+            {
+                "name": "Иван",
+                "surname": "Иванов",
+                "email": f"ivan.ivanov.{i}@yandex.com",
+                "birthday": "2005-10-23T04:00:00+03:00",
+            }
+            for i in range(count)
+        ]
+
+    @pytest.mark.parametrize("count", [3, BulkCreateUsersUseCase.copy_threshold + 1])
+    async def test_json(self, count, client, users_repository):
+        payload = self.make_payload(count)
+        payload[1]["email"] = "NOT-EMAIL"
+
+        resp = await client.post("/users/bulk", json=payload)
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        resp_body = resp.json()
+
+        assert len(resp_body["ids"]) == count - 1
+        assert [error["index"] for error in resp_body["errors"]] == [1]
+        assert resp_body["errors"][0]["errors"][0]["loc"] == ["email"]
+
+        user = await users_repository.get(pk_value=resp_body["ids"][-1])
+
+        assert user.email == payload[-1]["email"]
+
+    async def test_ndjson(self, client):
+        lines = [json.dumps(row) for row in self.make_payload(3)]
+        lines.insert(1, "NOT-JSON")
+
+        resp = await client.post(
+            "/users/bulk",
+            content="\n".join(lines).encode(),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        resp_body = resp.json()
+
+        assert len(resp_body["ids"]) == 3
+        assert [error["index"] for error in resp_body["errors"]] == [1]
+
+    async def test_not_array(self, client):
+        resp = await client.post("/users/bulk", json={})
+
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestBulkUpdateDeleteUsers:
+    @pytest.fixture
+    async def user_ids(self, create_users):
+        return await create_users(3)
+
+    async def test_update(self, client, user_ids):
+        missing_id = user_ids[-1] + 1000
+        payload = {"ids": [*user_ids[:2], missing_id], "changes": {"name": "Сергей"}}
+
+        resp = await client.patch("/users/bulk", json=payload)
+
+        assert resp.status_code == status.HTTP_200_OK
+
+        resp_body = resp.json()
+
+        assert sorted(user["id"] for user in resp_body["updated"]) == user_ids[:2]
+        assert all(user["name"] == "Сергей" for user in resp_body["updated"])
+        assert resp_body["not_found"] == [missing_id]
+
+        resp = await client.get(f"/users/{user_ids[2]}")
+
+        assert resp.json()["name"] == "Иван"
+
+    async def test_update_without_changes(self, client, user_ids):
+        resp = await client.patch("/users/bulk", json={"ids": user_ids, "changes": {}})
+
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+    async def test_delete(self, client, user_ids):
+        missing_id = user_ids[-1] + 1000
+        payload = {"ids": [*user_ids[:2], missing_id]}
+
+        resp = await client.request("DELETE", "/users/bulk", json=payload)
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.json() == {"deleted": user_ids[:2], "not_found": [missing_id]}
+
+        for user_id, status_code in zip(
+            user_ids, [status.HTTP_404_NOT_FOUND] * 2 + [status.HTTP_200_OK]
+        ):
+            resp = await client.get(f"/users/{user_id}")
+
+            assert resp.status_code == status_code
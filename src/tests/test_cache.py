@@ -0,0 +1,68 @@
+import asyncio
+
+from app.cache import LRUCache
+
+
+class TestLRUCache:
+    """Тестирование кэша."""
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "a")
+        cache.set(2, "b")
+        cache.get(1)
+        cache.set(3, "c")
+
+        assert cache.get(2) is None
+        assert cache.get(1) == "a"
+        assert cache.get(3) == "c"
+        assert cache.stats()["evictions"] == 1
+
+    def test_expiration(self):
+        cache = LRUCache(maxsize=2, ttl=-1)
+        cache.set(1, "a")
+
+        assert cache.get(1) is None
+        assert cache.stats()["expirations"] == 1
+
+    async def test_single_flight(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "a"
+
+        results = await asyncio.gather(
+            *(cache.get_or_load(1, loader) for _ in range(10))
+        )
+
+        assert results == ["a"] * 10
+        assert calls == 1
+        assert cache.get(1) == "a"
+
+    async def test_single_flight_error(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+
+        async def loader():
+            await asyncio.sleep(0.01)
+            raise LookupError
+
+        results = await asyncio.gather(
+            *(cache.get_or_load(1, loader) for _ in range(3)), return_exceptions=True
+        )
+
+        assert all(isinstance(result, LookupError) for result in results)
+        assert len(cache) == 0
+
+    async def test_delete_while_loading(self):
+        cache = LRUCache(maxsize=2, ttl=60)
+
+        async def loader():
+            cache.delete(1)
+            return "a"
+
+        assert await cache.get_or_load(1, loader) == "a"
+        assert cache.get(1) is None
@@ -0,0 +1,62 @@
+import xml.etree.ElementTree as ET
+
+from app.feedback import render_batch
+from app.parsers import NAMESPACE
+
+
+class TestFeedback:
+    """Тестирование формирования фидбеков."""
+
+    namespaces = {"ns2": NAMESPACE}
+
+    def test_batch(self):
+        failed = {
+            "name": "Иван",
+            "surname": "Иванов",
+            "email": "NOT-EMAIL",
+            "birthday": "2005-10-23T04:00:00+03:00",
+        }
+
+        xml = ET.fromstring(render_batch([1, 2], [failed]))
+        users = xml.findall("ns2:KafkaUser", self.namespaces)
+
+        assert [user.findtext("ns2:Id", None, self.namespaces) for user in users] == [
+            "1",
+            "2",
+            None,
+        ]
+        assert [
+            user.findtext("ns2:Status", None, self.namespaces) for user in users
+        ] == [
+            "SUCCESS",
+            "SUCCESS",
+            "FAILED",
+        ]
+        assert users[2].findtext("ns2:Email", None, self.namespaces) == "NOT-EMAIL"
+
+    def test_batch_existing(self):
+        xml = ET.fromstring(render_batch([1], [], existing_ids=[2]))
+        users = xml.findall("ns2:KafkaUser", self.namespaces)
+
+        assert [user.findtext("ns2:Id", None, self.namespaces) for user in users] == [
+            "1",
+            "2",
+        ]
+        assert [
+            user.findtext("ns2:Status", None, self.namespaces) for user in users
+        ] == ["SUCCESS", "EXISTS"]
+
+    def test_escaping(self):
+        failed = {
+            "name": "<ns2:Id>1</ns2:Id>",
+            "surname": "Иванов & Ко",
+            "email": "",
+            "birthday": "",
+        }
+
+        xml = ET.fromstring(render_batch([], [failed]))
+        user = xml.find("ns2:KafkaUser", self.namespaces)
+
+        assert user.findtext("ns2:Id", None, self.namespaces) is None
+        assert user.findtext("ns2:Name", None, self.namespaces) == failed["name"]
+        assert user.findtext("ns2:Surname", None, self.namespaces) == failed["surname"]
@@ -0,0 +1,169 @@
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from sqlalchemy import select
+
+from app.importer import import_users, iter_rows, parse_args, validate_chunk
+from app.models import User
+
+USERS = [
+    ("Иван", "Иванов", "ivan.ivanov@yandex.com", "2005-10-23T04:00:00+03:00"),
+    ("Петр", "", "petr.petrov@yandex.com", "2006-10-23T04:00:00+03:00"),
+    ("Анна", "Петрова", "NOT-EMAIL", "2007-10-23T04:00:00+03:00"),
+    ("Олег", "Сидоров", "oleg.sidorov@yandex.com", "2008-10-23T04:00:00+03:00"),
+]
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "users.csv"
+    lines = ["name,surname,email,birthday"] + [",".join(user) for user in USERS]
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+    return path
+
+
+@pytest.fixture
+def ndjson_file(tmp_path):
+    path = tmp_path / "users.ndjson"
+    lines = [
+        json.dumps(dict(zip(("name", "surname", "email", "birthday"), user)))
+        for user in USERS
+    ]
+    lines.insert(1, "NOT-JSON")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+    return path
+
+
+def write_xml(path, users):
+    tags = ("Name", "Surname", "Email", "Birthday")
+    # поля со значением None в выгрузку не попадают
+    users = "".join(
+        "<ns2:User>"
+        + "".join(
+            f"<ns2:{tag}>{value}</ns2:{tag}>"
+            for tag, value in zip(tags, user)
+            if value is not None
+        )
+        + "</ns2:User>"
+        for user in users
+    )
+    path.write_text(
+        f'<ns2:Request xmlns:ns2="urn://www.example.com">{users}</ns2:Request>',
+        encoding="utf-8",
+    )
+
+    return path
+
+
+@pytest.fixture
+def xml_file(tmp_path):
+    return write_xml(tmp_path / "users.xml", USERS)
+
+
+class TestIterRows:
+    def test_csv(self, csv_file):
+        rows = list(iter_rows(csv_file, "csv"))
+
+        assert rows[0] == (
+            1,
+            {
+                "name": "Иван",
+                "surname": "Иванов",
+                "email": "ivan.ivanov@yandex.com",
+                "birthday": "2005-10-23T04:00:00+03:00",
+            },
+        )
+        assert [number for number, _ in rows] == [1, 2, 3, 4]
+
+    def test_ndjson(self, ndjson_file):
+        rows = list(iter_rows(ndjson_file, "ndjson"))
+
+        assert [number for number, _ in rows] == [1, 2, 3, 4, 5]
+        assert rows[1] == (2, b"NOT-JSON\n")
+
+    def test_xml(self, xml_file):
+        rows = list(iter_rows(xml_file, "xml"))
+
+        assert [row["email"] for _, row in rows] == [user[2] for user in USERS]
+
+
+class TestValidateChunk:
+    def test_rejects(self, ndjson_file):
+        valid, rejects = validate_chunk(list(iter_rows(ndjson_file, "ndjson")))
+
+        assert [user["email"] for user in valid] == [
+            "ivan.ivanov@yandex.com",
+            "oleg.sidorov@yandex.com",
+        ]
+        assert [json.loads(reject)["row"] for reject in rejects] == [2, 3, 4]
+
+        reject = json.loads(rejects[0])
+
+        assert reject["data"] == "NOT-JSON"
+        assert reject["errors"][0]["type"] == "json_invalid"
+
+
+class TestImportUsers:
+    @pytest.mark.parametrize("file", ["csv_file", "ndjson_file", "xml_file"])
+    async def test_import(self, file, request, users_repository, session):
+        path = request.getfixturevalue(file)
+        args = parse_args([str(path)])
+        rejects, progress_file = io.StringIO(), io.StringIO()
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            progress = await import_users(
+                iter_rows(args.path, args.format),
+                users_repository,
+                executor,
+                rejects,
+                chunk_size=1,
+                max_pending=2,
+                progress_file=progress_file,
+            )
+
+        emails = (await session.scalars(select(User.email).order_by(User.id))).all()
+
+        assert emails == ["ivan.ivanov@yandex.com", "oleg.sidorov@yandex.com"]
+        assert progress.loaded == 2
+        assert progress.rejected == len(rejects.getvalue().splitlines())
+        assert "загружено 2" in progress_file.getvalue()
+
+    async def test_xml_missing_field(self, tmp_path, users_repository, session):
+        users = [USERS[0], ("Петр", "Петров", "petr.petrov@yandex.com", None), USERS[3]]
+        path = write_xml(tmp_path / "users.xml", users)
+        rejects = io.StringIO()
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            progress = await import_users(
+                iter_rows(path, "xml"),
+                users_repository,
+                executor,
+                rejects,
+                chunk_size=1,
+                max_pending=2,
+                progress_file=io.StringIO(),
+            )
+
+        emails = (await session.scalars(select(User.email).order_by(User.id))).all()
+        reject = json.loads(rejects.getvalue())
+
+        # пользователь без даты рождения отклонен, а разбор файла продолжен
+        assert emails == ["ivan.ivanov@yandex.com", "oleg.sidorov@yandex.com"]
+        assert progress.rejected == 1
+        assert reject["row"] == 2
+        assert reject["errors"][0]["type"] == "missing"
+        assert reject["errors"][0]["loc"] == ["birthday"]
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(SystemExit):
+            parse_args([str(tmp_path / "users.txt")])
+
+    def test_default_rejects(self, csv_file):
+        args = parse_args([str(csv_file)])
+
+        assert args.format == "csv"
+        assert args.rejects == csv_file.with_name("users.csv.rejects.ndjson")
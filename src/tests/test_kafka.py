@@ -1,12 +1,32 @@
+import asyncio
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
 from unittest import mock
 from unittest.mock import AsyncMock
 
 import pytest
 import sqlalchemy.exc
+from sqlalchemy import select
 
-from aiokafka import ConsumerRecord
+from aiokafka import ConsumerRecord, TopicPartition
+from aiokafka.errors import ConsumerStoppedError, KafkaError
 from app.config import settings
-from app.kafka import consume
+from app.kafka import (
+    DEAD_LETTERS,
+    FEEDBACK_RETRIES,
+    RETRIED_MESSAGES,
+    STAGE_DURATION,
+    STAGE_QUEUE_DEPTH,
+    WRITE_RETRIES,
+    OffsetCommitter,
+    PartitionWorkers,
+    consume,
+    get_retry_topics,
+    get_source_key,
+    is_transient_error,
+    validate_messages,
+)
 from app.models import User
 from app.repositories import UsersRepository
 
@@ -14,16 +34,53 @@ from app.repositories import UsersRepository
 class Consumer:
     def __init__(self, seq):
         super().__init__()
-        self.iter = iter(seq)
+        self.records = list(seq)
+        self.iter = iter(self.records)
+        self.paused = []
+        self.resumed = []
+        self.committed = []
+        self.seeks = []
 
-    def __aiter__(self):
-        return self
+    async def getmany(self, *partitions, timeout_ms=0, max_records=None):
+        batches = {}
 
-    async def __anext__(self):
-        try:
-            return next(self.iter)
-        except StopIteration:
-            raise StopAsyncIteration
+        for record in itertools.islice(self.iter, max_records):
+            tp = TopicPartition(record.topic, record.partition)
+            batches.setdefault(tp, []).append(record)
+
+        if not batches:
+            raise ConsumerStoppedError
+
+        return batches
+
+    def pause(self, *partitions):
+        self.paused += partitions
+
+    def seek(self, partition, offset):
+        self.seeks.append((partition, offset))
+        # партиция читается заново со смещения offset
+        self.iter = itertools.chain(
+            [
+                record
+                for record in self.records
+                if TopicPartition(record.topic, record.partition) == partition
+                and record.offset >= offset
+            ],
+            [
+                record
+                for record in self.iter
+                if TopicPartition(record.topic, record.partition) != partition
+            ],
+        )
+
+    def resume(self, *partitions):
+        self.resumed += partitions
+
+    def assignment(self):
+        return set(self.paused)
+
+    async def commit(self, offsets):
+        self.committed.append(offsets)
 
     async def start(self):
         pass
@@ -42,7 +99,12 @@ class TestConsume:
     def setup_method(self):
         self.producer = Producer()
 
-    async def test_user_created(self, users_repository: UsersRepository):
+    @pytest.fixture
+    def workers(self, session):
+        # сессия в тестах одна, поэтому обработчики партиций работают с ней по очереди
+        return PartitionWorkers(self.producer, lambda: session, max_concurrency=1)
+
+    async def test_user_created(self, users_repository: UsersRepository, workers):
         xml = """
             <ns2:Request xmlns:ns2="urn://www.example.com">
                 <ns2:User>
@@ -69,8 +131,8 @@ class TestConsume:
         )
         consumer = Consumer([msg])
 
-        with mock.patch("app.kafka.send_success_feedback") as send_success_feedback:
-            await consume(consumer, self.producer, users_repository)
+        with mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback:
+            await consume(consumer, workers)
 
             assert (
                 user := await users_repository.get(
@@ -79,7 +141,9 @@ class TestConsume:
                     User.email == "ivan.ivanov.2023.2024@yandex.com",
                 )
             )
-            send_success_feedback.assert_called_once_with(self.producer, user.id)
+            send_batch_feedback.assert_called_once_with(
+                self.producer, [user.id], [], []
+            )
 
     @pytest.mark.parametrize(
         "field,bad_value",
@@ -92,7 +156,7 @@ class TestConsume:
             ("email", "a" * 255 + "@mail.ru"),
         ],
     )
-    async def test_user_not_created(self, field, bad_value, users_repository):
+    async def test_user_not_created(self, field, bad_value, users_repository, workers):
         values = {
             "name": "Иван",
             "surname": "Иванов",
@@ -129,8 +193,8 @@ class TestConsume:
         )
         consumer = Consumer([msg])
 
-        with mock.patch("app.kafka.send_failed_feedback") as send_failed_feedback:
-            await consume(consumer, self.producer, users_repository)
+        with mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback:
+            await consume(consumer, workers)
 
             with pytest.raises(sqlalchemy.exc.NoResultFound):
                 await users_repository.get(
@@ -139,4 +203,802 @@ class TestConsume:
                     User.email == values["email"],
                 )
 
-            send_failed_feedback.assert_called_once_with(self.producer, values)
+            send_batch_feedback.assert_called_once_with(self.producer, [], [values], [])
+
+    async def test_batch(self, users_repository, workers):
+        xml = """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>{name}</ns2:Name>
+                    <ns2:Surname>Иванов</ns2:Surname>
+                    <ns2:Email>{email}</ns2:Email>
+                    <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+            </ns2:Request>
+        """
+        emails = [
+            "ivan.ivanov.1@yandex.com",
+            "NOT-EMAIL",
+            "ivan.ivanov.2@yandex.com",
+            "ivan.ivanov.3@yandex.com",
+        ]
+        msgs = [
+            ConsumerRecord(
+                topic=settings.kafka.consume_topic,
+                partition=0,
+                offset=offset,
+                timestamp=1697655000970,
+                timestamp_type=0,
+                key=None,
+                value=xml.format(name=f"Иван {offset}", email=email).strip().encode(),
+                checksum=None,
+                serialized_key_size=-1,
+                serialized_value_size=350,
+                headers=(),
+            )
+            for offset, email in enumerate(emails)
+        ]
+        consumer = Consumer(msgs)
+
+        with (
+            mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback,
+            mock.patch.object(
+                UsersRepository,
+                "commit",
+                autospec=True,
+                side_effect=UsersRepository.commit,
+            ) as commit,
+        ):
+            await consume(consumer, workers)
+
+            commit.assert_awaited_once()
+            users = [
+                await users_repository.get(User.email == email)
+                for email in emails
+                if email != "NOT-EMAIL"
+            ]
+            assert [user.name for user in users] == ["Иван 0", "Иван 2", "Иван 3"]
+            send_batch_feedback.assert_called_once_with(
+                self.producer,
+                [user.id for user in users],
+                [
+                    {
+                        "name": "Иван 1",
+                        "surname": "Иванов",
+                        "email": "NOT-EMAIL",
+                        "birthday": "2005-10-23T04:00:00+03:00",
+                    }
+                ],
+                [],
+            )
+
+    async def test_replay(self, users_repository, session):
+        xml = """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>Иван</ns2:Name>
+                    <ns2:Surname>Иванов</ns2:Surname>
+                    <ns2:Email>ivan.ivanov.{offset}@yandex.com</ns2:Email>
+                    <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+            </ns2:Request>
+        """
+        msgs = [
+            ConsumerRecord(
+                topic=settings.kafka.consume_topic,
+                partition=0,
+                offset=offset,
+                timestamp=1697655000970,
+                timestamp_type=0,
+                key=None,
+                value=xml.format(offset=offset).strip().encode(),
+                checksum=None,
+                serialized_key_size=-1,
+                serialized_value_size=350,
+                headers=(),
+            )
+            for offset in range(3)
+        ]
+
+        with mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback:
+            # сначала читаются два сообщения, затем топик перечитывается с начала
+            for batch in (msgs[:2], msgs):
+                workers = PartitionWorkers(
+                    self.producer, lambda: session, max_concurrency=1
+                )
+                await consume(Consumer(batch), workers)
+
+        users = (
+            await session.scalars(
+                select(User).where(User.email.like("ivan.ivanov.%")).order_by(User.id)
+            )
+        ).all()
+
+        assert [user.email for user in users] == [
+            f"ivan.ivanov.{offset}@yandex.com" for offset in range(3)
+        ]
+        assert send_batch_feedback.call_args_list == [
+            mock.call(self.producer, [users[0].id, users[1].id], [], []),
+            mock.call(self.producer, [users[2].id], [], [users[0].id, users[1].id]),
+        ]
+
+    async def test_replay_not_idempotent(self, session, monkeypatch):
+        xml = """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>Иван</ns2:Name>
+                    <ns2:Surname>Иванов</ns2:Surname>
+                    <ns2:Email>ivan.ivanov.{offset}@yandex.com</ns2:Email>
+                    <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+            </ns2:Request>
+        """
+        msgs = [
+            ConsumerRecord(
+                topic=settings.kafka.consume_topic,
+                partition=0,
+                offset=offset,
+                timestamp=1697655000970,
+                timestamp_type=0,
+                key=None,
+                value=xml.format(offset=offset).strip().encode(),
+                checksum=None,
+                serialized_key_size=-1,
+                serialized_value_size=350,
+                headers=(),
+            )
+            for offset in range(2)
+        ]
+        monkeypatch.setattr(settings.kafka, "idempotent", False)
+
+        with mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback:
+            # одна и та же пачка доставляется дважды
+            for _ in range(2):
+                workers = PartitionWorkers(
+                    self.producer, lambda: session, max_concurrency=1
+                )
+                await consume(Consumer(msgs), workers)
+
+        users = (
+            await session.scalars(
+                select(User).where(User.email.like("ivan.ivanov.%")).order_by(User.id)
+            )
+        ).all()
+
+        assert [user.email for user in users] == [
+            f"ivan.ivanov.{offset}@yandex.com" for offset in (0, 1, 0, 1)
+        ]
+        assert all(user.source_key is None for user in users)
+        assert send_batch_feedback.call_count == 2
+        self.producer.send_and_wait.assert_not_called()
+
+    def test_source_key(self):
+        msg = ConsumerRecord(
+            topic="users",
+            partition=1,
+            offset=28,
+            timestamp=1697655000970,
+            timestamp_type=0,
+            key=None,
+            value=b"",
+            checksum=None,
+            serialized_key_size=-1,
+            serialized_value_size=0,
+            headers=(),
+        )
+
+        assert get_source_key(msg, 0) == "users/1/28/0"
+
+        msg.headers = (("message-id", b"6f1c"),)
+
+        assert get_source_key(msg, 2) == "6f1c/2"
+
+    async def test_partitions(self, users_repository, workers):
+        xml = """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>Иван</ns2:Name>
+                    <ns2:Surname>Иванов</ns2:Surname>
+                    <ns2:Email>ivan.ivanov.{partition}@yandex.com</ns2:Email>
+                    <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+            </ns2:Request>
+        """
+        msgs = [
+            ConsumerRecord(
+                topic=settings.kafka.consume_topic,
+                partition=partition,
+                offset=28,
+                timestamp=1697655000970,
+                timestamp_type=0,
+                key=None,
+                value=xml.format(partition=partition).strip().encode(),
+                checksum=None,
+                serialized_key_size=-1,
+                serialized_value_size=350,
+                headers=(),
+            )
+            for partition in range(2)
+        ]
+        tps = {TopicPartition(settings.kafka.consume_topic, p) for p in range(3)}
+
+        await workers.on_partitions_assigned(tps)
+
+        assert workers.assignment == tps
+
+        await consume(Consumer(msgs), workers)
+
+        assert workers.assignment == frozenset()
+
+        for partition in range(2):
+            assert await users_repository.get(
+                User.email == f"ivan.ivanov.{partition}@yandex.com"
+            )
+
+    async def test_partitions_revoked(self, workers):
+        tps = {TopicPartition(settings.kafka.consume_topic, p) for p in range(3)}
+        revoked = {TopicPartition(settings.kafka.consume_topic, 0)}
+
+        await workers.on_partitions_assigned(tps)
+        await workers.on_partitions_revoked(revoked)
+
+        assert workers.assignment == tps - revoked
+
+        await workers.stop()
+
+    async def test_backpressure(self, users_repository, workers, monkeypatch):
+        xml = """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>Иван</ns2:Name>
+                    <ns2:Surname>Иванов</ns2:Surname>
+                    <ns2:Email>ivan.ivanov.{offset}@yandex.com</ns2:Email>
+                    <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+            </ns2:Request>
+        """
+        msgs = [
+            ConsumerRecord(
+                topic=settings.kafka.consume_topic,
+                partition=0,
+                offset=offset,
+                timestamp=1697655000970,
+                timestamp_type=0,
+                key=None,
+                value=xml.format(offset=offset).strip().encode(),
+                checksum=None,
+                serialized_key_size=-1,
+                serialized_value_size=350,
+                headers=(),
+            )
+            for offset in range(4)
+        ]
+        consumer = Consumer(msgs)
+        tp = TopicPartition(settings.kafka.consume_topic, 0)
+        write = STAGE_DURATION.labels("write")
+        writes = write.count
+        # каждая пачка - одно сообщение, очередь партиции - одна пачка
+        monkeypatch.setattr(settings.kafka, "batch_size", 1)
+        monkeypatch.setattr(settings.kafka, "worker_queue_size", 1)
+
+        with mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback:
+            await consume(consumer, workers)
+
+        assert consumer.paused and consumer.paused.count(tp) == len(consumer.paused)
+        assert consumer.resumed == consumer.paused
+        assert send_batch_feedback.call_count == 4
+        assert write.count == writes + 4
+
+        for stage in ("validate", "write", "feedback"):
+            assert STAGE_QUEUE_DEPTH.labels(stage).value == 0
+
+        for offset in range(4):
+            assert await users_repository.get(
+                User.email == f"ivan.ivanov.{offset}@yandex.com"
+            )
+
+
+class TestValidateMessages:
+    def test_process_pool(self):
+        xml = """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>Иван</ns2:Name>
+                    <ns2:Surname>Иванов</ns2:Surname>
+                    <ns2:Email>{email}</ns2:Email>
+                    <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+            </ns2:Request>
+        """
+        messages = [
+            ("users/0/1", xml.format(email="ivan.ivanov@yandex.com").encode()),
+            ("users/0/2", xml.format(email="NOT-EMAIL").encode()),
+            ("users/0/3", b"<ns2:Request"),
+        ]
+
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            create_data, failed, poisoned, duration = executor.submit(
+                validate_messages, messages
+            ).result()
+
+        assert [user_data["source_key"] for user_data in create_data] == ["users/0/1/0"]
+        assert [user_data["email"] for user_data in failed] == ["NOT-EMAIL"]
+        assert list(poisoned) == [2]
+        assert duration > 0
+
+
+class TestOffsetCommitter:
+    XML = """
+        <ns2:Request xmlns:ns2="urn://www.example.com">
+            <ns2:User>
+                <ns2:Name>Иван</ns2:Name>
+                <ns2:Surname>Иванов</ns2:Surname>
+                <ns2:Email>ivan.ivanov.{partition}.{offset}@yandex.com</ns2:Email>
+                <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+            </ns2:User>
+        </ns2:Request>
+    """
+
+    def make_records(self, partition, offsets):
+        return [
+            ConsumerRecord(
+                topic=settings.kafka.consume_topic,
+                partition=partition,
+                offset=offset,
+                timestamp=1697655000970,
+                timestamp_type=0,
+                key=None,
+                value=self.XML.format(partition=partition, offset=offset)
+                .strip()
+                .encode(),
+                checksum=None,
+                serialized_key_size=-1,
+                serialized_value_size=350,
+                headers=(),
+            )
+            for offset in offsets
+        ]
+
+    async def test_commit_after_write(self, session, users_repository):
+        msgs = self.make_records(0, range(10, 13)) + self.make_records(1, [5])
+        consumer = Consumer(msgs)
+        committer = OffsetCommitter(consumer)
+        workers = PartitionWorkers(
+            Producer(), lambda: session, max_concurrency=1, committer=committer
+        )
+
+        with mock.patch("app.kafka.send_batch_feedback"):
+            await consume(consumer, workers)
+
+        # все смещения зафиксированы одним запросом при остановке
+        assert consumer.committed == [
+            {
+                TopicPartition(settings.kafka.consume_topic, 0): 13,
+                TopicPartition(settings.kafka.consume_topic, 1): 6,
+            }
+        ]
+        assert await users_repository.get(User.email == "ivan.ivanov.0.12@yandex.com")
+
+    async def test_commit_every_messages(self, monkeypatch):
+        consumer = Consumer([])
+        committer = OffsetCommitter(consumer)
+        tp = TopicPartition(settings.kafka.consume_topic, 0)
+        monkeypatch.setattr(settings.kafka, "commit_interval_ms", 60_000)
+        monkeypatch.setattr(settings.kafka, "commit_messages", 3)
+        committer.start()
+
+        committer.mark(tp, 0, 1)
+        committer.mark(tp, 1, 1)
+        await asyncio.sleep(0)
+
+        assert consumer.committed == []
+
+        committer.mark(tp, 2, 1)
+        await asyncio.sleep(0.01)
+
+        assert consumer.committed == [{tp: 3}]
+
+        await committer.stop()
+
+        assert consumer.committed == [{tp: 3}]
+
+    async def test_commit_on_revoke(self, session):
+        consumer = Consumer(self.make_records(0, [7]) + self.make_records(1, [3]))
+        committer = OffsetCommitter(consumer)
+        workers = PartitionWorkers(
+            Producer(), lambda: session, max_concurrency=1, committer=committer
+        )
+        revoked = {TopicPartition(settings.kafka.consume_topic, 0)}
+
+        with mock.patch("app.kafka.send_batch_feedback"):
+            await workers.dispatch(await consumer.getmany(max_records=2), consumer)
+            await workers.on_partitions_revoked(revoked)
+
+            assert consumer.committed == [
+                {TopicPartition(settings.kafka.consume_topic, 0): 8}
+            ]
+
+            await workers.stop()
+
+        assert consumer.committed[-1] == {
+            TopicPartition(settings.kafka.consume_topic, 1): 4
+        }
+
+    async def test_not_committed_on_write_error(self, session):
+        consumer = Consumer(self.make_records(0, [7]))
+        committer = OffsetCommitter(consumer)
+        # сообщения не удалось ни записать, ни отложить в топик повторной обработки
+        producer = Producer()
+        producer.send_and_wait.side_effect = KafkaError
+        workers = PartitionWorkers(
+            producer, lambda: session, max_concurrency=1, committer=committer
+        )
+
+        with mock.patch("app.kafka.write_users", side_effect=RuntimeError):
+            await consume(consumer, workers)
+
+        assert consumer.committed == []
+
+    async def test_feedback_retried(self, session, monkeypatch):
+        monkeypatch.setattr(settings.kafka, "retry_backoff_ms", 0)
+        retries = FEEDBACK_RETRIES.labels().value
+        consumer = Consumer(self.make_records(0, [7]))
+        producer = Producer()
+        workers = PartitionWorkers(
+            producer,
+            lambda: session,
+            max_concurrency=1,
+            committer=OffsetCommitter(consumer),
+        )
+
+        with mock.patch(
+            "app.kafka.send_batch_feedback", side_effect=[KafkaError, None]
+        ) as send_batch_feedback:
+            await consume(consumer, workers)
+
+        assert send_batch_feedback.call_count == 2
+        assert FEEDBACK_RETRIES.labels().value == retries + 1
+        producer.send_and_wait.assert_not_called()
+        assert consumer.committed == [
+            {TopicPartition(settings.kafka.consume_topic, 0): 8}
+        ]
+
+    async def test_feedback_parked(self, session, monkeypatch):
+        monkeypatch.setattr(settings.kafka, "retry_backoff_ms", 0)
+        monkeypatch.setattr(settings.kafka, "feedback_retries", 1)
+        consumer = Consumer(self.make_records(0, [7]))
+        producer = Producer()
+        workers = PartitionWorkers(
+            producer,
+            lambda: session,
+            max_concurrency=1,
+            committer=OffsetCommitter(consumer),
+        )
+
+        with mock.patch(
+            "app.kafka.send_batch_feedback", side_effect=KafkaError
+        ) as send_batch_feedback:
+            await consume(consumer, workers)
+
+        # фидбек не доставлен, поэтому сообщение отложено в топик повторной обработки
+        assert send_batch_feedback.call_count == 2
+        assert [call.args[0] for call in producer.send_and_wait.call_args_list] == [
+            get_retry_topics()[0]
+        ]
+        assert consumer.committed == [
+            {TopicPartition(settings.kafka.consume_topic, 0): 8}
+        ]
+
+    async def test_feedback_not_idempotent(self, session, monkeypatch):
+        monkeypatch.setattr(settings.kafka, "idempotent", False)
+        monkeypatch.setattr(settings.kafka, "retry_backoff_ms", 1)
+        monkeypatch.setattr(settings.kafka, "feedback_retries", 0)
+        consumer = Consumer(self.make_records(0, [7]))
+        producer = Producer()
+        workers = PartitionWorkers(
+            producer,
+            lambda: session,
+            max_concurrency=1,
+            committer=OffsetCommitter(consumer),
+        )
+
+        tp = TopicPartition(settings.kafka.consume_topic, 0)
+
+        with mock.patch(
+            "app.kafka.send_batch_feedback", side_effect=[KafkaError] * 3 + [None]
+        ) as send_batch_feedback:
+            await workers.dispatch(await consumer.getmany(max_records=1), consumer)
+            # как при отзыве партиции: отправка фидбеков не останавливается
+            await workers.stop({tp})
+
+        # повторяется только отправка фидбека, сообщение не откладывается, иначе
+        # пользователь был бы записан второй раз
+        assert send_batch_feedback.call_count == 4
+        producer.send_and_wait.assert_not_called()
+        assert consumer.committed == [{tp: 8}]
+
+        await workers.stop()
+
+    async def test_feedback_not_idempotent_stopped(self, session, monkeypatch):
+        monkeypatch.setattr(settings.kafka, "idempotent", False)
+        monkeypatch.setattr(settings.kafka, "retry_backoff_ms", 1)
+        consumer = Consumer(self.make_records(0, [7]))
+        producer = Producer()
+        workers = PartitionWorkers(
+            producer,
+            lambda: session,
+            max_concurrency=1,
+            committer=OffsetCommitter(consumer),
+        )
+
+        with mock.patch("app.kafka.send_batch_feedback", side_effect=KafkaError):
+            await asyncio.wait_for(consume(consumer, workers), 1)
+
+        producer.send_and_wait.assert_not_called()
+        assert consumer.committed == []
+
+    async def test_not_committed_on_feedback_error(self, session, monkeypatch):
+        monkeypatch.setattr(settings.kafka, "retry_backoff_ms", 0)
+        consumer = Consumer(self.make_records(0, [7]))
+        # фидбек не удалось ни отправить, ни отложить сообщение
+        producer = Producer()
+        producer.send_and_wait.side_effect = KafkaError
+        workers = PartitionWorkers(
+            producer,
+            lambda: session,
+            max_concurrency=1,
+            committer=OffsetCommitter(consumer),
+        )
+
+        with mock.patch("app.kafka.send_batch_feedback", side_effect=KafkaError):
+            await consume(consumer, workers)
+
+        assert consumer.committed == []
+
+    async def rewind(self, workers, consumer, committer):
+        """Обрабатывает сообщения по одному, пока партиция не будет перемотана."""
+
+        for _ in range(2):
+            await workers.dispatch(await consumer.getmany(max_records=1), consumer)
+
+        for _ in range(100):
+            await workers.dispatch({}, consumer)
+
+            if consumer.seeks:
+                break
+
+            await asyncio.sleep(0.01)
+
+        await committer.commit()
+
+    async def test_rewind_on_write_error(self, session):
+        consumer = Consumer(self.make_records(0, [7, 8]))
+        committer = OffsetCommitter(consumer)
+        tp = TopicPartition(settings.kafka.consume_topic, 0)
+        # сообщение 7 не удалось ни записать, ни отложить в топик повторной обработки
+        producer = Producer()
+        producer.send_and_wait.side_effect = KafkaError
+        workers = PartitionWorkers(
+            producer, lambda: session, max_concurrency=1, committer=committer
+        )
+
+        with (
+            mock.patch(
+                "app.kafka.write_users",
+                side_effect=[RuntimeError, ([1], []), ([2, 3], [])],
+            ),
+            mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback,
+            mock.patch.object(committer, "mark", wraps=committer.mark) as mark,
+        ):
+            await self.rewind(workers, consumer, committer)
+
+            # записанное сообщение 8 не сдвигает смещение дальше незаписанного 7
+            assert consumer.seeks == [(tp, 7)]
+            assert consumer.committed == []
+            mark.assert_not_called()
+
+            await workers.dispatch(await consumer.getmany(max_records=2), consumer)
+            await workers.stop()
+
+        mark.assert_called_once_with(tp, 8, 2)
+        send_batch_feedback.assert_called_once_with(producer, [1], [], [])
+        assert consumer.committed == [{tp: 9}]
+
+    async def test_rewind_on_feedback_error(self, session, monkeypatch):
+        monkeypatch.setattr(settings.kafka, "feedback_retries", 0)
+        consumer = Consumer(self.make_records(0, [7, 8]))
+        committer = OffsetCommitter(consumer)
+        tp = TopicPartition(settings.kafka.consume_topic, 0)
+        # фидбек по сообщению 7 не удалось ни отправить, ни отложить
+        producer = Producer()
+        producer.send_and_wait.side_effect = KafkaError
+        workers = PartitionWorkers(
+            producer, lambda: session, max_concurrency=1, committer=committer
+        )
+
+        with (
+            mock.patch("app.kafka.write_users", return_value=([1], [])),
+            mock.patch(
+                "app.kafka.send_batch_feedback", side_effect=[KafkaError, None]
+            ) as send_batch_feedback,
+            mock.patch.object(committer, "mark", wraps=committer.mark) as mark,
+        ):
+            await self.rewind(workers, consumer, committer)
+            await workers.dispatch(await consumer.getmany(max_records=2), consumer)
+            await workers.stop()
+
+        # фидбек по сообщению 8, полученному до перемотки, не отправлялся
+        assert consumer.seeks == [(tp, 7)]
+        assert send_batch_feedback.call_count == 2
+        mark.assert_called_once_with(tp, 8, 2)
+        assert consumer.committed == [{tp: 9}]
+
+
+class TestRedelivery:
+    XML = """
+        <ns2:Request xmlns:ns2="urn://www.example.com">
+            <ns2:User>
+                <ns2:Name>Иван</ns2:Name>
+                <ns2:Surname>Иванов</ns2:Surname>
+                <ns2:Email>ivan.ivanov.{offset}@yandex.com</ns2:Email>
+                <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+            </ns2:User>
+        </ns2:Request>
+    """
+
+    def setup_method(self):
+        self.producer = Producer()
+
+    @pytest.fixture
+    def workers(self, session, monkeypatch):
+        monkeypatch.setattr(settings.kafka, "retry_backoff_ms", 0)
+
+        return PartitionWorkers(self.producer, lambda: session, max_concurrency=1)
+
+    def make_record(self, offset, topic=None, value=None, timestamp=1697655000970):
+        if value is None:
+            value = self.XML.format(offset=offset).strip().encode()
+
+        return ConsumerRecord(
+            topic=topic or settings.kafka.consume_topic,
+            partition=0,
+            offset=offset,
+            timestamp=timestamp,
+            timestamp_type=0,
+            key=None,
+            value=value,
+            checksum=None,
+            serialized_key_size=-1,
+            serialized_value_size=len(value),
+            headers=(),
+        )
+
+    def sent(self, topic):
+        return [
+            call
+            for call in self.producer.send_and_wait.call_args_list
+            if call.args[0] == topic
+        ]
+
+    def test_transient_errors(self):
+        deadlock = Exception()
+        deadlock.sqlstate = "40P01"
+        unique = Exception()
+        unique.sqlstate = "23505"
+
+        assert is_transient_error(sqlalchemy.exc.TimeoutError())
+        assert is_transient_error(ConnectionResetError())
+        assert is_transient_error(sqlalchemy.exc.DBAPIError("insert", {}, deadlock))
+        assert not is_transient_error(sqlalchemy.exc.DBAPIError("insert", {}, unique))
+        assert not is_transient_error(RuntimeError())
+
+    async def test_write_retried(self, users_repository, workers):
+        retries = WRITE_RETRIES.labels().value
+        error = sqlalchemy.exc.TimeoutError()
+
+        with (
+            mock.patch("app.kafka.write_users", side_effect=[error, ([1], [])]),
+            mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback,
+        ):
+            await consume(Consumer([self.make_record(1)]), workers)
+
+        assert WRITE_RETRIES.labels().value == retries + 1
+        send_batch_feedback.assert_called_once_with(self.producer, [1], [], [])
+        self.producer.send_and_wait.assert_not_called()
+
+    async def test_parked_on_retry_topic(self, session, monkeypatch):
+        retried = RETRIED_MESSAGES.labels("1").value
+        consumer = Consumer([self.make_record(1), self.make_record(2)])
+        workers = PartitionWorkers(
+            self.producer,
+            lambda: session,
+            max_concurrency=1,
+            committer=OffsetCommitter(consumer),
+        )
+
+        with (
+            mock.patch("app.kafka.write_users", side_effect=RuntimeError("constraint")),
+            mock.patch("app.kafka.send_batch_feedback") as send_batch_feedback,
+        ):
+            await consume(consumer, workers)
+
+        calls = self.sent(get_retry_topics()[0])
+        headers = dict(calls[0].kwargs["headers"])
+
+        assert len(calls) == 2
+        assert RETRIED_MESSAGES.labels("1").value == retried + 2
+        assert headers["message-id"] == b"users/0/1"
+        assert headers["original-offset"] == b"1"
+        assert b"constraint" in headers["error"]
+        send_batch_feedback.assert_not_called()
+        # отложенные сообщения больше не задерживают партицию
+        assert consumer.committed == [
+            {TopicPartition(settings.kafka.consume_topic, 0): 3}
+        ]
+
+    async def test_retry_topic_processed(self, users_repository, workers):
+        # сообщение из топика повторной обработки, задержка которого давно истекла
+        record = self.make_record(1, topic=get_retry_topics()[0])
+        record.headers = (("message-id", b"users/0/28"),)
+
+        with mock.patch("app.kafka.send_batch_feedback"):
+            await consume(Consumer([record]), workers)
+
+        user = await users_repository.get(User.email == "ivan.ivanov.1@yandex.com")
+
+        assert user.source_key == "users/0/28/0"
+
+    async def test_dead_letter_after_last_tier(self, workers):
+        dead_letters = DEAD_LETTERS.labels("write").value
+        record = self.make_record(1, topic=get_retry_topics()[-1])
+
+        with mock.patch("app.kafka.write_users", side_effect=RuntimeError):
+            await consume(Consumer([record]), workers)
+
+        calls = self.sent(settings.kafka.dlq_topic)
+        headers = dict(calls[0].kwargs["headers"])
+
+        assert len(calls) == 1
+        assert headers["error-reason"] == b"write"
+        assert DEAD_LETTERS.labels("write").value == dead_letters + 1
+
+    async def test_poison_message(self, users_repository, workers):
+        dead_letters = DEAD_LETTERS.labels("parse").value
+        msgs = [
+            self.make_record(1),
+            self.make_record(2, value=b"<ns2:Request"),
+            self.make_record(3),
+        ]
+
+        with mock.patch("app.kafka.send_batch_feedback"):
+            await consume(Consumer(msgs), workers)
+
+        calls = self.sent(settings.kafka.dlq_topic)
+
+        assert [call.args[1] for call in calls] == [b"<ns2:Request"]
+        assert dict(calls[0].kwargs["headers"])["error-reason"] == b"parse"
+        assert DEAD_LETTERS.labels("parse").value == dead_letters + 1
+
+        for offset in (1, 3):
+            assert await users_repository.get(
+                User.email == f"ivan.ivanov.{offset}@yandex.com"
+            )
+
+    async def test_delay_interrupted_on_stop(self, session):
+        consumer = Consumer([])
+        workers = PartitionWorkers(
+            self.producer,
+            lambda: session,
+            max_concurrency=1,
+            committer=OffsetCommitter(consumer),
+        )
+        record = self.make_record(
+            1, topic=get_retry_topics()[-1], timestamp=int(time.time() * 1000)
+        )
+
+        await workers.dispatch(
+            {TopicPartition(record.topic, record.partition): [record]}
+        )
+        await asyncio.wait_for(workers.stop(), 1)
+
+        assert consumer.committed == []
@@ -0,0 +1,146 @@
+import asyncio
+from unittest import mock
+
+import pytest
+from pydantic_core import ValidationError
+from starlette import status
+
+from app.config import settings
+from app.feedback import render_batch
+from app.kafka import MESSAGE_ID_HEADER, KafkaUser
+from app.loadgen import (
+    IngestionReport,
+    LoadRun,
+    get_user_seq,
+    parse_feedback,
+    percentile,
+    produce,
+)
+from app.parsers import parse
+
+
+class Producer:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, topic, value, headers=None):
+        self.sent.append((topic, value, headers))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+
+        return future
+
+
+class TestProduce:
+    async def test_users(self):
+        producer = Producer()
+
+        run = await produce(
+            producer, "users", 50, invalid_ratio=0.3, users_per_message=2, seed=1
+        )
+
+        assert run.messages == len(producer.sent) == 50
+        assert run.users == 100
+        assert 0 < len(run.invalid) < 100
+
+        for number, (topic, value, headers) in enumerate(producer.sent):
+            assert topic == "users"
+            assert headers == [
+                (MESSAGE_ID_HEADER, f"loadgen-{run.run_id}-{number}".encode())
+            ]
+
+            for user_data in parse(value):
+                seq = get_user_seq(run.run_id, user_data["email"])
+
+                if seq in run.invalid:
+                    with pytest.raises(ValidationError):
+                        KafkaUser(**user_data)
+                else:
+                    KafkaUser(**user_data)
+
+    async def test_seed(self):
+        first = await produce(Producer(), "users", 10, invalid_ratio=0.5, seed=1)
+        second = await produce(Producer(), "users", 10, invalid_ratio=0.5, seed=1)
+
+        assert first.invalid == second.invalid
+
+    async def test_endpoint(self, client):
+        with mock.patch("app.main.producer", Producer()) as producer:
+            resp = await client.get("/produce?count=20&invalid_ratio=1")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.json() == {
+            "run_id": mock.ANY,
+            "messages": 20,
+            "users": 20,
+            "invalid": 20,
+        }
+        assert {topic for topic, _, _ in producer.sent} == {
+            settings.kafka.consume_topic
+        }
+
+    async def test_endpoint_validation(self, client):
+        resp = await client.get("/produce?invalid_ratio=2")
+
+        assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+class TestIngestionReport:
+    def setup_method(self):
+        self.run = LoadRun("abc")
+        self.run.started_at = 0
+        self.run.finished_at = 1
+        self.run.messages = 3
+        self.run.sent_at = {0: 0.0, 1: 0.5, 2: 1.0}
+        self.run.invalid = {2}
+
+    def test_report(self):
+        report = IngestionReport(self.run)
+
+        # фидбек обогнал опрос БД
+        report.add_feedback(render_batch([10], []), 2.0)
+        report.add_rows(
+            [(10, "loadgen-abc-0@loadgen.example.com"), (7, "other@yandex.ru")], 1.5
+        )
+        report.add_rows([(11, "loadgen-abc-1@loadgen.example.com")], 2.5)
+
+        assert not report.done
+
+        report.add_feedback(
+            render_batch(
+                [11, 12], [{"name": "", "email": "loadgen-abc-2.loadgen.example.com"}]
+            ),
+            3.0,
+        )
+
+        assert report.done
+        assert report.stored_at == {0: 1.5, 1: 2.5}
+        assert report.feedback_at == {0: 2.0, 1: 3.0, 2: 3.0}
+
+        summary = report.summary()
+        assert "строки в БД: 2 из 2" in summary
+        assert "фидбеки: 3 из 3" in summary
+
+    def test_parse_feedback(self):
+        msg = render_batch([1], [{"email": "a@b.c"}], [2])
+
+        assert list(parse_feedback(msg)) == [
+            ("SUCCESS", 1, None),
+            ("EXISTS", 2, None),
+            ("FAILED", None, "a@b.c"),
+        ]
+
+    def test_get_user_seq(self):
+        assert get_user_seq("abc", "loadgen-abc-12@loadgen.example.com") == 12
+        assert get_user_seq("abc", "loadgen-abc-12.loadgen.example.com") == 12
+        assert get_user_seq("abc", "loadgen-def-12@loadgen.example.com") is None
+        assert get_user_seq("abc", None) is None
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([5], 90) == 5
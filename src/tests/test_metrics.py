@@ -0,0 +1,117 @@
+import pytest
+from starlette import status
+
+from app.main import app
+from app.metrics import (
+    DB_QUERY_DURATION,
+    HTTP_REQUEST_DURATION,
+    USE_CASE_DURATION,
+    Counter,
+    Histogram,
+    HistogramValue,
+    Metric,
+    Registry,
+    instrument_engine,
+    timed,
+)
+from app.middleware import RequestMiddleware
+
+
+class TestHistogramValue:
+    def test_cumulative(self):
+        histogram = HistogramValue(buckets=(0.1, 1))
+
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value)
+
+        assert histogram.cumulative() == [(0.1, 2), (1, 3), (float("inf"), 4)]
+        assert histogram.count == 4
+        assert histogram.sum == pytest.approx(5.65)
+
+
+class TestRegistry:
+    def test_render(self):
+        registry = Registry()
+        counter = registry.register(Counter("requests", "Запросы", ("path",)))
+        histogram = registry.register(
+            Histogram("latency_seconds", "Длительность", buckets=(0.1,))
+        )
+        registry.add_collector(lambda: [Counter("empty", "Пустая")])
+
+        counter.labels('/"users"').inc()
+        counter.labels('/"users"').inc(2)
+        histogram.observe(0.05)
+
+        assert registry.render() == (
+            "# HELP requests Запросы\n"
+            "# TYPE requests counter\n"
+            'requests{path="/\\"users\\""} 3\n'
+            "# HELP latency_seconds Длительность\n"
+            "# TYPE latency_seconds histogram\n"
+            'latency_seconds_bucket{le="0.1"} 1\n'
+            'latency_seconds_bucket{le="+Inf"} 1\n'
+            "latency_seconds_sum 0.05\n"
+            "latency_seconds_count 1\n"
+            "# HELP empty Пустая\n"
+            "# TYPE empty counter\n"
+        )
+
+    def test_labels_mismatch(self):
+        with pytest.raises(ValueError):
+            Counter("requests", "Запросы", ("path",)).labels()
+
+    def test_abstract_metric(self):
+        with pytest.raises(TypeError):
+            Metric("requests", "Запросы")
+
+
+class TestTimed:
+    async def test_outcome(self):
+        @timed
+        async def use_case(fail: bool):
+            if fail:
+                raise ValueError
+
+        name = use_case.__qualname__
+        await use_case(False)
+
+        with pytest.raises(ValueError):
+            await use_case(True)
+
+        assert USE_CASE_DURATION.labels(name, "success").count == 1
+        assert USE_CASE_DURATION.labels(name, "error").count == 1
+
+
+class TestMetricsEndpoint:
+    async def test_metrics(self, client, engine):
+        instrument_engine(engine)
+        http = HTTP_REQUEST_DURATION.labels("GET", "/users/{user_id}", "404")
+        use_case = USE_CASE_DURATION.labels("GetUserUseCase.get_user_or_404", "error")
+        select = DB_QUERY_DURATION.labels("SELECT")
+        counts = http.count, use_case.count, select.count
+
+        resp = await client.get("/users/0")
+
+        assert resp.status_code == status.HTTP_404_NOT_FOUND
+        assert (http.count, use_case.count, select.count) == (
+            counts[0] + 1,
+            counts[1] + 1,
+            counts[2] + 1,
+        )
+
+        resp = await client.get("/metrics")
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert resp.headers["content-type"].startswith("text/plain")
+        assert (
+            'http_request_duration_seconds_count{method="GET",'
+            'route="/users/{user_id}",status="404"}' in resp.text
+        )
+        assert "http_requests_in_flight 1" in resp.text
+        assert "db_pool_size" in resp.text
+
+    def test_single_middleware(self):
+        # метрики, профилирование и телеметрия пула - один слой middleware
+        assert [middleware.cls for middleware in app.user_middleware] == [
+            RequestMiddleware
+        ]
@@ -0,0 +1,98 @@
+import itertools
+import tracemalloc
+
+import pytest
+
+from app.parsers import ParseError, iter_users, parse
+
+
+class TestParse:
+    """Тестирование функции parse."""
+
+    def test_users(self):
+        xml = """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>Иван</ns2:Name>
+                    <ns2:Surname>Иванов</ns2:Surname>
+                    <ns2:Email>ivan.ivanov@yandex.com</ns2:Email>
+                    <ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+                <ns2:User>
+                    <ns2:Name>Петр</ns2:Name>
+                    <ns2:Surname></ns2:Surname>
+                    <ns2:Email>petr.petrov@yandex.com</ns2:Email>
+                    <ns2:Birthday>2006-10-23T04:00:00+03:00</ns2:Birthday>
+                </ns2:User>
+            </ns2:Request>
+        """
+
+        assert parse(xml.strip().encode()) == [
+            {
+                "name": "Иван",
+                "surname": "Иванов",
+                "email": "ivan.ivanov@yandex.com",
+                "birthday": "2005-10-23T04:00:00+03:00",
+            },
+            {
+                "name": "Петр",
+                "surname": "",
+                "email": "petr.petrov@yandex.com",
+                "birthday": "2006-10-23T04:00:00+03:00",
+            },
+        ]
+
+    @pytest.mark.parametrize(
+        "xml",
+        [
+            "NOT-XML",
+            '<ns2:Request xmlns:ns2="urn://www.example.com"><ns2:User>',
+            """
+            <ns2:Request xmlns:ns2="urn://www.example.com">
+                <ns2:User>
+                    <ns2:Name>Иван</ns2:Name>
+                    <ns2:Email>ivan.ivanov@yandex.com</ns2:Email>
+                </ns2:User>
+            </ns2:Request>
+            """,
+        ],
+    )
+    def test_parse_error(self, xml):
+        with pytest.raises(ParseError):
+            parse(xml.strip().encode())
+
+
+class TestIterUsers:
+    USER = (
+        "<ns2:User><ns2:Name>Иван</ns2:Name><ns2:Surname>Иванов</ns2:Surname>"
+        "<ns2:Email>ivan.ivanov@yandex.com</ns2:Email>"
+        "<ns2:Birthday>2005-10-23T04:00:00+03:00</ns2:Birthday></ns2:User>"
+    ).encode()
+
+    def chunks(self, count):
+        yield b'<ns2:Request xmlns:ns2="urn://www.example.com">'
+        yield from itertools.repeat(self.USER, count)
+        yield b"</ns2:Request>"
+
+    def test_memory(self):
+        tracemalloc.start()
+
+        try:
+            count = sum(1 for _ in iter_users(self.chunks(20_000)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # разобранные пользователи не накапливаются в корне документа (~80 байт на
+        # пользователя, если их не удалять)
+        assert count == 20_000
+        assert peak < 256 * 1024
+
+    def test_partial(self):
+        xml = (
+            '<ns2:Request xmlns:ns2="urn://www.example.com">'
+            "<ns2:User><ns2:Name>Петр</ns2:Name></ns2:User>"
+            "</ns2:Request>"
+        )
+
+        assert list(iter_users([xml.encode()], partial=True)) == [{"name": "Петр"}]
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+from sqlalchemy import URL, text
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.config import settings
+from app.pool import TelemetryPool, pool_holder, pool_telemetry
+
+
+class TestPoolTelemetry:
+    @pytest.fixture
+    async def telemetry_engine(self, database):
+        url = URL.create(
+            drivername=settings.db.drivername,
+            host=settings.db.host,
+            port=settings.db.port,
+            username=settings.db.username,
+            password=settings.db.password,
+            database=database,
+        )
+        engine_ = create_async_engine(
+            url,
+            poolclass=TelemetryPool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=0.1,
+        )
+        pool_telemetry.clear()
+        pool_telemetry.instrument(engine_, max_overflow=0)
+        yield engine_
+        await engine_.dispose()
+        pool_telemetry.clear()
+
+    async def test_stats(self, telemetry_engine):
+        async def hold(holder: str, seconds: float):
+            pool_holder.set(holder)
+
+            async with telemetry_engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+                await asyncio.sleep(seconds)
+
+        await asyncio.gather(hold("slow", 0.05), hold("fast", 0))
+
+        stats = pool_telemetry.stats(telemetry_engine.pool)
+
+        assert stats["size"] == 1
+        assert stats["max_overflow"] == 0
+        assert stats["checked_out"] == 0
+        assert stats["wait_time"]["count"] == 2
+        assert stats["hold_time"]["count"] == 2
+        # второй ждал, пока первый вернет единственное соединение
+        assert stats["wait_time"]["sum"] >= 0.05
+        assert stats["slowest_holds"][0]["holder"] == "slow"
+        assert stats["slowest_holds"][0]["duration"] >= 0.05
+
+    async def test_timeout(self, telemetry_engine):
+        async with telemetry_engine.connect():
+            with pytest.raises(TimeoutError):
+                async with telemetry_engine.connect():
+                    pass
+
+            assert pool_telemetry.stats(telemetry_engine.pool)["checked_out"] == 1
+
+        assert pool_telemetry.timeouts == 1
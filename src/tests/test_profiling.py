@@ -0,0 +1,99 @@
+import json
+from unittest import mock
+
+import pytest
+from starlette import status
+
+from app.config import settings
+from app.profiling import (
+    PROFILE_HEADER,
+    RequestProfile,
+    current_profile,
+    profile_engine,
+)
+
+
+class TestRequestProfile:
+    def test_repeated(self):
+        profile = RequestProfile("GET /users")
+        profile.queries = [
+            ("SELECT users", 0.1),
+            ("SELECT cars WHERE user_id = $1", 0.2),
+            ("SELECT cars WHERE user_id = $1", 0.3),
+        ]
+
+        assert profile.db_time == pytest.approx(0.6)
+        assert profile.repeated(2) == {"SELECT cars WHERE user_id = $1": 2}
+        assert profile.repeated(3) == {}
+
+
+class TestProfilingMiddleware:
+    @pytest.fixture(autouse=True)
+    def profiling(self, engine, monkeypatch, tmp_path):
+        profile_engine(engine)
+        monkeypatch.setattr(settings.profiling, "enabled", True)
+        monkeypatch.setattr(settings.profiling, "directory", str(tmp_path))
+
+    @pytest.fixture
+    async def user_ids(self, create_users):
+        return await create_users(3)
+
+    async def test_header(self, client, user_ids, tmp_path):
+        resp = await client.get("/users", headers={PROFILE_HEADER: "1"})
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert int(resp.headers["X-Query-Count"]) >= 1
+        assert float(resp.headers["X-DB-Time-ms"]) > 0
+
+        name = resp.headers["X-Profile-Name"]
+        assert (tmp_path / f"{name}.prof").exists()
+
+        with open(tmp_path / f"{name}.sql.json") as file:
+            profile = json.load(file)
+
+        assert profile["name"] == "GET /users"
+        assert profile["query_count"] == int(resp.headers["X-Query-Count"])
+        assert any("FROM users" in q["statement"] for q in profile["queries"])
+
+    async def test_streaming(self, client, user_ids):
+        resp = await client.get("/users/export", headers={PROFILE_HEADER: "1"})
+
+        assert resp.status_code == status.HTTP_200_OK
+        assert len(resp.text.splitlines()) == len(user_ids)
+        assert "X-Query-Count" in resp.headers
+        # после ответа запросы теста не профилируются
+        assert current_profile.get() is None
+
+    async def test_not_profiled(self, client, tmp_path):
+        resp = await client.get("/users")
+
+        assert "X-Query-Count" not in resp.headers
+        assert list(tmp_path.iterdir()) == []
+
+    async def test_disabled(self, client, monkeypatch):
+        monkeypatch.setattr(settings.profiling, "enabled", False)
+
+        resp = await client.get("/users", headers={PROFILE_HEADER: "1"})
+
+        assert "X-Query-Count" not in resp.headers
+
+    async def test_sample_rate(self, client, monkeypatch):
+        monkeypatch.setattr(settings.profiling, "sample_rate", 1)
+
+        resp = await client.get("/users")
+
+        assert "X-Query-Count" in resp.headers
+
+    async def test_repeated_queries(self, client, user_ids, monkeypatch):
+        with mock.patch("app.profiling.LOGGER") as logger:
+            await client.get("/users", headers={PROFILE_HEADER: "1"})
+
+        logger.warning.assert_not_called()
+
+        monkeypatch.setattr(settings.profiling, "repeated_queries", 1)
+
+        with mock.patch("app.profiling.LOGGER") as logger:
+            await client.get("/users", headers={PROFILE_HEADER: "1"})
+
+        msg = logger.warning.call_args_list[0].args[0]
+        assert msg.startswith("GET /users: SQL-запрос выполнен 1 раз, возможно N+1")
@@ -0,0 +1,44 @@
+import threading
+import time
+
+from app.worker import Supervisor
+
+
+def crash():
+    raise SystemExit(1)
+
+
+def sleep():
+    time.sleep(60)
+
+
+def wait_for(condition, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+class TestSupervisor:
+    def test_restart(self):
+        supervisor = Supervisor(1, restart_delay=0, target=crash)
+        thread = threading.Thread(target=supervisor.run)
+        thread.start()
+
+        wait_for(lambda: supervisor.restarts >= 2)
+        supervisor.stop()
+        thread.join()
+
+    def test_stop(self):
+        supervisor = Supervisor(2, target=sleep)
+        thread = threading.Thread(target=supervisor.run)
+        thread.start()
+
+        wait_for(lambda: len(supervisor._workers) == 2)
+        workers = list(supervisor._workers.values())
+        supervisor.stop()
+        thread.join()
+
+        assert supervisor.restarts == 0
+        assert all(not worker.is_alive() for worker in workers)